@@ -59,9 +59,12 @@ if "bpy" in locals():
     imp.reload(utils)
     imp.reload(material_utils)
     imp.reload(desc)
+    imp.reload(geometry_cache)
+    imp.reload(rc)
+    imp.reload(texture_manifest)
 else:
     import bpy
-    from io_bcry_exporter import export, export_animations, exceptions, udp, utils, material_utils, desc
+    from io_bcry_exporter import export, export_animations, exceptions, udp, utils, material_utils, desc, geometry_cache, rc, texture_manifest
 
 from bpy.props import BoolProperty, EnumProperty, FloatVectorProperty, \
     FloatProperty, IntProperty, StringProperty, BoolVectorProperty
@@ -168,6 +171,124 @@ for textures in .mtl file.'''
         return ExportHelper.invoke(self, context, event)
 
 
+class EditExportSettings(bpy.types.Operator):
+    '''Edit settings of the geometry cache and the resource compiler.'''
+
+    bl_label = "Export Settings"
+    bl_idname = "config.edit_export_settings"
+
+    geometry_cache_size = IntProperty(
+        name="Geometry Cache Size",
+        description="Maximum size of cached geometries in megabytes",
+        default=256,
+        min=1,
+    )
+    rc_max_jobs = IntProperty(
+        name="RC Jobs",
+        description="Maximum number of resource compiler processes "
+        "running at the same time",
+        default=1,
+        min=1,
+    )
+    rc_batch_size = IntProperty(
+        name="RC Batch Size",
+        description="Maximum number of files which are processed by one "
+        "resource compiler invocation",
+        default=16,
+        min=1,
+    )
+    rc_batch_delay = FloatProperty(
+        name="RC Batch Delay",
+        description="Seconds to wait for more files before a batch is "
+        "passed to the resource compiler",
+        default=0.5,
+        min=0.0,
+    )
+
+    def execute(self, context):
+        Configuration.geometry_cache_size = self.geometry_cache_size
+        Configuration.rc_max_jobs = self.rc_max_jobs
+        Configuration.rc_batch_size = self.rc_batch_size
+        Configuration.rc_batch_delay = self.rc_batch_delay
+        bcPrint("Geometry cache size: {} MB.".format(
+            Configuration.geometry_cache_size),
+            'debug')
+        bcPrint("RC jobs: {}, batches of {} files after {} seconds.".format(
+            Configuration.rc_max_jobs, Configuration.rc_batch_size,
+            Configuration.rc_batch_delay),
+            'debug')
+
+        return {'FINISHED'}
+
+    def invoke(self, context, event):
+        self.geometry_cache_size = Configuration.geometry_cache_size
+        self.rc_max_jobs = Configuration.rc_max_jobs
+        self.rc_batch_size = Configuration.rc_batch_size
+        self.rc_batch_delay = Configuration.rc_batch_delay
+
+        return context.window_manager.invoke_props_dialog(self)
+
+
+class ClearGeometryCache(bpy.types.Operator):
+    '''Removes all cached geometries of earlier exports.'''
+
+    bl_label = "Clear Geometry Cache"
+    bl_idname = "config.clear_geometry_cache"
+
+    def execute(self, context):
+        geometry_cache.clear_cache(Configuration.geometry_cache_dir)
+        self.report({'INFO'}, "Geometry cache has been cleared.")
+
+        return {'FINISHED'}
+
+
+class PruneTextureManifest(bpy.types.Operator):
+    '''Removes outdated entries of converted textures from the manifest in the game directory.'''
+
+    bl_label = "Prune Texture Manifest"
+    bl_idname = "config.prune_texture_manifest"
+
+    def execute(self, context):
+        if not os.path.isdir(Configuration.game_dir):
+            self.report({'ERROR'}, "No game directory found.")
+            return {'FINISHED'}
+
+        texture_manifest.TextureManifest(Configuration.game_dir).prune()
+        self.report({'INFO'}, "Texture manifest has been pruned.")
+
+        return {'FINISHED'}
+
+
+class RebuildTextureManifest(bpy.types.Operator):
+    '''Clears the manifest of converted textures, all textures are converted again on the next export.'''
+
+    bl_label = "Rebuild Texture Manifest"
+    bl_idname = "config.rebuild_texture_manifest"
+
+    def execute(self, context):
+        if not os.path.isdir(Configuration.game_dir):
+            self.report({'ERROR'}, "No game directory found.")
+            return {'FINISHED'}
+
+        texture_manifest.TextureManifest(Configuration.game_dir).rebuild()
+        self.report({'INFO'}, "Texture manifest has been cleared.")
+
+        return {'FINISHED'}
+
+
+class CancelRCJobs(bpy.types.Operator):
+    '''Stops running resource compiler processes and drops queued ones.'''
+
+    bl_label = "Cancel RC Jobs"
+    bl_idname = "config.cancel_rc_jobs"
+
+    def execute(self, context):
+        rc.cancel_rc_jobs()
+        self.report({'INFO'}, "RC jobs have been cancelled.")
+
+        return {'FINISHED'}
+
+
 class SaveBCryConfiguration(bpy.types.Operator):
     '''operator: Saves current BCry Exporter configuration.'''
     bl_label = "Save Config File"
@@ -1063,16 +1184,25 @@ class GenerateMaterials(bpy.types.Operator, ExportHelper):
             setattr(self, 'rc_path', Configuration.rc_path)
             setattr(self, 'texture_rc_path', Configuration.texture_rc_path)
             setattr(self, 'game_dir', Configuration.game_dir)
+            setattr(self, 'rc_max_jobs', Configuration.rc_max_jobs)
+            setattr(self, 'rc_batch_size', Configuration.rc_batch_size)
+            setattr(self, 'rc_batch_delay', Configuration.rc_batch_delay)
 
     def execute(self, context):
         bcPrint(Configuration.rc_path, 'debug')
         try:
             config = GenerateMaterials.Config(config=self)
 
-            material_utils.generate_mtl_files(config)
+            conversion = material_utils.generate_mtl_files(config)
+            # Blender exits after a background run, so RC has to finish.
+            if conversion is not None and bpy.app.background:
+                rc.wait_for_conversions([conversion])
 
         except exceptions.BCryException as exception:
             bcPrint(exception.what(), 'error')
+            # There is no window to show the error in background mode.
+            if bpy.app.background:
+                raise
             bpy.ops.screen.display_error(
                 'INVOKE_DEFAULT', message=exception.what())
 
@@ -2867,6 +2997,16 @@ class Export(bpy.types.Operator, ExportHelper):
         description="Use custom normals.",
         default=False,
     )
+    use_geometry_cache = BoolProperty(
+        name="Use Geometry Cache",
+        description="Reuse geometries of unchanged objects from earlier exports.",
+        default=True,
+    )
+    incremental_export = BoolProperty(
+        name="Incremental Export",
+        description="Only export nodes which have changed since the last export.",
+        default=False,
+    )
     vcloth_pre_process = BoolProperty(
         name="VCloth Pre-Process",
         description="Export skin as simulating mesh for VCloth V2.",
@@ -2927,6 +3067,20 @@ class Export(bpy.types.Operator, ExportHelper):
         description="Select only if you want to profile BCry Exporter.",
         default=False,
     )
+    export_timings = BoolProperty(
+        name="Export Timings",
+        description="Writes timings of export stages next to the DAE file.",
+        default=False,
+    )
+    export_memory = BoolProperty(
+        name="Export Memory",
+        description="Writes peak memory of export stages and top allocation "
+                    "sites next to the DAE file. Slows the export down.",
+        default=False,
+    )
+    # Set by batch_export for sharded exports of a single scene.
+    shard_index = IntProperty(default=0, min=0, options={'HIDDEN'})
+    shard_count = IntProperty(default=1, min=1, options={'HIDDEN'})
 
     is_animation_process = False
 
@@ -2939,6 +3093,8 @@ class Export(bpy.types.Operator, ExportHelper):
                 'merge_all_nodes',
                 'export_selected_nodes',
                 'custom_normals',
+                'use_geometry_cache',
+                'incremental_export',
                 'vcloth_pre_process',
                 'generate_materials',
                 'convert_textures',
@@ -2951,7 +3107,11 @@ class Export(bpy.types.Operator, ExportHelper):
                 'save_dae',
                 'save_tiffs',
                 'run_in_profiler',
-                'is_animation_process'
+                'export_timings',
+                'export_memory',
+                'is_animation_process',
+                'shard_index',
+                'shard_count'
             )
 
             for attribute in attributes:
@@ -2961,6 +3121,13 @@ class Export(bpy.types.Operator, ExportHelper):
             setattr(self, 'rc_path', Configuration.rc_path)
             setattr(self, 'texture_rc_path', Configuration.texture_rc_path)
             setattr(self, 'game_dir', Configuration.game_dir)
+            setattr(self, 'rc_max_jobs', Configuration.rc_max_jobs)
+            setattr(self, 'rc_batch_size', Configuration.rc_batch_size)
+            setattr(self, 'rc_batch_delay', Configuration.rc_batch_delay)
+            setattr(self, 'geometry_cache_dir',
+                    Configuration.geometry_cache_dir)
+            setattr(self, 'geometry_cache_size',
+                    Configuration.geometry_cache_size)
 
     def execute(self, context):
         bcPrint(Configuration.rc_path, 'debug', True)
@@ -2976,6 +3143,9 @@ class Export(bpy.types.Operator, ExportHelper):
 
         except exceptions.BCryException as exception:
             bcPrint(exception.what(), 'error')
+            # There is no window to show the error in background mode.
+            if bpy.app.background:
+                raise
             bpy.ops.screen.display_error(
                 'INVOKE_DEFAULT', message=exception.what())
 
@@ -3002,6 +3172,8 @@ class Export(bpy.types.Operator, ExportHelper):
         box.prop(self, "merge_all_nodes")
         box.prop(self, "export_selected_nodes")
         box.prop(self, "custom_normals")
+        box.prop(self, "use_geometry_cache")
+        box.prop(self, "incremental_export")
         box.prop(self, "vcloth_pre_process")
 
         box = col.box()
@@ -3032,6 +3204,8 @@ class Export(bpy.types.Operator, ExportHelper):
         box.prop(self, "save_dae")
         box.prop(self, "save_tiffs")
         box.prop(self, "run_in_profiler")
+        box.prop(self, "export_timings")
+        box.prop(self, "export_memory")
 
 
 class ExportAnimations(bpy.types.Operator, ExportHelper):
@@ -3046,6 +3220,22 @@ class ExportAnimations(bpy.types.Operator, ExportHelper):
         description="Export for LumberYard engine instead of CryEngine.",
         default=False,
     )
+    reduce_keyframes = BoolProperty(
+        name="Reduce Keyframes",
+        description="Remove keyframes which can be interpolated from their "
+        "neighbours and collapse constant channels into a single keyframe.",
+        default=False,
+    )
+    location_tolerance = FloatProperty(
+        name="Location Tolerance",
+        description="Maximum location error of removed keyframes.",
+        default=0.0001, min=0.0, precision=5, step=0.001,
+    )
+    rotation_tolerance = FloatProperty(
+        name="Rotation Tolerance",
+        description="Maximum rotation error in degrees of removed keyframes.",
+        default=0.01, min=0.0, precision=3, step=0.1,
+    )
     disable_rc = BoolProperty(
         name="Disable RC",
         description="Do not run the resource compiler.",
@@ -3061,6 +3251,17 @@ class ExportAnimations(bpy.types.Operator, ExportHelper):
         description="Select only if you want to profile BCry Exporter.",
         default=False,
     )
+    export_timings = BoolProperty(
+        name="Export Timings",
+        description="Writes timings of export stages next to the DAE file.",
+        default=False,
+    )
+    export_memory = BoolProperty(
+        name="Export Memory",
+        description="Writes peak memory of export stages and top allocation "
+                    "sites next to the DAE file. Slows the export down.",
+        default=False,
+    )
     merge_all_nodes = True
     generate_materials = False
     make_layer = False
@@ -3077,10 +3278,15 @@ class ExportAnimations(bpy.types.Operator, ExportHelper):
                 'generate_materials',
                 'export_for_lumberyard',
                 'is_animation_process',
+                'reduce_keyframes',
+                'location_tolerance',
+                'rotation_tolerance',
                 'make_layer',
                 'disable_rc',
                 'save_dae',
-                'run_in_profiler'
+                'run_in_profiler',
+                'export_timings',
+                'export_memory'
             )
 
             for attribute in attributes:
@@ -3090,6 +3296,9 @@ class ExportAnimations(bpy.types.Operator, ExportHelper):
             setattr(self, 'rc_path', Configuration.rc_path)
             setattr(self, 'texture_rc_path', Configuration.texture_rc_path)
             setattr(self, 'game_dir', Configuration.game_dir)
+            setattr(self, 'rc_max_jobs', Configuration.rc_max_jobs)
+            setattr(self, 'rc_batch_size', Configuration.rc_batch_size)
+            setattr(self, 'rc_batch_delay', Configuration.rc_batch_delay)
 
     def execute(self, context):
         bcPrint(Configuration.rc_path, 'debug')
@@ -3106,6 +3315,9 @@ class ExportAnimations(bpy.types.Operator, ExportHelper):
 
         except exceptions.BCryException as exception:
             bcPrint(exception.what(), 'error')
+            # There is no window to show the error in background mode.
+            if bpy.app.background:
+                raise
             bpy.ops.screen.display_error(
                 'INVOKE_DEFAULT', message=exception.what())
 
@@ -3130,11 +3342,19 @@ class ExportAnimations(bpy.types.Operator, ExportHelper):
         box.label("LumberYard", icon="GAME")
         box.prop(self, "export_for_lumberyard")
 
+        box = col.box()
+        box.label("Keyframes", icon="ANIM_DATA")
+        box.prop(self, "reduce_keyframes")
+        box.prop(self, "location_tolerance")
+        box.prop(self, "rotation_tolerance")
+
         box = col.box()
         box.label("Developer Tools", icon="MODIFIER")
         box.prop(self, "disable_rc")
         box.prop(self, "save_dae")
         box.prop(self, "run_in_profiler")
+        box.prop(self, "export_timings")
+        box.prop(self, "export_memory")
 
 
 class QuickExport(bpy.types.Operator, ExportHelper):
@@ -3165,6 +3385,16 @@ class QuickExport(bpy.types.Operator, ExportHelper):
         description="Use custom normals.",
         default=False,
     )
+    use_geometry_cache = BoolProperty(
+        name="Use Geometry Cache",
+        description="Reuse geometries of unchanged objects from earlier exports.",
+        default=True,
+    )
+    incremental_export = BoolProperty(
+        name="Incremental Export",
+        description="Only export nodes which have changed since the last export.",
+        default=False,
+    )
     vcloth_pre_process = BoolProperty(
         name="VCloth Pre-Process",
         description="Export skin as simulating mesh for VCloth V2.",
@@ -3225,8 +3455,21 @@ class QuickExport(bpy.types.Operator, ExportHelper):
         description="Select only if you want to profile BCry Exporter.",
         default=False,
     )
+    export_timings = BoolProperty(
+        name="Export Timings",
+        description="Writes timings of export stages next to the DAE file.",
+        default=False,
+    )
+    export_memory = BoolProperty(
+        name="Export Memory",
+        description="Writes peak memory of export stages and top allocation "
+                    "sites next to the DAE file. Slows the export down.",
+        default=False,
+    )
 
     is_animation_process = False
+    shard_index = 0
+    shard_count = 1
 
     class Config:
 
@@ -3237,6 +3480,8 @@ class QuickExport(bpy.types.Operator, ExportHelper):
                 'merge_all_nodes',
                 'export_selected_nodes',
                 'custom_normals',
+                'use_geometry_cache',
+                'incremental_export',
                 'vcloth_pre_process',
                 'generate_materials',
                 'convert_textures',
@@ -3249,7 +3494,11 @@ class QuickExport(bpy.types.Operator, ExportHelper):
                 'save_dae',
                 'save_tiffs',
                 'run_in_profiler',
-                'is_animation_process'
+                'export_timings',
+                'export_memory',
+                'is_animation_process',
+                'shard_index',
+                'shard_count'
             )
 
             for attribute in attributes:
@@ -3259,6 +3508,13 @@ class QuickExport(bpy.types.Operator, ExportHelper):
             setattr(self, 'rc_path', Configuration.rc_path)
             setattr(self, 'texture_rc_path', Configuration.texture_rc_path)
             setattr(self, 'game_dir', Configuration.game_dir)
+            setattr(self, 'rc_max_jobs', Configuration.rc_max_jobs)
+            setattr(self, 'rc_batch_size', Configuration.rc_batch_size)
+            setattr(self, 'rc_batch_delay', Configuration.rc_batch_delay)
+            setattr(self, 'geometry_cache_dir',
+                    Configuration.geometry_cache_dir)
+            setattr(self, 'geometry_cache_size',
+                    Configuration.geometry_cache_size)
 
     def execute(self, context):
         bcPrint(Configuration.rc_path, 'debug', True)
@@ -3275,6 +3531,9 @@ class QuickExport(bpy.types.Operator, ExportHelper):
 
         except exceptions.BCryException as exception:
             bcPrint(exception.what(), 'error')
+            # There is no window to show the error in background mode.
+            if bpy.app.background:
+                raise
             bpy.ops.screen.display_error(
                 'INVOKE_DEFAULT', message=exception.what())
 
@@ -3301,6 +3560,8 @@ class QuickExport(bpy.types.Operator, ExportHelper):
         box.prop(self, "merge_all_nodes")
         box.prop(self, "export_selected_nodes")
         box.prop(self, "custom_normals")
+        box.prop(self, "use_geometry_cache")
+        box.prop(self, "incremental_export")
         box.prop(self, "vcloth_pre_process")
 
         box = col.box()
@@ -3331,6 +3592,8 @@ class QuickExport(bpy.types.Operator, ExportHelper):
         box.prop(self, "save_dae")
         box.prop(self, "save_tiffs")
         box.prop(self, "run_in_profiler")
+        box.prop(self, "export_timings")
+        box.prop(self, "export_memory")
 
 
 class ErrorHandler(bpy.types.Operator):
@@ -3628,6 +3891,27 @@ class ConfigurationsPanel(View3DPanel, Panel):
             "file.select_game_dir",
             text="Select Game Directory",
             icon="FILESEL")
+        col.separator()
+        col.operator(
+            "config.edit_export_settings",
+            text="Export Settings",
+            icon="PREFERENCES")
+        col.operator(
+            "config.clear_geometry_cache",
+            text="Clear Geometry Cache",
+            icon="CANCEL")
+        col.operator(
+            "config.prune_texture_manifest",
+            text="Prune Texture Manifest",
+            icon="TEXTURE")
+        col.operator(
+            "config.rebuild_texture_manifest",
+            text="Rebuild Texture Manifest",
+            icon="FILE_REFRESH")
+        col.operator(
+            "config.cancel_rc_jobs",
+            text="Cancel RC Jobs",
+            icon="X")
 
 
 class ExportPanel(View3DPanel, Panel):
@@ -3925,6 +4209,27 @@ class ConfigurationsMenu(bpy.types.Menu):
             "file.select_game_dir",
             text="Select Game Directory",
             icon="FILE_FOLDER")
+        layout.separator()
+        layout.operator(
+            "config.edit_export_settings",
+            text="Export Settings",
+            icon="PREFERENCES")
+        layout.operator(
+            "config.clear_geometry_cache",
+            text="Clear Geometry Cache",
+            icon="CANCEL")
+        layout.operator(
+            "config.prune_texture_manifest",
+            text="Prune Texture Manifest",
+            icon="TEXTURE")
+        layout.operator(
+            "config.rebuild_texture_manifest",
+            text="Rebuild Texture Manifest",
+            icon="FILE_REFRESH")
+        layout.operator(
+            "config.cancel_rc_jobs",
+            text="Cancel RC Jobs",
+            icon="X")
 
 
 class SetMaterialPhysicsMenu(bpy.types.Menu):
@@ -4025,6 +4330,11 @@ def get_classes_to_register():
         FindRC,
         FindRCForTextureConversion,
         SelectGameDirectory,
+        EditExportSettings,
+        ClearGeometryCache,
+        PruneTextureManifest,
+        RebuildTextureManifest,
+        CancelRCJobs,
         SaveBCryConfiguration,
 
         AddCryExportNode,
@@ -4160,6 +4470,7 @@ def register():
 
 def unregister():
     unregister_bcry_icons()
+    rc.cancel_rc_jobs()
 
     # Be sure to unregister operators.
     for classToRegister in get_classes_to_register():
@@ -0,0 +1,366 @@
+#------------------------------------------------------------------------------
+# Name:        batch_export.py
+# Purpose:     Headless export of many .blend files
+#
+# Created:     17/10/2026
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+# The driver runs in a plain Python interpreter and starts one background
+# Blender per .blend file:
+#
+#   python batch_export.py --blender blender --profile profile.json
+#                          --jobs 4 --summary summary.json a.blend b.blend
+#
+# Each Blender runs export_current_file() with the same profile. A profile
+# is a JSON file which selects the operator and its options:
+#
+#   {"operator": "export",
+#    "output_dir": "",
+#    "rc_path": "", "texture_rc_path": "", "game_dir": "",
+#    "geometry_cache_size": 256, "rc_max_jobs": 4,
+#    "rc_batch_size": 16, "rc_batch_delay": 0.5,
+#    "options": {"apply_modifiers": true, "generate_materials": true}}
+#
+# "operator" is "export" or "export_animations", options are the properties
+# of that operator. Empty paths and missing settings keep the saved BCry
+# configuration.
+#
+# The result of a file lists the files its export has written into the
+# output directory. Files of exports into the same directory are told apart
+# by name, so export nodes of different .blend files there need distinct
+# names. A file whose RC conversion failed is reported as failed.
+#
+# With --shards N every .blend is exported by N Blender processes which
+# share a read-only copy of the file. Each one exports a part of the export
+# nodes into its own DAE, the first one also writes materials and textures.
+#
+# bpy is imported only inside Blender, so this file has no imports from the
+# add-on at module level.
+
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+
+OPERATORS = {
+    'export': 'export_to_game',
+    'export_animations': 'export_animations',
+}
+
+CONFIGURATION_PATHS = ('rc_path', 'texture_rc_path', 'game_dir')
+CONFIGURATION_SETTINGS = ('geometry_cache_size', 'rc_max_jobs',
+                          'rc_batch_size', 'rc_batch_delay')
+
+BLENDER_EXPRESSION = ("import io_bcry_exporter.batch_export as batch_export; "
+                      "batch_export.export_current_file()")
+
+
+#------------------------------------------------------------------------------
+# Blender Side:
+#------------------------------------------------------------------------------
+
+def export_current_file():
+    '''Exports the open .blend file with the profile given after "--" on
+    the Blender command line and writes a JSON result.
+    '''
+    import bpy
+    from io_bcry_exporter.configuration import Configuration
+
+    argv = sys.argv[sys.argv.index('--') + 1:]
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profile', required=True)
+    parser.add_argument('--result', required=True)
+    parser.add_argument('--filepath')
+    parser.add_argument('--shard-index', type=int, default=0)
+    parser.add_argument('--shard-count', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    profile = load_profile(args.profile)
+    blend_path = bpy.data.filepath
+    filepath = args.filepath or get_dae_path(blend_path, profile)
+    output_dir = os.path.dirname(filepath)
+
+    options = dict(profile.get('options', {}))
+    if args.shard_count > 1:
+        options['shard_index'] = args.shard_index
+        options['shard_count'] = args.shard_count
+
+    for path in CONFIGURATION_PATHS:
+        if profile.get(path):
+            setattr(Configuration, path, profile[path])
+    for setting in CONFIGURATION_SETTINGS:
+        if profile.get(setting) is not None:
+            setattr(Configuration, setting, profile[setting])
+
+    result = {
+        'file': blend_path,
+        'operator': profile.get('operator', 'export'),
+        'filepath': filepath,
+        'status': 'ok',
+        'error': None,
+        'outputs': [],
+    }
+
+    start_time = time.time()
+    try:
+        operator = getattr(bpy.ops.scene, OPERATORS[result['operator']])
+        operator('EXEC_DEFAULT', filepath=filepath, **options)
+    except Exception as exception:
+        result['status'] = 'failed'
+        result['error'] = str(exception)
+    result['duration'] = time.time() - start_time
+
+    prefixes, names = get_output_names(filepath)
+    result['outputs'] = get_outputs(output_dir, start_time, prefixes, names)
+
+    with open(args.result, 'w') as f:
+        json.dump(result, f, indent=2)
+
+
+def get_dae_path(blend_path, profile):
+    output_dir = profile.get('output_dir') or os.path.dirname(blend_path)
+    return os.path.join(output_dir, "{}.dae".format(
+        os.path.splitext(os.path.basename(blend_path))[0]))
+
+
+def get_output_names(filepath):
+    '''Returns the file name prefixes and file names of the outputs of an
+    export to filepath. Outputs of the DAE and of export nodes start with
+    their name and a dot, .anm and .mtl files are named after other nodes.
+    '''
+    from io_bcry_exporter import utils, material_utils
+
+    prefixes = ["{}.".format(
+        os.path.splitext(os.path.basename(filepath))[0])]
+    names = set()
+    for group in utils.get_export_nodes():
+        prefixes.append("{}.".format(utils.get_node_name(group)))
+        if utils.get_node_type(group) == 'anm':
+            names.add(utils.get_geometry_animation_file_name(group))
+
+    for node in material_utils.MaterialRegistry().get_node_materials():
+        names.add("{}.mtl".format(node))
+
+    return prefixes, names
+
+
+def get_outputs(output_dir, start_time, prefixes, names):
+    # Other exports may write into the same directory at the same time,
+    # so only files named after this export are its outputs.
+    outputs = []
+    for filename in sorted(os.listdir(output_dir)):
+        if filename not in names and \
+                not any(filename.startswith(prefix) for prefix in prefixes):
+            continue
+
+        filepath = os.path.join(output_dir, filename)
+        if os.path.isfile(filepath) and \
+                os.path.getmtime(filepath) >= start_time:
+            outputs.append(filepath)
+
+    return outputs
+
+
+def load_profile(profile_path):
+    with open(profile_path, 'r') as f:
+        profile = json.load(f)
+
+    operator = profile.get('operator', 'export')
+    if operator not in OPERATORS:
+        raise ValueError("Unknown operator {!r} in profile {!r}.".format(
+            operator, profile_path))
+
+    return profile
+
+
+#------------------------------------------------------------------------------
+# Driver:
+#------------------------------------------------------------------------------
+
+def export_files(blender, blend_files, profile_path, jobs=1, timeout=None):
+    '''Exports the .blend files in parallel background Blender processes
+    and returns a summary of every file.
+    '''
+    load_profile(profile_path)
+
+    with tempfile.TemporaryDirectory(prefix="bcry_batch") as result_dir:
+        def export_file(index_and_file):
+            index, blend_file = index_and_file
+            result_path = os.path.join(result_dir, "{}.json".format(index))
+            return run_blender(blender, blend_file, profile_path,
+                               result_path, timeout)
+
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            results = list(executor.map(export_file,
+                                        enumerate(blend_files)))
+
+    return get_summary(profile_path, results)
+
+
+def get_summary(profile_path, results):
+    return {
+        'profile': os.path.abspath(profile_path),
+        'files': results,
+        'succeeded': sum(1 for result in results if result['status'] == 'ok'),
+        'failed': sum(1 for result in results if result['status'] != 'ok'),
+    }
+
+
+def export_sharded_file(blender, blend_file, profile_path, shards,
+                        timeout=None):
+    '''Exports one .blend file with a Blender process per shard and merges
+    the results of the shards.
+    '''
+    profile = load_profile(profile_path)
+    if profile.get('operator', 'export') != 'export':
+        raise ValueError("Only the 'export' operator can be sharded.")
+
+    # The copy stays next to the original to keep relative paths valid, its
+    # name is unique so that drivers of the same file do not share it.
+    blend_file = os.path.abspath(blend_file)
+    directory, filename = os.path.split(blend_file)
+    copy_file, copy_path = tempfile.mkstemp(
+        prefix=".bcry_shards_", suffix="_{}".format(filename), dir=directory)
+    os.close(copy_file)
+    shutil.copyfile(blend_file, copy_path)
+    os.chmod(copy_path, stat.S_IREAD)
+
+    dae_path = os.path.splitext(get_dae_path(blend_file, profile))[0]
+    try:
+        with tempfile.TemporaryDirectory(prefix="bcry_shards") as result_dir:
+            def export_shard(index):
+                extra_args = [
+                    '--filepath', "{}_shard{}.dae".format(dae_path, index),
+                    '--shard-index', str(index),
+                    '--shard-count', str(shards)]
+                result_path = os.path.join(result_dir,
+                                           "{}.json".format(index))
+                return run_blender(blender, copy_path, profile_path,
+                                   result_path, timeout, extra_args)
+
+            with ThreadPoolExecutor(max_workers=shards) as executor:
+                results = list(executor.map(export_shard, range(shards)))
+    finally:
+        os.chmod(copy_path, stat.S_IREAD | stat.S_IWRITE)
+        os.remove(copy_path)
+
+    errors = [result['error'] for result in results if result['error']]
+    outputs = set()
+    for result in results:
+        outputs.update(result['outputs'])
+
+    return {
+        'file': blend_file,
+        'status': 'ok' if all(result['status'] == 'ok'
+                              for result in results) else 'failed',
+        'error': "; ".join(errors) or None,
+        'outputs': sorted(outputs),
+        'wall_time': max(result['wall_time'] for result in results),
+        'shards': results,
+    }
+
+
+def run_blender(blender, blend_file, profile_path, result_path, timeout,
+                extra_args=()):
+    args = [blender, '-b', blend_file,
+            '--addons', 'io_bcry_exporter',
+            '--python-expr', BLENDER_EXPRESSION,
+            '--', '--profile', os.path.abspath(profile_path),
+            '--result', result_path]
+    args.extend(extra_args)
+
+    start_time = time.time()
+    try:
+        process = subprocess.run(args, stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT,
+                                 universal_newlines=True, timeout=timeout)
+        returncode = process.returncode
+        log = process.stdout
+    except subprocess.TimeoutExpired as exception:
+        returncode = None
+        log = exception.output or ''
+    except OSError as exception:
+        returncode = None
+        log = str(exception)
+    wall_time = time.time() - start_time
+
+    try:
+        with open(result_path, 'r') as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        result = {
+            'file': os.path.abspath(blend_file),
+            'status': 'failed',
+            'error': "Blender did not write an export result.",
+            'outputs': [],
+        }
+
+    result['returncode'] = returncode
+    result['wall_time'] = wall_time
+    if result['status'] != 'ok':
+        result['log'] = log[-4000:]
+
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Exports .blend files with BCry Exporter in background "
+                    "Blender processes.")
+    parser.add_argument('files', nargs='*', help=".blend files to export")
+    parser.add_argument('--blender', default='blender',
+                        help="Blender executable")
+    parser.add_argument('--profile', required=True,
+                        help="JSON export profile")
+    parser.add_argument('--list', help="text file with one .blend per line")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                        help="number of Blender processes")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="Blender processes per .blend file, files are "
+                             "then exported one after another")
+    parser.add_argument('--timeout', type=float,
+                        help="seconds before a Blender process is killed")
+    parser.add_argument('--summary', help="JSON file for the summary")
+    args = parser.parse_args(argv)
+
+    blend_files = list(args.files)
+    if args.list:
+        with open(args.list, 'r') as f:
+            blend_files.extend(line.strip() for line in f if line.strip())
+
+    if args.shards > 1:
+        results = [export_sharded_file(args.blender, blend_file,
+                                       args.profile, args.shards,
+                                       args.timeout)
+                   for blend_file in blend_files]
+        summary = get_summary(args.profile, results)
+    else:
+        summary = export_files(args.blender, blend_files, args.profile,
+                               args.jobs, args.timeout)
+
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    print("{} files exported, {} failed.".format(summary['succeeded'],
+                                                   summary['failed']))
+    for result in summary['files']:
+        if result['status'] != 'ok':
+            print("Failed: {} ({})".format(result['file'], result['error']))
+
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
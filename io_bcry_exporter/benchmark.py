@@ -0,0 +1,996 @@
+#------------------------------------------------------------------------------
+# Name:        benchmark.py
+# Purpose:     Export benchmarks on generated scenes
+#
+# Created:     17/10/2026
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+# The driver runs in a plain Python interpreter and starts a background
+# Blender for every run of a scenario:
+#
+#   python benchmark.py --blender blender --repeat 3 --stub-rc
+#                       --output results.json --baseline baseline.json
+#
+# Blender generates the scene of the scenario from its parameters and runs
+# export.save() or export_animations.save() on it with export timings
+# enabled. Every run starts from the factory settings, so the results of a
+# scenario depend only on its parameters, Blender and the exporter.
+#
+# Parameters of a scenario:
+#
+#   operator        "export" or "export_animations"
+#   nodes           number of export nodes
+#   grid_size       quads along a side of the grid mesh of a node
+#   materials       material slots of every mesh
+#   distinct_materials
+#                   every node gets its own materials instead of sharing
+#                   them with the other nodes
+#   bones           bones of the armature of a node, meshes become skinned
+#                   chr nodes and animations i_caf nodes
+#   frames          length of the animation clips
+#   vertex_colors   meshes get a vertex color layer
+#   smooth          grids get a relief, smooth and flat faces, sharp edges
+#                   and auto smooth
+#   check_normals   split normals of the array engine are checked against
+#                   get_normal_array and get_custom_normals after the
+#                   export, both engines are timed as "normals (arrays)"
+#                   and "normals (elements)"
+#
+# Variant parameters select an implementation of the exporter instead of
+# changing the scene:
+#
+#   bulk            0 exports meshes with the per element code instead of
+#                   numpy arrays
+#   rc_batch_size   files per RC invocation, 1 runs RC once per file
+#   action_sampling 0 samples bone animations by evaluating the whole scene
+#                   on every frame instead of the action of the armature
+#
+# --set key=value changes a parameter of every selected scenario. A
+# baseline which differs only in variants is still compared, so
+#
+#   python benchmark.py --scenario arrays_100k --set bulk=0
+#                       --baseline elements.json --update-baseline
+#   python benchmark.py --scenario arrays_100k --baseline elements.json
+#
+# measures the bulk extraction against the per element code. Nested stages
+# are compared by their totals, e.g. "totals/positions".
+#
+# Code which has been replaced is measured with --addon-dir, the directory
+# of another checkout which holds its io_bcry_exporter package. Blender
+# then loads that add-on, while the scenes still come from this file:
+#
+#   git worktree add ../bcry_old <commit before the change>
+#   python benchmark.py --scenario streaming_2m --addon-dir ../bcry_old
+#                       --baseline old.json --update-baseline
+#   python benchmark.py --scenario streaming_2m --baseline old.json
+#
+# Add-ons without export timings are compared by wall time and memory.
+#
+# --rc-startup gives the stub RC a startup time, and every run counts its
+# RC invocations as "rc_invocations". The rc_second_pass scenario measures
+# batching of the second pass of chr nodes:
+#
+#   python benchmark.py --scenario rc_second_pass --stub-rc --rc-startup 0.2
+#                       --set rc_batch_size=1 --baseline single.json
+#                       --update-baseline
+#   python benchmark.py --scenario rc_second_pass --stub-rc --rc-startup 0.2
+#                       --baseline single.json
+#
+# With --memory the exporter also traces memory of its stages. The peaks
+# are recorded but not compared, and since tracing slows the export down
+# times are compared only with a baseline which traced memory too.
+#
+# The median of the runs is compared with the baseline. Total wall time,
+# top level export stages and peak memory regress when they exceed the
+# baseline by more than their threshold. Without --stub-rc the RC is
+# disabled, the stub RC is a shell script which exits after its startup
+# time.
+#
+# bpy is imported only inside Blender, so this file has no imports from the
+# add-on at module level.
+
+
+from collections import OrderedDict
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+
+DEFAULT_PARAMETERS = OrderedDict((
+    ('operator', 'export'),
+    ('nodes', 1),
+    ('grid_size', 0),
+    ('materials', 0),
+    ('distinct_materials', 0),
+    ('bones', 0),
+    ('frames', 0),
+    ('vertex_colors', 0),
+    ('smooth', 0),
+    ('check_normals', 0),
+    ('bulk', 1),
+    ('rc_batch_size', 16),
+    ('action_sampling', 1),
+))
+
+VARIANT_PARAMETERS = ('bulk', 'rc_batch_size', 'action_sampling')
+
+SCENARIOS = OrderedDict((
+    ('mesh', {'grid_size': 100, 'materials': 1}),
+    ('dense_mesh', {'grid_size': 400, 'materials': 1}),
+    ('material_slots', {'grid_size': 100, 'materials': 32}),
+    ('export_nodes', {'nodes': 64, 'grid_size': 20, 'materials': 2}),
+    # Per object overhead of mesh acquisition on many small props.
+    ('small_props', {'nodes': 2000, 'grid_size': 2, 'materials': 1}),
+    # Material lookups with 2000 materials across 500 objects.
+    ('many_materials', {'nodes': 500, 'grid_size': 4, 'materials': 4,
+                        'distinct_materials': 1}),
+    ('skinned_mesh', {'grid_size': 100, 'materials': 1, 'bones': 64}),
+    # Second RC pass of many chr nodes, meant for --stub-rc.
+    ('rc_second_pass', {'nodes': 64, 'grid_size': 2, 'materials': 1,
+                        'bones': 2}),
+    ('i_caf', {'operator': 'export_animations', 'bones': 64,
+               'frames': 250}),
+    ('anm', {'operator': 'export_animations', 'nodes': 8, 'frames': 250}),
+    # Pose sampling of a long clip, compare with --set action_sampling=0.
+    ('long_i_caf', {'operator': 'export_animations', 'bones': 120,
+                    'frames': 300}),
+    # Positions, UVs and vertex colors from 10k to 2M vertices.
+    ('arrays_10k', {'grid_size': 99, 'materials': 1, 'vertex_colors': 1}),
+    ('arrays_100k', {'grid_size': 315, 'materials': 1, 'vertex_colors': 1}),
+    ('arrays_1m', {'grid_size': 999, 'materials': 1, 'vertex_colors': 1}),
+    ('arrays_2m', {'grid_size': 1413, 'materials': 1, 'vertex_colors': 1}),
+    ('split_normals', {'grid_size': 150, 'materials': 1, 'smooth': 1,
+                       'check_normals': 1}),
+    # 2M triangles to compare memory of the streaming writer.
+    ('streaming_2m', {'grid_size': 1000, 'materials': 1}),
+))
+
+NORMALS_TOLERANCE = 1e-4
+
+EXPORT_OPTIONS = {
+    'apply_modifiers': False,
+    'merge_all_nodes': True,
+    'export_selected_nodes': False,
+    'custom_normals': False,
+    'use_geometry_cache': False,
+    'incremental_export': False,
+    'vcloth_pre_process': False,
+    'generate_materials': False,
+    'convert_textures': False,
+    'make_chrparams': False,
+    'make_cdf': False,
+    'fix_weights': False,
+    'export_for_lumberyard': False,
+    'make_layer': False,
+    'save_dae': True,
+    'save_tiffs': False,
+    'run_in_profiler': False,
+    'is_animation_process': False,
+    'shard_index': 0,
+    'shard_count': 1,
+}
+
+ANIMATION_OPTIONS = {
+    'merge_all_nodes': True,
+    'vcloth_pre_process': False,
+    'generate_materials': False,
+    'export_for_lumberyard': False,
+    'is_animation_process': True,
+    'reduce_keyframes': False,
+    'location_tolerance': 0.0001,
+    'rotation_tolerance': 0.01,
+    'make_layer': False,
+    'save_dae': True,
+    'run_in_profiler': False,
+}
+
+# Blender runs the scenario from this file, not from the add-on, which may
+# be an older one.
+BLENDER_EXPRESSION = ("import runpy; runpy.run_path({!r}, "
+                      "run_name='bcry_benchmark')['run_scenario']()")
+
+# The stub RC waits for its startup time and logs its invocation.
+STUB_RC = """#!/bin/sh
+sleep {}
+if [ -n "$BCRY_BENCHMARK_RC_LOG" ]; then
+    echo "$@" >> "$BCRY_BENCHMARK_RC_LOG"
+fi
+exit 0
+"""
+
+
+#------------------------------------------------------------------------------
+# Blender Side:
+#------------------------------------------------------------------------------
+
+def run_scenario():
+    '''Generates the scene of the scenario given after "--" on the Blender
+    command line, exports it and writes a JSON result.
+    '''
+    argv = sys.argv[sys.argv.index('--') + 1:]
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--name', required=True)
+    parser.add_argument('--parameters', required=True)
+    parser.add_argument('--output-dir', required=True)
+    parser.add_argument('--result', required=True)
+    parser.add_argument('--rc-path', default='')
+    parser.add_argument('--memory', action='store_true')
+    args = parser.parse_args(argv)
+
+    parameters = json.loads(args.parameters)
+    generate_scene(parameters)
+
+    filepath = os.path.join(args.output_dir, "{}.dae".format(args.name))
+    save, config = get_export(parameters['operator'], filepath, args.rc_path)
+    config.export_memory = args.memory
+    set_variants(parameters, config)
+
+    result = {
+        'scenario': args.name,
+        'parameters': parameters,
+        'status': 'ok',
+        'error': None,
+    }
+
+    rss_before = get_rss()
+    start_time = time.time()
+    try:
+        save(config)
+    except Exception as exception:
+        result['status'] = 'failed'
+        result['error'] = str(exception)
+    result['wall_time'] = time.time() - start_time
+    result['peak_rss_mb'] = get_peak_rss()
+    result['export_rss_mb'] = max(0.0, result['peak_rss_mb'] - rss_before)
+    result['stages'], result['stage_totals'] = get_stages(filepath)
+    if parameters['check_normals'] and result['status'] == 'ok':
+        max_error, seconds = check_normals()
+        result['normals_max_error'] = max_error
+        result['stage_totals'].update(seconds)
+        if max_error > NORMALS_TOLERANCE:
+            result['status'] = 'failed'
+            result['error'] = ("Split normals differ from the per element "
+                               "normals by {:g}.".format(max_error))
+    if args.memory:
+        result['stage_memory_mb'] = get_stage_memory(filepath)
+
+    with open(args.result, 'w') as f:
+        json.dump(result, f, indent=2)
+
+
+def get_export(operator, filepath, rc_path):
+    import io_bcry_exporter
+    from io_bcry_exporter import export, export_animations
+
+    if operator == 'export':
+        options = _Options(EXPORT_OPTIONS, filepath)
+        config = io_bcry_exporter.Export.Config(options)
+        save = export.save
+    else:
+        options = _Options(ANIMATION_OPTIONS, filepath)
+        config = io_bcry_exporter.ExportAnimations.Config(options)
+        save = export_animations.save
+
+    # Saved paths of the user are not used, results have to be comparable.
+    config.rc_path = rc_path
+    config.texture_rc_path = ''
+    config.game_dir = ''
+    config.disable_rc = not rc_path
+
+    return save, config
+
+
+def check_normals():
+    '''Compares calc_split_normals with get_normal_array in the four edge
+    angle and edge sharp modes, and with get_custom_normals, on every mesh
+    of the scene. Returns the largest difference and the times of both.
+    '''
+    import bpy
+    from io_bcry_exporter import utils
+
+    max_error = 0.0
+    seconds = {'normals (arrays)': 0.0, 'normals (elements)': 0.0}
+    modes = [(use_edge_angle, use_edge_sharp, False)
+             for use_edge_angle in (False, True)
+             for use_edge_sharp in (False, True)]
+    modes.extend((use_edge_angle, False, True)
+                 for use_edge_angle in (False, True))
+
+    for object_ in bpy.data.objects:
+        if object_.type != 'MESH':
+            continue
+
+        bmesh_, mesh = utils.get_bmesh(object_)
+        split_angle = object_.data.auto_smooth_angle
+        for use_edge_angle, use_edge_sharp, custom_normals in modes:
+            start_time = time.time()
+            arrays = utils.calc_split_normals(mesh, use_edge_angle,
+                                              use_edge_sharp, split_angle)
+            array_time = time.time()
+            if custom_normals:
+                elements = utils.get_custom_normals(bmesh_, use_edge_angle,
+                                                    split_angle)
+            else:
+                elements = utils.get_normal_array(bmesh_, use_edge_angle,
+                                                  use_edge_sharp, split_angle)
+            end_time = time.time()
+
+            seconds['normals (arrays)'] += array_time - start_time
+            seconds['normals (elements)'] += end_time - array_time
+            max_error = max([max_error] + [abs(a - b) for a, b
+                                           in zip(arrays, elements)])
+        utils.clear_bmesh(bmesh_, mesh)
+
+    return max_error, seconds
+
+
+def set_variants(parameters, config):
+    from io_bcry_exporter import utils
+
+    # Older add-ons have only one implementation.
+    if hasattr(utils, 'set_bulk_extraction'):
+        utils.set_bulk_extraction(bool(parameters['bulk']))
+    if hasattr(utils, 'set_action_sampling'):
+        utils.set_action_sampling(bool(parameters['action_sampling']))
+    if hasattr(config, 'rc_batch_size'):
+        config.rc_batch_size = parameters['rc_batch_size']
+
+
+class _Options:
+    '''Stands in for the operator whose properties a Config copies.'''
+
+    def __init__(self, options, filepath):
+        self.__dict__.update(options)
+        self.filepath = filepath
+        self.disable_rc = True
+        self.export_timings = True
+        self.export_memory = False
+
+
+def get_stages(filepath):
+    '''Returns times of the top level stages, and the totals of nested
+    stages by their name, which sum a stage over all nodes and objects.
+    '''
+    timings_path = "{}.timings.json".format(os.path.splitext(filepath)[0])
+    try:
+        with open(timings_path, 'r') as f:
+            timings = json.load(f)
+    except (OSError, ValueError):
+        return {}, {}
+
+    stages = OrderedDict()
+    totals = OrderedDict()
+    for entry in timings['summary']:
+        if "/" not in entry['path']:
+            stages[entry['path']] = entry['seconds']
+        else:
+            name = entry['path'].rsplit("/", 1)[-1]
+            totals[name] = totals.get(name, 0.0) + entry['seconds']
+
+    return stages, totals
+
+
+def get_stage_memory(filepath):
+    memory_path = "{}.memory.json".format(os.path.splitext(filepath)[0])
+    try:
+        with open(memory_path, 'r') as f:
+            memory = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    return OrderedDict((entry['path'], entry['traced_peak_mb'])
+                       for entry in memory['summary']
+                       if "/" not in entry['path'])
+
+
+def get_rss():
+    # Current resident set size in MB, Linux only.
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+
+    return 0.0
+
+
+def get_peak_rss():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+#------------------------------------------------------------------------------
+# Scene Generator:
+#------------------------------------------------------------------------------
+
+def generate_scene(parameters):
+    import bpy
+
+    __clear_scene()
+
+    scene = bpy.context.scene
+    frames = parameters['frames']
+    if frames:
+        scene.frame_start = 1
+        scene.frame_end = frames
+
+    materials = [bpy.data.materials.new("material_{:02d}".format(index))
+                 for index in range(parameters['materials'])]
+
+    for index in range(parameters['nodes']):
+        name = "node_{:03d}".format(index)
+        offset = index * 3.0
+        if parameters['distinct_materials']:
+            materials = [bpy.data.materials.new(
+                "{}_material_{:02d}".format(name, material_index))
+                for material_index in range(parameters['materials'])]
+
+        if parameters['operator'] == 'export':
+            object_ = __create_grid(name, parameters['grid_size'], materials,
+                                    parameters['vertex_colors'],
+                                    parameters['smooth'])
+            object_.location.x = offset
+            if parameters['bones']:
+                armature = __create_armature("{}_skeleton".format(name),
+                                             parameters['bones'])
+                armature.location.x = offset
+                __skin(object_, armature)
+                __create_node(name, 'chr', [object_])
+            else:
+                __create_node(name, 'cgf', [object_])
+
+        elif parameters['bones']:
+            armature = __create_armature(name, parameters['bones'])
+            armature.location.x = offset
+            __animate_bones(armature, frames)
+            __set_node_range(armature, name, frames)
+            __create_node(name, 'i_caf', [armature])
+
+        else:
+            object_ = __create_grid(name, 1, materials)
+            object_.location.x = offset
+            __animate(object_, ("location", "rotation_euler"), frames)
+            __set_node_range(object_, name, frames)
+            __create_node(name, 'anm', [object_])
+
+
+def __clear_scene():
+    import bpy
+
+    for object_ in list(bpy.data.objects):
+        bpy.data.objects.remove(object_, do_unlink=True)
+    for group in list(bpy.data.groups):
+        bpy.data.groups.remove(group)
+
+
+def __create_grid(name, grid_size, materials, vertex_colors=False,
+                  smooth=False):
+    import bpy
+
+    size = grid_size + 1
+    # Relief of steps up to about 50 degrees, around the auto smooth angle.
+    height = 0.3 / grid_size if smooth else 0.0
+    vertices = [(x / grid_size, y / grid_size,
+                 height * ((x * 7 + y * 3) % 5))
+                for y in range(size) for x in range(size)]
+    faces = [(y * size + x, y * size + x + 1,
+              (y + 1) * size + x + 1, (y + 1) * size + x)
+             for y in range(grid_size) for x in range(grid_size)]
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.from_pydata(vertices, [], faces)
+
+    mesh.uv_textures.new()
+    uvs = []
+    for loop in mesh.loops:
+        uvs.extend(vertices[loop.vertex_index][:2])
+    mesh.uv_layers.active.data.foreach_set('uv', uvs)
+
+    if vertex_colors:
+        color_layer = mesh.vertex_colors.new()
+        colors = []
+        for loop in mesh.loops:
+            colors.extend((vertices[loop.vertex_index][0],
+                           vertices[loop.vertex_index][1], 0.5))
+        color_layer.data.foreach_set('color', colors)
+
+    if smooth:
+        mesh.polygons.foreach_set(
+            'use_smooth', [index % 11 != 0 for index in range(len(faces))])
+        mesh.edges.foreach_set(
+            'use_edge_sharp',
+            [index % 5 == 0 for index in range(len(mesh.edges))])
+        mesh.use_auto_smooth = True
+        mesh.auto_smooth_angle = 0.5
+
+    for material in materials:
+        mesh.materials.append(material)
+    if materials:
+        mesh.polygons.foreach_set(
+            'material_index',
+            [index % len(materials) for index in range(len(faces))])
+    mesh.update()
+
+    object_ = bpy.data.objects.new(name, mesh)
+    bpy.context.scene.objects.link(object_)
+
+    return object_
+
+
+def __create_armature(name, bone_count):
+    import bpy
+
+    armature_data = bpy.data.armatures.new(name)
+    armature = bpy.data.objects.new(name, armature_data)
+    bpy.context.scene.objects.link(armature)
+
+    bpy.context.scene.objects.active = armature
+    bpy.ops.object.mode_set(mode='EDIT')
+    parent = None
+    for index in range(bone_count):
+        bone = armature_data.edit_bones.new("bone_{:03d}".format(index))
+        bone.head = (0.0, 0.0, index * 0.1)
+        bone.tail = (0.0, 0.0, (index + 1) * 0.1)
+        if parent is not None:
+            bone.parent = parent
+            bone.use_connect = True
+        parent = bone
+    bpy.ops.object.mode_set(mode='OBJECT')
+
+    for pose_bone in armature.pose.bones:
+        pose_bone.rotation_mode = 'XYZ'
+
+    return armature
+
+
+def __skin(object_, armature):
+    object_.parent = armature
+    modifier = object_.modifiers.new("Armature", 'ARMATURE')
+    modifier.object = armature
+
+    # Every vertex has a full and a half weight of neighbouring bones.
+    vertex_count = len(object_.data.vertices)
+    bones = armature.data.bones
+    for index, bone in enumerate(bones):
+        vertex_group = object_.vertex_groups.new(bone.name)
+        vertex_group.add(list(range(index, vertex_count, len(bones))),
+                         1.0, 'REPLACE')
+        if len(bones) > 1:
+            vertex_group.add(list(range((index + 1) % len(bones),
+                                        vertex_count,
+                                        len(bones))),
+                             0.5, 'REPLACE')
+
+
+def __animate_bones(armature, frames):
+    data_paths = []
+    for bone in armature.pose.bones:
+        data_paths.append('pose.bones["{}"].location'.format(bone.name))
+        data_paths.append('pose.bones["{}"].rotation_euler'.format(bone.name))
+
+    __animate(armature, data_paths, frames)
+
+
+def __animate(object_, data_paths, frames):
+    import bpy
+
+    object_.animation_data_create()
+    action = bpy.data.actions.new("{}_action".format(object_.name))
+    object_.animation_data.action = action
+
+    for path_index, data_path in enumerate(data_paths):
+        for array_index in range(3):
+            curve = action.fcurves.new(data_path, array_index)
+            curve.keyframe_points.add(frames)
+            phase = path_index * 3 + array_index
+            co = []
+            for frame in range(frames):
+                co.extend((frame + 1, math.sin((frame + phase) * 0.1)))
+            curve.keyframe_points.foreach_set('co', co)
+            curve.update()
+
+
+def __set_node_range(object_, name, frames):
+    object_["{}_Start".format(name)] = 1
+    object_["{}_End".format(name)] = frames
+
+
+def __create_node(name, node_type, objects):
+    import bpy
+
+    group = bpy.data.groups.new("{}.{}".format(name, node_type))
+    for object_ in objects:
+        group.objects.link(object_)
+
+    return group
+
+
+#------------------------------------------------------------------------------
+# Driver:
+#------------------------------------------------------------------------------
+
+def run_benchmarks(blender, scenarios, repeat=1, stub_rc=False,
+                   timeout=None, memory=False, addon_dir=None,
+                   rc_startup=0.0):
+    '''Runs every scenario repeat times, each run in a new background
+    Blender, and returns the median results.
+    '''
+    results = OrderedDict()
+    with tempfile.TemporaryDirectory(prefix="bcry_benchmark") as work_dir:
+        rc_path = write_stub_rc(work_dir, rc_startup) if stub_rc else ''
+        scripts_dir = None
+        if addon_dir:
+            scripts_dir = write_scripts_dir(work_dir, addon_dir)
+
+        for name, parameters in scenarios.items():
+            runs = []
+            for index in range(repeat):
+                output_dir = os.path.join(work_dir,
+                                          "{}_{}".format(name, index))
+                os.mkdir(output_dir)
+                runs.append(run_blender(blender, name, parameters,
+                                        output_dir, rc_path, timeout,
+                                        memory, scripts_dir))
+
+            results[name] = get_median_result(name, parameters, runs)
+            print("{}: {} in {:.2f} s, peak memory {:.1f} MB.".format(
+                name, results[name]['status'], results[name]['wall_time'],
+                results[name]['peak_rss_mb']))
+
+    return {
+        'blender': get_blender_version(blender),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'stub_rc': stub_rc,
+        'rc_startup': rc_startup if stub_rc else None,
+        'memory': memory,
+        'addon_dir': os.path.abspath(addon_dir) if addon_dir else None,
+        'scenarios': results,
+    }
+
+
+def write_stub_rc(directory, startup=0.0):
+    rc_path = os.path.join(directory, "rc_stub.sh")
+    with open(rc_path, 'w') as f:
+        f.write(STUB_RC.format(max(0.0, startup)))
+    os.chmod(rc_path, stat.S_IRWXU)
+
+    return rc_path
+
+
+def write_scripts_dir(directory, addon_dir):
+    # Blender looks for add-ons in the addons directory of its user scripts.
+    addon_path = os.path.join(os.path.abspath(addon_dir), 'io_bcry_exporter')
+    if not os.path.isdir(addon_path):
+        raise ValueError("{!r} has no io_bcry_exporter package.".format(
+            addon_dir))
+
+    scripts_dir = os.path.join(directory, "scripts")
+    os.makedirs(os.path.join(scripts_dir, "addons"))
+    os.symlink(addon_path,
+               os.path.join(scripts_dir, "addons", "io_bcry_exporter"))
+
+    return scripts_dir
+
+
+def run_blender(blender, name, parameters, output_dir, rc_path, timeout,
+                memory=False, scripts_dir=None):
+    result_path = os.path.join(output_dir, "result.json")
+    rc_log_path = os.path.join(output_dir, "rc.log")
+    expression = BLENDER_EXPRESSION.format(os.path.abspath(__file__))
+    args = [blender, '-b', '--factory-startup',
+            '--addons', 'io_bcry_exporter',
+            '--python-expr', expression,
+            '--', '--name', name,
+            '--parameters', json.dumps(parameters),
+            '--output-dir', output_dir,
+            '--result', result_path,
+            '--rc-path', rc_path]
+    if memory:
+        args.append('--memory')
+
+    # Same hashes in every run, set and dict orders do not vary.
+    env = dict(os.environ, PYTHONHASHSEED='0',
+               BCRY_BENCHMARK_RC_LOG=rc_log_path)
+    if scripts_dir is not None:
+        env['BLENDER_USER_SCRIPTS'] = scripts_dir
+    try:
+        process = subprocess.run(args, stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT,
+                                 universal_newlines=True, timeout=timeout,
+                                 env=env)
+        log = process.stdout
+    except subprocess.TimeoutExpired as exception:
+        log = exception.output or ''
+    except OSError as exception:
+        log = str(exception)
+
+    try:
+        with open(result_path, 'r') as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return {
+            'scenario': name,
+            'parameters': parameters,
+            'status': 'failed',
+            'error': "Blender did not write a benchmark result.",
+            'log': log[-4000:],
+        }
+
+    if rc_path:
+        result['rc_invocations'] = get_rc_invocations(rc_log_path)
+
+    return result
+
+
+def get_rc_invocations(rc_log_path):
+    try:
+        with open(rc_log_path, 'r') as f:
+            return sum(1 for line in f)
+    except OSError:
+        return 0
+
+
+def get_median_result(name, parameters, runs):
+    succeeded = [run for run in runs if run['status'] == 'ok']
+    errors = [run['error'] for run in runs if run['status'] != 'ok']
+
+    result = {
+        'scenario': name,
+        'parameters': parameters,
+        'status': 'ok' if not errors else 'failed',
+        'error': "; ".join(sorted(set(errors))) or None,
+        'runs': len(runs),
+        'wall_time': get_median([run['wall_time'] for run in succeeded]),
+        'peak_rss_mb': get_median([run['peak_rss_mb'] for run in succeeded]),
+        'export_rss_mb': get_median([run['export_rss_mb']
+                                     for run in succeeded]),
+        'stages': get_median_values(succeeded, 'stages'),
+        'stage_totals': get_median_values(succeeded, 'stage_totals'),
+    }
+    if any('rc_invocations' in run for run in succeeded):
+        result['rc_invocations'] = get_median(
+            [run['rc_invocations'] for run in succeeded
+             if 'rc_invocations' in run])
+    if any('normals_max_error' in run for run in runs):
+        result['normals_max_error'] = max(run.get('normals_max_error', 0.0)
+                                          for run in runs)
+    if any('stage_memory_mb' in run for run in succeeded):
+        result['stage_memory_mb'] = get_median_values(succeeded,
+                                                      'stage_memory_mb')
+    if errors:
+        result['log'] = next((run['log'] for run in runs if 'log' in run),
+                             None)
+
+    return result
+
+
+def get_median_values(runs, key):
+    values = OrderedDict()
+    for run in runs:
+        for name in run.get(key, ()):
+            if name not in values:
+                values[name] = get_median(
+                    [other[key][name] for other in runs
+                     if other.get(key, {}).get(name) is not None])
+
+    return values
+
+
+def get_median(values):
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+
+    return (values[middle - 1] + values[middle]) * 0.5
+
+
+def get_blender_version(blender):
+    try:
+        process = subprocess.run([blender, '-b', '--version'],
+                                 stdout=subprocess.PIPE,
+                                 universal_newlines=True)
+    except OSError:
+        return None
+
+    lines = process.stdout.strip().splitlines()
+    return lines[0] if lines else None
+
+
+def compare(results, baseline, time_threshold, memory_threshold,
+            min_time=0.05):
+    '''Returns the metrics of the results against the baseline as
+    (scenario, metric, baseline, current, regressed) tuples. Times below
+    min_time are too noisy to regress.
+    '''
+    comparison = []
+    compare_times = (results.get('memory', False) ==
+                     baseline.get('memory', False))
+    if not compare_times:
+        print("Memory tracing differs from the baseline, times are not "
+              "compared.")
+
+    for name, result in results['scenarios'].items():
+        reference = baseline['scenarios'].get(name)
+        if reference is None:
+            continue
+
+        if result['status'] != 'ok':
+            comparison.append((name, 'status', reference['status'],
+                               result['status'], True))
+            continue
+
+        if get_scene_parameters(reference) != get_scene_parameters(result):
+            print("{}: parameters differ from the baseline, it is "
+                  "skipped.".format(name))
+            continue
+
+        metrics = [('wall_time', reference['wall_time'],
+                    result['wall_time'], time_threshold)]
+        for path, seconds in result['stages'].items():
+            if path in reference['stages']:
+                metrics.append(("stages/{}".format(path),
+                                reference['stages'][path], seconds,
+                                time_threshold))
+        reference_totals = reference.get('stage_totals', {})
+        for stage_name, seconds in result.get('stage_totals', {}).items():
+            if stage_name in reference_totals:
+                metrics.append(("totals/{}".format(stage_name),
+                                reference_totals[stage_name], seconds,
+                                time_threshold))
+        metrics.append(('peak_rss_mb', reference['peak_rss_mb'],
+                        result['peak_rss_mb'], memory_threshold))
+        if 'rc_invocations' in reference and 'rc_invocations' in result:
+            metrics.append(('rc_invocations', reference['rc_invocations'],
+                            result['rc_invocations'], 0.0))
+
+        for metric, old, new, threshold in metrics:
+            is_time = metric not in ('peak_rss_mb', 'rc_invocations')
+            if is_time and not compare_times:
+                continue
+            regressed = new > old * (1.0 + threshold)
+            if is_time and max(old, new) < min_time:
+                regressed = False
+            comparison.append((name, metric, old, new, regressed))
+
+    return comparison
+
+
+def get_scene_parameters(result):
+    # Parameters which are newer than a baseline have their default value.
+    parameters = dict(DEFAULT_PARAMETERS)
+    parameters.update(result['parameters'])
+
+    return dict((key, value) for key, value in parameters.items()
+                if key not in VARIANT_PARAMETERS)
+
+
+def print_comparison(comparison):
+    print("{:<16} {:<32} {:>10} {:>10} {:>8}".format(
+        "Scenario", "Metric", "Baseline", "Current", "Change"))
+    for name, metric, old, new, regressed in comparison:
+        if metric == 'status':
+            print("{:<16} {:<32} {:>10} {:>10} {:>8}".format(
+                name, metric, old, new, "!"))
+            continue
+
+        change = new / old - 1.0 if old else 0.0
+        print("{:<16} {:<32} {:>10.3f} {:>10.3f} {:>+8.0%}{}".format(
+            name, metric[:32], old, new, change, " !" if regressed else ""))
+
+
+def get_scenarios(names, overrides):
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise ValueError("Unknown scenarios: {}.".format(", ".join(unknown)))
+
+    scenarios = OrderedDict()
+    for name in names or SCENARIOS:
+        parameters = OrderedDict(DEFAULT_PARAMETERS)
+        parameters.update(SCENARIOS[name])
+        for override in overrides:
+            key, separator, value = override.partition("=")
+            if key not in parameters or key == 'operator':
+                raise ValueError("Unknown parameter {!r}.".format(key))
+            parameters[key] = int(value)
+        scenarios[name] = parameters
+
+    return scenarios
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmarks BCry Exporter on generated scenes in "
+                    "background Blender processes.")
+    parser.add_argument('--blender', default='blender',
+                        help="Blender executable")
+    parser.add_argument('--scenario', action='append', default=[],
+                        help="scenario to run, all scenarios by default")
+    parser.add_argument('--set', action='append', default=[],
+                        metavar='KEY=VALUE',
+                        help="parameter of every selected scenario")
+    parser.add_argument('--list', action='store_true',
+                        help="list the scenarios and exit")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="runs of every scenario, the median is kept")
+    parser.add_argument('--stub-rc', action='store_true',
+                        help="run a stub RC instead of disabling the RC")
+    parser.add_argument('--rc-startup', type=float, default=0.0,
+                        help="seconds the stub RC takes to start")
+    parser.add_argument('--timeout', type=float,
+                        help="seconds before a Blender process is killed")
+    parser.add_argument('--memory', action='store_true',
+                        help="record peak memory of the export stages")
+    parser.add_argument('--addon-dir',
+                        help="checkout whose io_bcry_exporter is measured")
+    parser.add_argument('--output', help="JSON file for the results")
+    parser.add_argument('--baseline', help="JSON file of a baseline")
+    parser.add_argument('--update-baseline', action='store_true',
+                        help="write the results to the baseline file")
+    parser.add_argument('--time-threshold', type=float, default=0.15,
+                        help="allowed relative growth of times")
+    parser.add_argument('--memory-threshold', type=float, default=0.10,
+                        help="allowed relative growth of peak memory")
+    parser.add_argument('--min-time', type=float, default=0.05,
+                        help="seconds below which times are not compared")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, parameters in get_scenarios([], []).items():
+            print("{:<16} {}".format(name, json.dumps(parameters)))
+        return 0
+
+    scenarios = get_scenarios(args.scenario, args.set)
+    results = run_benchmarks(args.blender, scenarios, max(1, args.repeat),
+                             args.stub_rc, args.timeout, args.memory,
+                             args.addon_dir, args.rc_startup)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    failed = [name for name, result in results['scenarios'].items()
+              if result['status'] != 'ok']
+    for name in failed:
+        print("Failed: {} ({})".format(
+            name, results['scenarios'][name]['error']))
+
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print("Baseline has been written to {}.".format(args.baseline))
+        return 1 if failed else 0
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        comparison = compare(results, baseline, args.time_threshold,
+                             args.memory_threshold, args.min_time)
+        print_comparison(comparison)
+        regressions = [row for row in comparison if row[4]]
+
+    for name, metric, old, new, regressed in regressions:
+        print("Regression: {} {}.".format(name, metric))
+
+    return 1 if failed or regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
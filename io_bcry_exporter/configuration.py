@@ -29,7 +29,11 @@ class __Configuration:
     __CONFIG_FILEPATH = os.path.join(__CONFIG_PATH, __CONFIG_FILENAME)
     __DEFAULT_CONFIGURATION = {'RC_PATH': r'',
                                'TEXTURE_RC_PATH': r'',
-                               'GAME_DIR': r''}
+                               'GAME_DIR': r'',
+                               'GEOMETRY_CACHE_SIZE': 256,
+                               'RC_MAX_JOBS': os.cpu_count() or 1,
+                               'RC_BATCH_SIZE': 16,
+                               'RC_BATCH_DELAY': 0.5}
 
     def __init__(self):
         self.__CONFIG = self.__load({})
@@ -61,6 +65,42 @@ class __Configuration:
     def game_dir(self, value):
         self.__CONFIG['GAME_DIR'] = value
 
+    @property
+    def geometry_cache_dir(self):
+        return os.path.join(self.__CONFIG_PATH, 'bcry_geometry_cache')
+
+    @property
+    def geometry_cache_size(self):
+        return self.__CONFIG['GEOMETRY_CACHE_SIZE']
+
+    @geometry_cache_size.setter
+    def geometry_cache_size(self, value):
+        self.__CONFIG['GEOMETRY_CACHE_SIZE'] = value
+
+    @property
+    def rc_max_jobs(self):
+        return self.__CONFIG['RC_MAX_JOBS']
+
+    @rc_max_jobs.setter
+    def rc_max_jobs(self, value):
+        self.__CONFIG['RC_MAX_JOBS'] = value
+
+    @property
+    def rc_batch_size(self):
+        return self.__CONFIG['RC_BATCH_SIZE']
+
+    @rc_batch_size.setter
+    def rc_batch_size(self, value):
+        self.__CONFIG['RC_BATCH_SIZE'] = value
+
+    @property
+    def rc_batch_delay(self):
+        return self.__CONFIG['RC_BATCH_DELAY']
+
+    @rc_batch_delay.setter
+    def rc_batch_delay(self, value):
+        self.__CONFIG['RC_BATCH_DELAY'] = value
+
     def configured(self):
         path = self.__CONFIG['RC_PATH']
         if len(path) > 0 and get_filename(path) == "rc":
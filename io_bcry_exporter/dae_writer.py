@@ -0,0 +1,81 @@
+#------------------------------------------------------------------------------
+# Name:        dae_writer.py
+# Purpose:     Streaming writer for COLLADA files
+#
+# Created:     17/10/2026
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+
+from xml.sax.saxutils import quoteattr
+import io
+
+
+class DaeWriter:
+    '''Writes a COLLADA document to disk while it is being produced.
+
+    Library elements are opened with start_element and closed with
+    end_element. Finished DOM elements are passed to appendChild, written at
+    the current depth and unlinked, so the writer can stand in for a parent
+    DOM node and only one library item is kept in memory at a time.
+    '''
+
+    def __init__(self, filepath, indent=4):
+        self._file = open(filepath, 'w', encoding='utf-8')
+        self._indent = ' ' * indent
+        self._newline = '\n' if indent else ''
+        self._elements = []
+
+        self._file.write('<?xml version="1.0" ?>{}'.format(self._newline))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start_element(self, name, attributes=()):
+        tag = [name]
+        for attribute, value in attributes:
+            tag.append('{}={}'.format(attribute, quoteattr(value)))
+
+        self._file.write('{}<{}>{}'.format(
+            self._get_indent(), ' '.join(tag), self._newline))
+        self._elements.append(name)
+
+    def end_element(self):
+        name = self._elements.pop()
+        self._file.write('{}</{}>{}'.format(
+            self._get_indent(), name, self._newline))
+
+    def appendChild(self, element):
+        element.writexml(self._file, self._get_indent(), self._indent,
+                         self._newline)
+        element.unlink()
+
+    def serialize(self, element):
+        '''Returns the element as it would be written by appendChild, so
+        the text can be kept and passed to write_raw later.
+        '''
+        buffer = io.StringIO()
+        element.writexml(buffer, self._get_indent(), self._indent,
+                         self._newline)
+        element.unlink()
+
+        return buffer.getvalue()
+
+    def write_raw(self, text):
+        self._file.write(text)
+
+    def close(self):
+        if self._file.closed:
+            return
+
+        while self._elements:
+            self.end_element()
+        self._file.close()
+
+    def _get_indent(self):
+        return self._indent * len(self._elements)
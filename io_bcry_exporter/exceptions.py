@@ -57,6 +57,14 @@ Usually located in 'CryEngine\\Bin32\\rc\\rc.exe'
         BCryException.__init__(self, message)
 
 
+class RCFailedException(BCryException):
+
+    def __init__(self, names):
+        message = "Resource Compiler failed for: {}".format(", ".join(names))
+
+        BCryException.__init__(self, message)
+
+
 class NoGameDirectorySelected(BCryException):
 
     def __init__(self):
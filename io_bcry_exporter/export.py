@@ -20,11 +20,18 @@ if "bpy" in locals():
     imp.reload(export_materials)
     imp.reload(udp)
     imp.reload(exceptions)
+    imp.reload(incremental)
+    imp.reload(material_utils)
+    imp.reload(timers)
 else:
     import bpy
-    from io_bcry_exporter import utils, export_materials, udp, exceptions
+    from io_bcry_exporter import utils, export_materials, udp, exceptions, \
+        incremental, material_utils, timers
 
-from io_bcry_exporter.rc import RCInstance
+from io_bcry_exporter.rc import RCInstance, wait_for_conversions
+from io_bcry_exporter.dae_writer import DaeWriter
+from io_bcry_exporter.geometry_cache import GeometryCache, \
+    get_geometry_fingerprint
 from io_bcry_exporter.outpipe import bcPrint
 from io_bcry_exporter.utils import join
 
@@ -32,7 +39,6 @@ from bpy_extras.io_utils import ExportHelper
 from collections import OrderedDict
 from datetime import datetime
 from mathutils import Matrix, Vector
-from time import clock
 from xml.dom.minidom import Document, Element, parse, parseString
 import bmesh
 import copy
@@ -49,53 +55,88 @@ class CrytekDaeExporter:
         self._config = config
         self._doc = Document()
         self._m_exporter = export_materials.CrytekMaterialExporter(config)
+        self._geometry_cache = None
+        self._skeletons = {}
+        self._bone_transforms = None
 
     def export(self):
         self._prepare_for_export()
 
-        root_element = self._doc.createElement('collada')
-        root_element.setAttribute(
-            "xmlns", "http://www.collada.org/2005/11/COLLADASchema")
-        root_element.setAttribute("version", "1.4.1")
-        self._doc.appendChild(root_element)
-        self._create_file_header(root_element)
+        if self._config.use_geometry_cache:
+            self._geometry_cache = GeometryCache(
+                self._config.geometry_cache_dir,
+                self._config.geometry_cache_size * 1024 * 1024)
 
-        if self._config.generate_materials:
-            self._m_exporter.generate_materials()
-
-        # Just here for future use:
-        self._export_library_cameras(root_element)
-        self._export_library_lights(root_element)
-        ###
-
-        self._export_library_images(root_element)
-        self._export_library_effects(root_element)
-        self._export_library_materials(root_element)
-        self._export_library_geometries(root_element)
+        filepath = bpy.path.ensure_ext(self._config.filepath, ".dae")
+        with timers.export_timer(filepath, self._config.export_timings,
+                                 self._config.export_memory):
+            return self._export(filepath)
 
-        utils.add_fakebones()
-        try:
-            self._export_library_controllers(root_element)
-            self._export_library_animation_clips_and_animations(root_element)
-            self._export_library_visual_scenes(root_element)
-        except RuntimeError:
-            pass
-        finally:
-            utils.remove_fakebones()
+    def get_texture_conversions(self):
+        return self._m_exporter.get_texture_conversions()
 
-        self._export_scene(root_element)
+    def _export(self, filepath):
+        if self._config.generate_materials:
+            with timers.stage("materials"):
+                self._m_exporter.generate_materials()
+
+        with self._create_dae_writer(filepath) as root_element, \
+                utils.scene_index(self._config.export_selected_nodes):
+            self._create_file_header(root_element)
+
+            # Just here for future use:
+            self._export_library_cameras(root_element)
+            self._export_library_lights(root_element)
+            ###
+
+            with timers.stage("images"):
+                self._export_library_images(root_element)
+            with timers.stage("effects"):
+                self._export_library_effects(root_element)
+            with timers.stage("library materials"):
+                self._export_library_materials(root_element)
+            with timers.stage("geometries"):
+                self._export_library_geometries(root_element)
+
+            try:
+                with timers.stage("controllers"):
+                    self._export_library_controllers(root_element)
+                self._export_library_animation_clips_and_animations(
+                    root_element)
+                with timers.stage("visual scene"):
+                    self._export_library_visual_scenes(root_element)
+            except RuntimeError:
+                pass
+
+            self._export_scene(root_element)
+
+        if self._geometry_cache is not None:
+            self._geometry_cache.save()
+            self._geometry_cache.report()
 
         converter = RCInstance(self._config)
-        converter.convert_dae(self._doc)
+        conversion = converter.convert_dae(filepath)
 
         write_scripts(self._config)
 
+        return conversion
+
     def _prepare_for_export(self):
         utils.clean_file(self._config.export_selected_nodes)
 
         if self._config.fix_weights:
             utils.fix_weights()
 
+    def _create_dae_writer(self, filepath):
+        # Indentation is only worth its cost for DAE files kept on disk.
+        indent = 4 if self._config.save_dae else 0
+        writer = DaeWriter(filepath, indent)
+        writer.start_element('collada', (
+            ("xmlns", "http://www.collada.org/2005/11/COLLADASchema"),
+            ("version", "1.4.1")))
+
+        return writer
+
     def _create_file_header(self, parent_element):
         asset = self._doc.createElement('asset')
         parent_element.appendChild(asset)
@@ -174,87 +215,109 @@ class CrytekDaeExporter:
 #------------------------------------------------------------------
 
     def _export_library_geometries(self, parent_element):
-        libgeo = self._doc.createElement("library_geometries")
-        parent_element.appendChild(libgeo)
+        # Each geometry is streamed out as soon as it is finished.
+        parent_element.start_element("library_geometries")
+        libgeo = parent_element
         for group in utils.get_mesh_export_nodes(
                 self._config.export_selected_nodes):
-            for object_ in group.objects:
-                if object_.type != 'MESH':
-                    continue
-
-                apply_modifiers = self._config.apply_modifiers
-                if utils.get_node_type(group) in ('chr', 'skin'):
-                    apply_modifiers = False
-
-                bmesh_, backup_info = utils.get_bmesh(object_, apply_modifiers)
-                geometry_node = self._doc.createElement("geometry")
-                geometry_name = utils.get_geometry_name(group, object_)
-                geometry_node.setAttribute("id", geometry_name)
-                mesh_node = self._doc.createElement("mesh")
-
-                print()
-                bcPrint(
-                    '"{}" object is being processed...'.format(
-                        object_.name))
-
-                start_time = clock()
-                self._write_positions(bmesh_, mesh_node, geometry_name)
-                bcPrint(
-                    'Positions have been writed {:.4f} seconds.'.format(
-                        clock() - start_time))
-
-                start_time = clock()
-                self._write_normals(object_, bmesh_, mesh_node, geometry_name)
-                bcPrint(
-                    'Normals have been writed {:.4f} seconds.'.format(
-                        clock() - start_time))
-
-                start_time = clock()
-                self._write_uvs(object_, bmesh_, mesh_node, geometry_name)
+            with timers.stage(group.name):
+                for object_ in group.objects:
+                    if object_.type != 'MESH':
+                        continue
+
+                    with timers.stage(object_.name):
+                        self._export_geometry(libgeo, group, object_)
+
+        parent_element.end_element()
+
+    def _export_geometry(self, libgeo, group, object_):
+        apply_modifiers = self._config.apply_modifiers
+        if utils.get_node_type(group) in ('chr', 'skin'):
+            apply_modifiers = False
+
+        with timers.stage("mesh"):
+            mesh = utils.get_evaluated_mesh(object_, apply_modifiers)
+        geometry_name = utils.get_geometry_name(group, object_)
+
+        print()
+        cache_key = None
+        if self._geometry_cache is not None:
+            cache_key = self._get_geometry_cache_key(
+                object_, mesh, geometry_name, apply_modifiers)
+            fragment = self._geometry_cache.get(cache_key)
+            if fragment is not None:
+                with timers.stage("write"):
+                    libgeo.write_raw(fragment)
+                utils.clear_bmesh(None, mesh)
                 bcPrint(
-                    'UVs have been writed {:.4f} seconds.'.format(
-                        clock() - start_time))
+                    '"{}" object has been taken from geometry '
+                    'cache for "{}" node.'.format(object_.name, group.name))
+                return
 
-                start_time = clock()
-                self._write_vertex_colors(
-                    object_, bmesh_, mesh_node, geometry_name)
-                bcPrint(
-                    'Vertex colors have been writed {:.4f} seconds.'.format(
-                        clock() - start_time))
+        with timers.stage("mesh"):
+            bmesh_, mesh = utils.get_bmesh(object_, apply_modifiers, mesh)
+
+        geometry_node = self._doc.createElement("geometry")
+        geometry_node.setAttribute("id", geometry_name)
+        mesh_node = self._doc.createElement("mesh")
+
+        bcPrint('"{}" object is being processed...'.format(object_.name))
+
+        with timers.stage("positions"):
+            self._write_positions(bmesh_, mesh, mesh_node, geometry_name)
+        with timers.stage("normals"):
+            self._write_normals(
+                object_, bmesh_, mesh, mesh_node, geometry_name)
+        with timers.stage("uvs"):
+            self._write_uvs(object_, bmesh_, mesh, mesh_node, geometry_name)
+        with timers.stage("vertex colors"):
+            self._write_vertex_colors(
+                object_, bmesh_, mesh, mesh_node, geometry_name)
+        with timers.stage("vertices"):
+            self._write_vertices(mesh_node, geometry_name)
+        with timers.stage("triangles"):
+            self._write_triangle_list(
+                object_, bmesh_, mesh_node, geometry_name)
+
+        extra = self._create_double_sided_extra("MAYA")
+        mesh_node.appendChild(extra)
+        geometry_node.appendChild(mesh_node)
+        with timers.stage("write"):
+            if cache_key is not None:
+                fragment = libgeo.serialize(geometry_node)
+                self._geometry_cache.put(cache_key, fragment)
+                libgeo.write_raw(fragment)
+            else:
+                libgeo.appendChild(geometry_node)
 
-                start_time = clock()
-                self._write_vertices(mesh_node, geometry_name)
-                bcPrint(
-                    'Vertices have been writed {:.4f} seconds.'.format(
-                        clock() - start_time))
+        utils.clear_bmesh(bmesh_, mesh)
+        bcPrint('"{}" object has been processed for "{}" node.'.format(
+            object_.name, group.name))
 
-                start_time = clock()
-                self._write_triangle_list(
-                    object_, bmesh_, mesh_node, geometry_name)
-                bcPrint(
-                    'Triangle list have been writed {:.4f} seconds.'.format(
-                        clock() - start_time))
+    def _get_geometry_cache_key(self, object_, mesh, geometry_name,
+                                apply_modifiers):
+        slot_names = self._m_exporter.get_material_names_for_slots(object_)
+        options = (geometry_name,
+                   tuple(slot_names),
+                   apply_modifiers,
+                   self._config.custom_normals,
+                   self._config.save_dae)
 
-                extra = self._create_double_sided_extra("MAYA")
-                mesh_node.appendChild(extra)
-                geometry_node.appendChild(mesh_node)
-                libgeo.appendChild(geometry_node)
+        return get_geometry_fingerprint(object_, mesh, options)
 
-                utils.clear_bmesh(object_, backup_info)
-                bcPrint(
-                    '"{}" object has been processed for "{}" node.'.format(
-                        object_.name, group.name))
-
-    def _write_positions(self, bmesh_, mesh_node, geometry_name):
-        float_positions = []
-        for vertex in bmesh_.verts:
-            float_positions.extend(vertex.co)
+    def _write_positions(self, bmesh_, mesh, mesh_node, geometry_name):
+        if utils.is_bulk_extraction_available():
+            float_positions = utils.get_vertex_positions(mesh)
+        else:
+            float_positions = []
+            for vertex in bmesh_.verts:
+                float_positions.extend(vertex.co)
 
         id_ = "{!s}-pos".format(geometry_name)
         source = utils.write_source(id_, "float", float_positions, "XYZ")
         mesh_node.appendChild(source)
 
-    def _write_normals(self, object_, bmesh_, mesh_node, geometry_name):
+    def _write_normals(self, object_, bmesh_, mesh, mesh_node, geometry_name):
         split_angle = 0
         use_edge_angle = False
         use_edge_sharp = False
@@ -271,7 +334,12 @@ class CrytekDaeExporter:
                     split_angle = modifier.split_angle
 
         float_normals = None
-        if self._config.custom_normals:
+        if utils.is_bulk_extraction_available():
+            if self._config.custom_normals:
+                use_edge_sharp = False
+            float_normals = utils.calc_split_normals(
+                mesh, use_edge_angle, use_edge_sharp, split_angle)
+        elif self._config.custom_normals:
             float_normals = utils.get_custom_normals(bmesh_, use_edge_angle,
                                                      split_angle)
         else:
@@ -282,32 +350,37 @@ class CrytekDaeExporter:
         source = utils.write_source(id_, "float", float_normals, "XYZ")
         mesh_node.appendChild(source)
 
-    def _write_uvs(self, object_, bmesh_, mesh_node, geometry_name):
+    def _write_uvs(self, object_, bmesh_, mesh, mesh_node, geometry_name):
         uv_layer = bmesh_.loops.layers.uv.active
-        if object_.data.uv_layers.active is None:
+        if mesh.uv_layers.active is None:
             bcPrint(
                 "{} object has no a UV map, creating a default UV...".format(
                     object_.name))
             uv_layer = bmesh_.loops.layers.uv.new()
 
-        float_uvs = []
-
-        for face in bmesh_.faces:
-            for loop in face.loops:
-                float_uvs.extend(loop[uv_layer].uv)
+        if utils.is_bulk_extraction_available():
+            float_uvs = utils.get_loop_uvs(mesh)
+        else:
+            float_uvs = []
+            for face in bmesh_.faces:
+                for loop in face.loops:
+                    float_uvs.extend(loop[uv_layer].uv)
 
         id_ = "{!s}-uvs".format(geometry_name)
         source = utils.write_source(id_, "float", float_uvs, "ST")
         mesh_node.appendChild(source)
 
-    def _write_vertex_colors(self, object_, bmesh_, mesh_node, geometry_name):
+    def _write_vertex_colors(self, object_, bmesh_, mesh, mesh_node,
+                             geometry_name):
         float_colors = []
         alpha_found = False
 
         active_layer = bmesh_.loops.layers.color.active
-        if object_.data.vertex_colors:
-            if active_layer.name.lower() == 'alpha':
-                alpha_found = True
+        if mesh.vertex_colors:
+            alpha_found = active_layer.name.lower() == 'alpha'
+            if utils.is_bulk_extraction_available():
+                float_colors = utils.get_vertex_colors(mesh, alpha_found)
+            elif alpha_found:
                 for vert in bmesh_.verts:
                     loop = vert.link_loops[0]
                     color = loop[active_layer]
@@ -318,7 +391,7 @@ class CrytekDaeExporter:
                     loop = vert.link_loops[0]
                     float_colors.extend(loop[active_layer])
 
-        if float_colors:
+        if len(float_colors):
             id_ = "{!s}-vcol".format(geometry_name)
             params = ("RGBA" if alpha_found else "RGB")
             source = utils.write_source(id_, "float", float_colors, params)
@@ -332,36 +405,18 @@ class CrytekDaeExporter:
         mesh_node.appendChild(vertices)
 
     def _write_triangle_list(self, object_, bmesh_, mesh_node, geometry_name):
-        tessfaces = utils.get_tessfaces(bmesh_)
-        current_material_index = 0
-        for material, materialname in self._m_exporter.get_materials_for_object(
-                object_).items():
-            triangles = ''
-            triangle_count = 0
-            normal_uv_index = 0
-            for face in bmesh_.faces:
-                norm_uv_indices = {}
-
-                for index in range(0, len(face.verts)):
-                    norm_uv_indices[
-                        str(face.verts[index].index)] = normal_uv_index + index
-
-                if face.material_index == current_material_index:
-                    for tessface in tessfaces[face.index]:
-                        triangle_count += 1
-                        for vert in tessface:
-                            normal_uv = norm_uv_indices[str(vert)]
-                            dae_vertex = self._write_vertex_data(
-                                vert, normal_uv, normal_uv, object_.data.vertex_colors)
-                            triangles = join(triangles, dae_vertex)
-
-                normal_uv_index += len(face.verts)
-
-            current_material_index += 1
-
-            if triangle_count == 0:
+        vertex_colors = bool(object_.data.vertex_colors)
+        stride = 12 if vertex_colors else 9
+        triangle_indices = utils.get_triangle_indices(bmesh_, vertex_colors)
+
+        slot_names = self._m_exporter.get_material_names_for_slots(object_)
+        for material_index, materialname in enumerate(slot_names):
+            triangles = triangle_indices.get(material_index)
+            if not triangles or materialname is None:
                 continue
 
+            triangle_count = len(triangles) // stride
+
             triangle_list = self._doc.createElement('triangles')
             triangle_list.setAttribute('material', materialname)
             triangle_list.setAttribute('count', str(triangle_count))
@@ -385,7 +440,7 @@ class CrytekDaeExporter:
                     2,
                     'uvs',
                     'TEXCOORD'))
-            if object_.data.vertex_colors:
+            if vertex_colors:
                 inputs.append(
                     utils.write_input(
                         geometry_name,
@@ -397,19 +452,12 @@ class CrytekDaeExporter:
                 triangle_list.appendChild(input)
 
             p = self._doc.createElement('p')
-            p_text = self._doc.createTextNode(triangles)
+            p_text = self._doc.createTextNode(utils.ints_to_string(triangles))
             p.appendChild(p_text)
 
             triangle_list.appendChild(p)
             mesh_node.appendChild(triangle_list)
 
-    def _write_vertex_data(self, vert, normal, uv, vertex_colors):
-        if vertex_colors:
-            return "{:d} {:d} {:d} {:d} ".format(
-                vert, normal, uv, vert)
-        else:
-            return "{:d} {:d} {:d} ".format(vert, normal, uv)
-
     def _create_double_sided_extra(self, profile):
         extra = self._doc.createElement("extra")
         technique = self._doc.createElement("technique")
@@ -428,7 +476,8 @@ class CrytekDaeExporter:
 # -------------------------------------------------------------------------
 
     def _export_library_controllers(self, parent_element):
-        library_node = self._doc.createElement("library_controllers")
+        parent_element.start_element("library_controllers")
+        library_node = parent_element
 
         ALLOWED_NODE_TYPES = ('chr', 'skin')
         for group in utils.get_mesh_export_nodes(
@@ -439,18 +488,19 @@ class CrytekDaeExporter:
                     if not utils.is_bone_geometry(object_):
                         armature = utils.get_armature_for_object(object_)
                         if armature is not None:
-                            self._process_bones(library_node,
-                                                group,
-                                                object_,
-                                                armature)
+                            with timers.stage(group.name), \
+                                    timers.stage(object_.name):
+                                self._process_bones(library_node,
+                                                    group,
+                                                    object_,
+                                                    armature)
 
-        parent_element.appendChild(library_node)
+        parent_element.end_element()
 
     def _process_bones(self, parent_node, group, object_, armature):
         id_ = "{!s}_{!s}".format(armature.name, object_.name)
 
         controller_node = self._doc.createElement("controller")
-        parent_node.appendChild(controller_node)
         controller_node.setAttribute("id", id_)
 
         skin_node = self._doc.createElement("skin")
@@ -475,13 +525,16 @@ class CrytekDaeExporter:
         joints.appendChild(input)
         skin_node.appendChild(joints)
 
+        parent_node.appendChild(controller_node)
+
     def _process_bone_joints(self, object_, armature, skin_node, group):
 
         bones = utils.get_bones(armature)
+        skeleton = self._get_skeleton_index(bones, object_, group)
         id_ = "{!s}_{!s}-joints".format(armature.name, object_.name)
         bone_names = []
         for bone in bones:
-            props_name = self._create_properties_name(bone, group)
+            props_name = skeleton.properties_names[bone.name]
             bone_name = "{!s}{!s}".format(bone.name, props_name)
             bone_names.append(bone_name)
         source = utils.write_source(id_, "IDREF", bone_names, [])
@@ -489,11 +542,10 @@ class CrytekDaeExporter:
 
     def _process_bone_matrices(self, object_, armature, skin_node):
 
-        bones = utils.get_bones(armature)
         bone_matrices = []
         for bone in armature.pose.bones:
 
-            bone_matrix = utils.transform_bone_matrix(bone)
+            bone_matrix = utils.transform_rest_bone_matrix(bone.bone)
             bone_matrices.extend(utils.matrix_to_array(bone_matrix))
 
         id_ = "{!s}_{!s}-matrices".format(armature.name, object_.name)
@@ -503,33 +555,13 @@ class CrytekDaeExporter:
     def _process_bone_weights(self, object_, armature, skin_node):
 
         bones = utils.get_bones(armature)
-        group_weights = []
-        vw = ""
-        vertex_groups_lengths = ""
-        vertex_count = 0
-        bone_list = {}
-
-        for bone_id, bone in enumerate(bones):
-            bone_list[bone.name] = bone_id
-
-        for vertex in object_.data.vertices:
-            vertex_group_count = 0
-            for group in vertex.groups:
-                group_name = object_.vertex_groups[group.group].name
-                if (group.weight == 0 or
-                        group_name not in bone_list):
-                    continue
-                if vertex_group_count == 8:
-                    bcPrint("Too many bone references in {}:{} vertex group"
-                            .format(object_.name, group_name))
-                    continue
-                group_weights.append(group.weight)
-                vw = "{}{} {} ".format(vw, bone_list[group_name], vertex_count)
-                vertex_count += 1
-                vertex_group_count += 1
-
-            vertex_groups_lengths = "{}{} ".format(vertex_groups_lengths,
-                                                   vertex_group_count)
+        group_weights, vertex_groups_lengths, vw, capped_vertices = \
+            utils.get_skin_weights(object_, bones)
+
+        if capped_vertices:
+            bcPrint("Too many bone references in {} vertices of {}, "
+                    "the weakest ones are skipped.".format(
+                        capped_vertices, object_.name))
 
         id_ = "{!s}_{!s}-weights".format(armature.name, object_.name)
         source = utils.write_source(id_, "float", group_weights, [])
@@ -545,12 +577,13 @@ class CrytekDaeExporter:
         vertex_weights.appendChild(input)
 
         vcount = self._doc.createElement("vcount")
-        vcount_text = self._doc.createTextNode(vertex_groups_lengths)
+        vcount_text = self._doc.createTextNode(
+            utils.ints_to_string(vertex_groups_lengths))
         vcount.appendChild(vcount_text)
         vertex_weights.appendChild(vcount)
 
         v = self._doc.createElement("v")
-        v_text = self._doc.createTextNode(vw)
+        v_text = self._doc.createTextNode(utils.ints_to_string(vw))
         v.appendChild(v_text)
         vertex_weights.appendChild(v)
 
@@ -573,12 +606,10 @@ class CrytekDaeExporter:
 # ---------------------------------------------------------------------
 
     def _export_library_visual_scenes(self, parent_element):
-        current_element = self._doc.createElement("library_visual_scenes")
-        visual_scene = self._doc.createElement("visual_scene")
-        visual_scene.setAttribute("id", "scene")
-        visual_scene.setAttribute("name", "scene")
-        current_element.appendChild(visual_scene)
-        parent_element.appendChild(current_element)
+        parent_element.start_element("library_visual_scenes")
+        parent_element.start_element("visual_scene", (("id", "scene"),
+                                                      ("name", "scene")))
+        visual_scene = parent_element
 
         if utils.get_mesh_export_nodes(self._config.export_selected_nodes):
             if utils.are_duplicate_nodes():
@@ -587,10 +618,14 @@ class CrytekDaeExporter:
 
             for group in utils.get_mesh_export_nodes(
                     self._config.export_selected_nodes):
-                self._write_export_node(group, visual_scene)
+                with timers.stage(group.name):
+                    self._write_export_node(group, visual_scene)
         else:
             pass  # TODO: Handle No Export Nodes Error
 
+        parent_element.end_element()
+        parent_element.end_element()
+
     def _write_export_node(self, group, visual_scene):
         if not self._config.export_for_lumberyard:
             node_name = "CryExportNode_{}".format(utils.get_node_name(group))
@@ -618,7 +653,6 @@ class CrytekDaeExporter:
     def _write_visual_scene_node(self, objects, parent_node, group):
         for object_ in objects:
             if (object_.type == "MESH" or object_.type == 'EMPTY') \
-                    and not utils.is_fakebone(object_) \
                     and not utils.is_lod_geometry(object_) \
                     and not utils.is_there_a_parent_releation(object_, group):
                 prop_name = object_.name
@@ -668,11 +702,9 @@ class CrytekDaeExporter:
         return parent_node
 
     def _write_child_objects(self, parent_object, parent_node, group):
-        for child_object in parent_object.children:
+        for child_object in utils.get_children_in_group(parent_object, group):
             if utils.is_lod_geometry(child_object):
                 continue
-            if not utils.is_object_in_group(child_object, group):
-                continue
 
             prop_name = child_object.name
             node_type = utils.get_node_type(group)
@@ -728,25 +760,25 @@ class CrytekDaeExporter:
         return node
 
     def _write_bone_list(self, bones, object_, parent_node, group):
-        scene = bpy.context.scene
-        bone_names = []
+        skeleton = self._get_skeleton_index(bones, object_, group)
+        self.__write_bone_list(bones, object_, parent_node, group, skeleton)
 
+    def __write_bone_list(self, bones, object_, parent_node, group, skeleton):
         for bone in bones:
-            props_name = self._create_properties_name(bone, group)
-            props_ik = self._create_ik_properties(bone, object_)
+            props_name = skeleton.properties_names[bone.name]
+            props_ik = self._create_ik_properties(bone, skeleton)
             bone_name = join(bone.name, props_name, props_ik)
-            bone_names.append(bone_name)
 
             node = self._doc.createElement("node")
             node.setAttribute("id", bone_name)
             node.setAttribute("name", bone_name)
             node.setIdAttribute("id")
 
-            fakebone = utils.get_fakebone(bone.name)
-            if fakebone is not None:
-                self._write_transforms(fakebone, node)
+            transform = skeleton.transforms[bone.name]
+            if transform is not None:
+                self._write_transforms(transform, node)
 
-                bone_geometry = utils.get_bone_geometry(bone)
+                bone_geometry = skeleton.bone_geometries[bone.name]
                 if bone_geometry is not None:
                     geo_name = utils.get_geometry_name(group, bone_geometry)
                     instance = self._create_bone_instance(
@@ -758,15 +790,41 @@ class CrytekDaeExporter:
                     if extra is not None:
                         node.appendChild(extra)
 
-            elif utils.is_physic_bone(bone):
-                bone_geometry = utils.get_bone_geometry(bone)
-                if fakebone is not None:
-                    self._write_transforms(fakebone, node)
-
             parent_node.appendChild(node)
 
             if bone.children:
-                self._write_bone_list(bone.children, object_, node, group)
+                self.__write_bone_list(bone.children, object_, node, group,
+                                       skeleton)
+
+    def _get_skeleton_index(self, bones, object_, group):
+        # Property names depend on the node name, so indices are kept per
+        # export node.
+        if not bones:
+            # Armatures without bones have nothing to index.
+            return utils.SkeletonIndex((), object_,
+                                       utils.get_node_name(group), {})
+
+        armature = bones[0].id_data
+        key = (armature.name, object_.name, group.name)
+        skeleton = self._skeletons.get(key)
+        if skeleton is None:
+            skeleton = utils.SkeletonIndex(armature.bones, object_,
+                                           utils.get_node_name(group),
+                                           self._get_bone_transforms())
+            self._skeletons[key] = skeleton
+
+        return skeleton
+
+    def _get_bone_transforms(self):
+        # Rest pose transforms of the bones of the skeleton.
+        if self._bone_transforms is None:
+            self._bone_transforms = {}
+            armature = utils.get_armature()
+            if armature is not None:
+                self._bone_transforms = utils.get_rest_bone_transforms(
+                    armature)
+
+        return self._bone_transforms
 
     def _create_bone_instance(self, bone_geometry, geometry_name):
         instance = None
@@ -1032,23 +1090,14 @@ class CrytekDaeExporter:
         return helper
 
     def _create_properties_name(self, bone, group):
-        bone_name = bone.name.replace("__", "*")
-        node_name = utils.get_node_name(group)
-        props_name = '%{!s}%--PRprops_name={!s}'.format(node_name, bone_name)
-
-        return props_name
+        return utils.get_properties_name(bone.name, utils.get_node_name(group))
 
-    def _create_ik_properties(self, bone, object_):
+    def _create_ik_properties(self, bone, skeleton):
         props = ""
-        if utils.is_physic_bone(bone):
-
-            armature_object = bpy.data.objects[object_.name[:-5]]
-            pose_bone = armature_object.pose.bones[bone.name[:-5]]
+        if bone.name in skeleton.ik_limits:
 
-            xIK, yIK, zIK = udp.get_bone_ik_max_min(pose_bone)
-
-            damping, spring, spring_tension = udp.get_bone_ik_properties(
-                pose_bone)
+            xIK, yIK, zIK, damping, spring, spring_tension = \
+                skeleton.ik_limits[bone.name]
 
             props = join(
                 xIK,
@@ -1102,8 +1151,94 @@ def save(config):
     if not config.disable_rc and not os.path.isfile(config.rc_path):
         raise exceptions.NoRcSelectedException
 
-    exporter = CrytekDaeExporter(config)
-    exporter.export()
+    state = None
+    texture_conversions = []
+    if config.shard_count > 1:
+        nodes, texture_conversion = __prepare_shard(config)
+        if texture_conversion is not None:
+            texture_conversions.append(texture_conversion)
+
+        if not nodes:
+            bcPrint("Shard {} has no export nodes.".format(config.shard_index))
+            __wait_for_conversions(texture_conversions)
+            return
+
+        utils.set_export_node_filter(nodes)
+
+    elif config.incremental_export:
+        # Node names are cleaned first since they key the export state.
+        utils.clean_file(config.export_selected_nodes)
+        state = incremental.ExportState(config)
+        dirty_nodes = state.get_dirty_nodes()
+        if not dirty_nodes:
+            bcPrint("All export nodes are up to date.")
+            return
+
+        bcPrint("{} export nodes have changed: {}".format(
+            len(dirty_nodes), ", ".join(node.name for node in dirty_nodes)))
+        utils.set_export_node_filter(dirty_nodes)
+
+    try:
+        exporter = CrytekDaeExporter(config)
+        conversion = exporter.export()
+        texture_conversions.extend(exporter.get_texture_conversions())
+    finally:
+        utils.set_export_node_filter()
+
+    # Export nodes are up to date only after RC has converted them.
+    if state is not None:
+        conversion.add_done_callback(
+            lambda conversion: __save_state(state, conversion))
+
+    __wait_for_conversions([conversion] + texture_conversions)
+
+
+def __wait_for_conversions(conversions):
+    # Blender exits after a background export, so RC has to finish first.
+    if bpy.app.background:
+        wait_for_conversions(conversions)
+
+
+def __save_state(state, conversion):
+    if conversion.cancelled() or conversion.exception() is not None:
+        return
+
+    state.save(conversion.result())
+
+
+def __prepare_shard(config):
+    utils.clean_file(config.export_selected_nodes)
+    if config.incremental_export:
+        bcPrint("Incremental export is not used for sharded exports.",
+                'warning')
+
+    # Materials and textures are shared by the nodes of all shards, so
+    # only the first shard writes them and it writes them for every node.
+    texture_conversion = None
+    if config.shard_index == 0:
+        if config.generate_materials:
+            texture_conversion = material_utils.generate_mtl_files(config)
+        elif config.convert_textures:
+            registry = material_utils.MaterialRegistry(
+                config.export_selected_nodes)
+            images = []
+            for material in registry.materials.values():
+                images.extend(material_utils.get_textures(material))
+            texture_conversion = material_utils.convert_image_to_dds(
+                images, config)
+
+    config.generate_materials = False
+    config.convert_textures = False
+
+    nodes = utils.get_shard_nodes(
+        utils.get_export_nodes(config.export_selected_nodes),
+        config.shard_index, config.shard_count)
+
+    bcPrint("Shard {} of {} exports {} nodes: {}".format(
+        config.shard_index + 1, config.shard_count, len(nodes),
+        ", ".join(node.name for node in nodes)))
+
+    return nodes, texture_conversion
 
 
 def register():
@@ -16,11 +16,14 @@ if "bpy" in locals():
     import imp
     imp.reload(utils)
     imp.reload(exceptions)
+    imp.reload(keyframe_reduction)
+    imp.reload(timers)
 else:
     import bpy
-    from io_bcry_exporter import export, utils, exceptions
+    from io_bcry_exporter import export, utils, exceptions, \
+        keyframe_reduction, timers
 
-from io_bcry_exporter.rc import RCInstance
+from io_bcry_exporter.rc import RCInstance, wait_for_conversions
 from io_bcry_exporter.outpipe import bcPrint
 
 from xml.dom.minidom import Document, Element, parse, parseString
@@ -40,28 +43,38 @@ class CrytekDaeAnimationExporter(export.CrytekDaeExporter):
     def __init__(self, config):
         self._config = config
         self._doc = Document()
+        self._skeletons = {}
+        self._bone_transforms = {}
+        self._key_counts = [0, 0]
+        self._fcurves = {}
 
     def export(self):
-        self._prepare_for_export()
+        filepath = bpy.path.ensure_ext(self._config.filepath, ".dae")
+        with timers.export_timer(filepath, self._config.export_timings,
+                                 self._config.export_memory):
+            with timers.stage("prepare"):
+                self._prepare_for_export()
 
-        root_element = self._doc.createElement('collada')
-        root_element.setAttribute(
-            "xmlns", "http://www.collada.org/2005/11/COLLADASchema")
-        root_element.setAttribute("version", "1.4.1")
-        self._doc.appendChild(root_element)
+            with self._create_dae_writer(filepath) as root_element:
+                self._export_animation_nodes(root_element)
+
+            converter = RCInstance(self._config)
+            return converter.convert_dae(filepath)
+
+    def _export_animation_nodes(self, root_element):
         self._create_file_header(root_element)
 
+        # Animations are streamed per node, clips and visual scene nodes
+        # are small and written after them.
         libanmcl = self._doc.createElement("library_animation_clips")
-        libanm = self._doc.createElement("library_animations")
-        root_element.appendChild(libanmcl)
-        root_element.appendChild(libanm)
+        root_element.start_element("library_animations")
+        libanm = root_element
 
         lib_visual_scene = self._doc.createElement("library_visual_scenes")
         visual_scene = self._doc.createElement("visual_scene")
         visual_scene.setAttribute("id", "scene")
         visual_scene.setAttribute("name", "scene")
         lib_visual_scene.appendChild(visual_scene)
-        root_element.appendChild(lib_visual_scene)
 
         initial_frame_active = bpy.context.scene.frame_current
         initial_frame_start = bpy.context.scene.frame_start
@@ -75,11 +88,9 @@ class CrytekDaeAnimationExporter(export.CrytekDaeExporter):
 
             if node_type in ALLOWED_NODE_TYPES:
                 object_ = None
-                layers = None
 
                 if node_type == 'i_caf':
                     object_ = utils.get_armature_from_node(group)
-                    layers = utils.activate_all_bone_layers(object_)
                 elif node_type == 'anm':
                     object_ = group.objects[0]
 
@@ -94,19 +105,18 @@ class CrytekDaeAnimationExporter(export.CrytekDaeExporter):
                 bcPrint("Animation frame range are [{} - {}]".format(
                     frame_start, frame_end))
 
-                if node_type == 'i_caf':
-                    utils.add_fakebones(group)
                 try:
-                    self._export_library_animation_clips_and_animations(
-                        libanmcl, libanm, group)
-                    self._export_library_visual_scenes(visual_scene, group)
+                    with timers.stage("animations"), \
+                            timers.stage(group.name):
+                        self._export_library_animation_clips_and_animations(
+                            libanmcl, libanm, group)
+                    with timers.stage("visual scene"), \
+                            timers.stage(group.name):
+                        self._export_library_visual_scenes(visual_scene,
+                                                           group)
                 except RuntimeError:
                     pass
                 finally:
-                    if node_type == 'i_caf':
-                        utils.remove_fakebones()
-                        utils.recover_bone_layers(object_, layers)
-
                     bcPrint("Animation has been processed.")
 
         bpy.context.scene.frame_current = initial_frame_active
@@ -114,10 +124,15 @@ class CrytekDaeAnimationExporter(export.CrytekDaeExporter):
         bpy.context.scene.frame_end = initial_frame_end
         print('')
 
+        root_element.end_element()
+        root_element.appendChild(libanmcl)
+        root_element.appendChild(lib_visual_scene)
+
         self._export_scene(root_element)
 
-        converter = RCInstance(self._config)
-        converter.convert_dae(self._doc)
+    def _get_bone_transforms(self):
+        # Skeleton nodes get the pose of the first frame of the clip.
+        return self._bone_transforms
 
     def _prepare_for_export(self):
         utils.clean_file()
@@ -140,57 +155,181 @@ class CrytekDaeAnimationExporter(export.CrytekDaeExporter):
         animation_clip.setAttribute("end", "{:f}".format(
             utils.frame_to_time(scene.frame_end)))
         is_animation = False
+        self._key_counts = [0, 0]
 
         for object_ in group.objects:
             if (object_.type != 'ARMATURE' and object_.animation_data and
                     object_.animation_data.action):
 
                 is_animation = True
+                with timers.stage(object_.name):
+                    self._export_object_animation(
+                        object_, group, libanm, animation_clip, anim_id)
+
+        self._bone_transforms = {}
+        if utils.get_node_type(group) == 'i_caf':
+            armature = utils.get_armature_from_node(group)
+            if armature is not None:
+                self._export_bone_animations(
+                    armature, group, libanm, animation_clip, anim_id)
+                is_animation = True
 
-                props_name = self._create_properties_name(object_, group)
-                bone_name = "{!s}{!s}".format(object_.name, props_name)
+        if is_animation:
+            libanmcl.appendChild(animation_clip)
 
-                for axis in iter(AXES):
-                    animation = self._get_animation_location(
-                        object_, bone_name, axis, anim_id)
-                    if animation is not None:
-                        libanm.appendChild(animation)
+            if self._config.reduce_keyframes:
+                bcPrint("Keyframes reduced from {} to {}.".format(
+                    *self._key_counts))
 
-                for axis in iter(AXES):
-                    animation = self._get_animation_rotation(
-                        object_, bone_name, axis, anim_id)
-                    if animation is not None:
-                        libanm.appendChild(animation)
+    def _export_object_animation(
+            self, object_, group, libanm, animation_clip, anim_id):
+        props_name = self._create_properties_name(object_, group)
+        bone_name = "{!s}{!s}".format(object_.name, props_name)
 
-                self._export_instance_animation_parameters(
-                    object_, animation_clip, anim_id)
+        for axis in iter(AXES):
+            animation = self._get_animation_location(
+                object_, bone_name, axis, anim_id)
+            if animation is not None:
+                libanm.appendChild(animation)
 
-        if is_animation:
-            libanmcl.appendChild(animation_clip)
+        for axis in iter(AXES):
+            animation = self._get_animation_rotation(
+                object_, bone_name, axis, anim_id)
+            if animation is not None:
+                libanm.appendChild(animation)
+
+        self._export_instance_animation_parameters(
+            object_, animation_clip, anim_id)
+
+    def _export_bone_animations(
+            self, armature, group, libanm, animation_clip, anim_id):
+        scene = bpy.context.scene
+        with timers.stage("sample"):
+            channels = utils.sample_bone_animation(
+                armature, scene.frame_start, scene.frame_end)
+        frames = list(range(scene.frame_start, scene.frame_end + 1))
+        node_name = utils.get_node_name(group)
+
+        for bone_name, (locations, rotations) in channels.items():
+            with timers.stage("bones"):
+                self._export_bone_animation(
+                    bone_name, node_name, locations, rotations, frames,
+                    libanm, animation_clip, anim_id)
+
+    def _export_bone_animation(self, bone_name, node_name, locations,
+                               rotations, frames, libanm, animation_clip,
+                               anim_id):
+        props_name = utils.get_properties_name(bone_name, node_name)
+        target_name = "{!s}{!s}".format(bone_name, props_name)
+
+        for axis in iter(AXES):
+            target = "{!s}{!s}{!s}".format(
+                target_name, "/translation.", axis)
+            libanm.appendChild(self._create_sampled_animation(
+                bone_name, "location", axis, frames,
+                locations[AXES[axis]], target, anim_id))
+
+        for axis in iter(AXES):
+            target = "{!s}{!s}{!s}{!s}".format(
+                target_name, "/rotation_", axis, ".ANGLE")
+            libanm.appendChild(self._create_sampled_animation(
+                bone_name, "rotation_euler", axis, frames,
+                rotations[AXES[axis]], target, anim_id))
+
+        self._export_instance_parameter(
+            bone_name, animation_clip, "location", anim_id)
+        self._export_instance_parameter(
+            bone_name, animation_clip, "rotation_euler", anim_id)
+
+        self._bone_transforms[bone_name] = utils.BoneTransform(
+            tuple(values[0] for values in locations),
+            tuple(values[0] for values in rotations),
+            (1.0, 1.0, 1.0))
+
+    def _create_sampled_animation(self, name, attribute_type, axis, frames,
+                                  values, target, anim_id):
+        id_prefix = "{!s}-{!s}_{!s}_{!s}".format(anim_id, name,
+                                                 attribute_type, axis)
+        keyframes = keyframe_reduction.get_bezier_keyframes(frames, values)
+        keyframes = self._reduce_keyframes(
+            keyframes, list(zip(frames, values)), attribute_type)
+        multiplier = 1
+        if attribute_type == "rotation_euler":
+            multiplier = utils.to_degrees
+        sources = self._get_keyframe_sources(keyframes, multiplier)
+
+        return self._create_animation_element(id_prefix, sources, target)
+
+    def _reduce_keyframes(self, keyframes, samples, attribute_type):
+        self._key_counts[0] += len(keyframes)
+        if self._config.reduce_keyframes:
+            if attribute_type == "location":
+                tolerance = self._config.location_tolerance
+            else:
+                tolerance = self._config.rotation_tolerance / utils.to_degrees
+
+            keyframes = keyframe_reduction.reduce_keyframes(
+                keyframes, samples, tolerance)
+        self._key_counts[1] += len(keyframes)
+
+        return keyframes
+
+    def _get_keyframe_sources(self, keyframes, multiplier):
+        sources = {
+            "input": [],
+            "output": [],
+            "interpolation": [],
+            "intangent": [],
+            "outangent": []
+        }
+        frames = []
+        for keyframe in keyframes:
+            frames.extend((keyframe.frame,
+                           keyframe.handle_left[0],
+                           keyframe.handle_right[0]))
+            sources["output"].append(keyframe.value * multiplier)
+            sources["interpolation"].append(keyframe.interpolation)
+
+        times = utils.frames_to_times(frames)
+        for i, keyframe in enumerate(keyframes):
+            sources["input"].append(times[3 * i])
+            sources["intangent"].extend(
+                (times[3 * i + 1], keyframe.handle_left[1]))
+            sources["outangent"].extend(
+                (times[3 * i + 2], keyframe.handle_right[1]))
+
+        return sources
+
+    def _get_fcurve(self, action, data_path, array_index):
+        # Actions can be shared, fcurves of each are indexed only once.
+        fcurves = self._fcurves.get(action.name)
+        if fcurves is None:
+            fcurves = {(curve.data_path, curve.array_index): curve
+                       for curve in action.fcurves}
+            self._fcurves[action.name] = fcurves
+
+        return fcurves.get((data_path, array_index))
 
     def _export_instance_animation_parameters(
             self, object_, animation_clip, anim_id):
-        location_exists = rotation_exists = False
-        for curve in object_.animation_data.action.fcurves:
-            for axis in iter(AXES):
-                if curve.array_index == AXES[axis]:
-                    if curve.data_path == "location":
-                        location_exists = True
-                    if curve.data_path == "rotation_euler":
-                        rotation_exists = True
-                    if location_exists and rotation_exists:
-                        break
+        action = object_.animation_data.action
+        location_exists = any(
+            self._get_fcurve(action, "location", index) is not None
+            for index in AXES.values())
+        rotation_exists = any(
+            self._get_fcurve(action, "rotation_euler", index) is not None
+            for index in AXES.values())
 
         if location_exists:
             self._export_instance_parameter(
-                object_, animation_clip, "location", anim_id)
+                object_.name, animation_clip, "location", anim_id)
         if rotation_exists:
             self._export_instance_parameter(
-                object_, animation_clip, "rotation_euler", anim_id)
+                object_.name, animation_clip, "rotation_euler", anim_id)
 
     def _export_instance_parameter(
             self,
-            object_,
+            name,
             animation_clip,
             parameter,
             anim_id):
@@ -198,7 +337,7 @@ class CrytekDaeAnimationExporter(export.CrytekDaeExporter):
             inst = self._doc.createElement("instance_animation")
             inst.setAttribute(
                 "url", "#{!s}-{!s}_{!s}_{!s}".format(
-                    anim_id, object_.name, parameter, axis))
+                    anim_id, name, parameter, axis))
             animation_clip.appendChild(inst)
 
     def _get_animation_location(self, object_, bone_name, axis, anim_id):
@@ -239,53 +378,42 @@ class CrytekDaeAnimationExporter(export.CrytekDaeExporter):
                                  anim_id):
         id_prefix = "{!s}-{!s}_{!s}_{!s}".format(anim_id, object_.name,
                                                  attribute_type, axis)
+
+        curve = self._get_fcurve(object_.animation_data.action,
+                                 attribute_type, AXES[axis])
+        if curve is None:
+            return None
+
+        keyframes = keyframe_reduction.get_fcurve_keyframes(curve)
+        if keyframes and self._config.reduce_keyframes:
+            samples = keyframe_reduction.get_fcurve_samples(curve, keyframes)
+            keyframes = self._reduce_keyframes(
+                keyframes, samples, attribute_type)
+        sources = self._get_keyframe_sources(keyframes, multiplier)
+
+        return self._create_animation_element(id_prefix, sources, target)
+
+    def _create_animation_element(self, id_prefix, sources, target):
         source_prefix = "#{!s}".format(id_prefix)
 
-        for curve in object_.animation_data.action.fcurves:
-            if (curve.data_path ==
-                    attribute_type and curve.array_index == AXES[axis]):
-                keyframe_points = curve.keyframe_points
-                sources = {
-                    "input": [],
-                    "output": [],
-                    "interpolation": [],
-                    "intangent": [],
-                    "outangent": []
-                }
-                for keyframe_point in keyframe_points:
-                    khlx = keyframe_point.handle_left[0]
-                    khly = keyframe_point.handle_left[1]
-                    khrx = keyframe_point.handle_right[0]
-                    khry = keyframe_point.handle_right[1]
-                    frame, value = keyframe_point.co
-
-                    sources["input"].append(utils.frame_to_time(frame))
-                    sources["output"].append(value * multiplier)
-                    sources["interpolation"].append(
-                        keyframe_point.interpolation)
-                    sources["intangent"].extend(
-                        [utils.frame_to_time(khlx), khly])
-                    sources["outangent"].extend(
-                        [utils.frame_to_time(khrx), khry])
-
-                animation_element = self._doc.createElement("animation")
-                animation_element.setAttribute("id", id_prefix)
-
-                for type_, data in sources.items():
-                    anim_node = self._create_animation_node(
-                        type_, data, id_prefix)
-                    animation_element.appendChild(anim_node)
-
-                sampler = self._create_sampler(id_prefix, source_prefix)
-                channel = self._doc.createElement("channel")
-                channel.setAttribute(
-                    "source", "{!s}-sampler".format(source_prefix))
-                channel.setAttribute("target", target)
-
-                animation_element.appendChild(sampler)
-                animation_element.appendChild(channel)
-
-                return animation_element
+        animation_element = self._doc.createElement("animation")
+        animation_element.setAttribute("id", id_prefix)
+
+        for type_, data in sources.items():
+            anim_node = self._create_animation_node(
+                type_, data, id_prefix)
+            animation_element.appendChild(anim_node)
+
+        sampler = self._create_sampler(id_prefix, source_prefix)
+        channel = self._doc.createElement("channel")
+        channel.setAttribute(
+            "source", "{!s}-sampler".format(source_prefix))
+        channel.setAttribute("target", target)
+
+        animation_element.appendChild(sampler)
+        animation_element.appendChild(channel)
+
+        return animation_element
 
     def _create_animation_node(self, type_, data, id_prefix):
         id_ = "{!s}-{!s}".format(id_prefix, type_)
@@ -431,7 +559,11 @@ def save(config):
         raise exceptions.NoRcSelectedException
 
     exporter = CrytekDaeAnimationExporter(config)
-    exporter.export()
+    conversion = exporter.export()
+
+    # Blender exits after a background export, so RC has to finish first.
+    if bpy.app.background:
+        wait_for_conversions([conversion])
 
 
 def register():
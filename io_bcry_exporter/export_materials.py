@@ -36,20 +36,25 @@ class CrytekMaterialExporter:
     def __init__(self, config):
         self._config = config
         self._doc = Document()
-        self._materials = material_utils.get_materials(
+        self._registry = material_utils.MaterialRegistry(
             config.export_selected_nodes)
+        self._materials = self._registry.materials
+        self._texture_conversions = []
 
     def generate_materials(self):
-        material_utils.generate_mtl_files(self._config, self._materials)
+        conversion = material_utils.generate_mtl_files(self._config,
+                                                       self._registry)
+        if conversion is not None:
+            self._texture_conversions.append(conversion)
+
+    def get_texture_conversions(self):
+        return self._texture_conversions
 
     def get_materials_for_object(self, object_):
-        materials = OrderedDict()
-        for material_name, material in self._materials.items():
-            for object_material in object_.data.materials:
-                if material.name == object_material.name:
-                    materials[material] = material_name
+        return self._registry.get_materials_for_object(object_)
 
-        return materials
+    def get_material_names_for_slots(self, object_):
+        return self._registry.get_slot_names(object_)
 
 
 #------------------------------------------------------------------------------
@@ -57,14 +62,13 @@ class CrytekMaterialExporter:
 #------------------------------------------------------------------------------
 
     def export_library_images(self, library_images):
-        images = []
-        for node in utils.get_export_nodes():
-            for material in self._materials:
-                for image in material_utils.get_textures(material):
-                    if image:
-                        images.append(image)
+        images = set()
+        for material in self._materials.values():
+            for image in material_utils.get_textures(material):
+                if image:
+                    images.add(image)
 
-        self._write_texture_nodes(list(set(images)), library_images)
+        self._write_texture_nodes(list(images), library_images)
 
     def _write_texture_nodes(self, images, library_images):
         for image in images:
@@ -80,7 +84,8 @@ class CrytekMaterialExporter:
             library_images.appendChild(image_node)
 
         if self._config.convert_textures:
-            material_utils.convert_image_to_dds(images, self._config)
+            self._texture_conversions.append(
+                material_utils.convert_image_to_dds(images, self._config))
 
 #------------------------------------------------------------------------------
 # Library Effects:
@@ -0,0 +1,173 @@
+#------------------------------------------------------------------------------
+# Name:        geometry_cache.py
+# Purpose:     On-disk cache of exported geometry fragments
+#
+# Created:     17/10/2026
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+
+from io_bcry_exporter.outpipe import bcPrint
+from array import array
+import hashlib
+import os
+import pickle
+import shutil
+import time
+
+
+class GeometryCache:
+    '''Stores serialized <geometry> elements keyed by a fingerprint of the
+    evaluated mesh and the export options which affect it. Least recently
+    used fragments are evicted when the cache grows over its size limit.
+    '''
+
+    __INDEX_FILENAME = 'index.cache'
+
+    def __init__(self, cache_dir, size_limit):
+        self.__cache_dir = cache_dir
+        self.__size_limit = size_limit
+        self.__index_path = os.path.join(cache_dir, self.__INDEX_FILENAME)
+        self.__entries = {}
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.__load()
+
+    def get(self, key):
+        entry = self.__entries.get(key)
+        if entry is not None:
+            try:
+                with open(self.__get_fragment_path(key), 'r',
+                          encoding='utf-8') as f:
+                    fragment = f.read()
+
+                entry[1] = time.time()
+                self.hits += 1
+                return fragment
+
+            except OSError:
+                del self.__entries[key]
+
+        self.misses += 1
+        return None
+
+    def put(self, key, fragment):
+        try:
+            with open(self.__get_fragment_path(key), 'w',
+                      encoding='utf-8') as f:
+                f.write(fragment)
+        except OSError:
+            bcPrint("Geometry cache can not write {!r}.".format(key),
+                    'warning')
+            return
+
+        self.__entries[key] = [len(fragment), time.time()]
+        self.__evict()
+
+    def save(self):
+        try:
+            with open(self.__index_path, 'wb') as f:
+                pickle.dump(self.__entries, f, -1)
+        except OSError:
+            bcPrint("[IO] can not write: {}".format(self.__index_path),
+                    'error')
+
+    def report(self):
+        bcPrint("Geometry cache: {} hits, {} misses.".format(
+            self.hits, self.misses))
+
+    def __load(self):
+        if not os.path.isfile(self.__index_path):
+            return
+
+        try:
+            with open(self.__index_path, 'rb') as f:
+                self.__entries = pickle.load(f)
+        except:
+            bcPrint("[IO] can not read: {}".format(self.__index_path),
+                    'error')
+            self.__entries = {}
+
+    def __evict(self):
+        total_size = sum(entry[0] for entry in self.__entries.values())
+        if total_size <= self.__size_limit:
+            return
+
+        by_last_use = sorted(self.__entries.items(),
+                             key=lambda item: item[1][1])
+        for key, entry in by_last_use:
+            if total_size <= self.__size_limit:
+                break
+
+            try:
+                os.remove(self.__get_fragment_path(key))
+            except OSError:
+                pass
+            del self.__entries[key]
+            total_size -= entry[0]
+
+    def __get_fragment_path(self, key):
+        return os.path.join(self.__cache_dir, "{}.xml".format(key))
+
+
+def clear_cache(cache_dir):
+    if os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
+        bcPrint("Geometry cache has been cleared.")
+
+
+#------------------------------------------------------------------------------
+# Fingerprints:
+#------------------------------------------------------------------------------
+
+def get_geometry_fingerprint(object_, mesh, options):
+    '''Hashes the evaluated mesh data, the modifier stack, the exported
+    material names and the export options into a cache key.
+    '''
+    fingerprint = hashlib.sha1()
+    fingerprint.update(repr(options).encode('utf-8'))
+
+    for modifier in object_.modifiers:
+        settings = [modifier.name, modifier.type, modifier.show_viewport]
+        if modifier.type == 'EDGE_SPLIT':
+            settings.extend((modifier.use_edge_angle,
+                             modifier.use_edge_sharp,
+                             modifier.split_angle))
+        fingerprint.update(repr(settings).encode('utf-8'))
+
+    fingerprint.update(repr((object_.data.use_auto_smooth,
+                             object_.data.auto_smooth_angle)).encode('utf-8'))
+
+    __update_with_collection(fingerprint, mesh.vertices, "co", 'f', 3)
+    __update_with_collection(fingerprint, mesh.edges, "use_edge_sharp", 'b')
+    __update_with_collection(fingerprint, mesh.loops, "vertex_index", 'i')
+    __update_with_collection(fingerprint, mesh.loops, "edge_index", 'i')
+    __update_with_collection(fingerprint, mesh.polygons, "loop_total", 'i')
+    __update_with_collection(fingerprint, mesh.polygons, "material_index", 'i')
+    __update_with_collection(fingerprint, mesh.polygons, "use_smooth", 'b')
+
+    uv_layer = mesh.uv_layers.active
+    if uv_layer is not None:
+        __update_with_collection(fingerprint, uv_layer.data, "uv", 'f', 2)
+
+    color_layer = mesh.vertex_colors.active
+    if color_layer is not None:
+        fingerprint.update(color_layer.name.encode('utf-8'))
+        channels = 3
+        if len(color_layer.data):
+            channels = len(color_layer.data[0].color)
+        __update_with_collection(fingerprint, color_layer.data, "color", 'f',
+                                 channels)
+
+    return fingerprint.hexdigest()
+
+
+def __update_with_collection(fingerprint, collection, attribute, typecode,
+                             size=1):
+    values = array(typecode, [0]) * (len(collection) * size)
+    collection.foreach_get(attribute, values)
+    fingerprint.update(values.tobytes())
@@ -0,0 +1,236 @@
+#------------------------------------------------------------------------------
+# Name:        incremental.py
+# Purpose:     Tracks changed export nodes for incremental exports
+#
+# Created:     17/10/2026
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+
+if "bpy" in locals():
+    import imp
+    imp.reload(utils)
+    imp.reload(material_utils)
+    imp.reload(udp)
+else:
+    import bpy
+    from io_bcry_exporter import utils, material_utils, udp
+
+from io_bcry_exporter.geometry_cache import get_geometry_fingerprint
+from io_bcry_exporter.outpipe import bcPrint
+import hashlib
+import os
+import pickle
+
+
+class ExportState:
+    '''Keeps the fingerprints of export nodes from the last successful export
+    into a directory. Export nodes whose fingerprint differs, or whose RC
+    output is missing, are dirty and have to be exported again.
+    '''
+
+    __STATE_FILENAME = '.bcry_export_state'
+
+    # Export options which change the content of any RC output.
+    __OPTIONS = ('apply_modifiers', 'merge_all_nodes', 'custom_normals',
+                 'vcloth_pre_process', 'generate_materials',
+                 'export_for_lumberyard', 'fix_weights', 'make_chrparams',
+                 'make_cdf')
+
+    __OUTPUT_NODE_TYPES = ('cgf', 'cga', 'chr', 'skin')
+
+    def __init__(self, config):
+        self.__config = config
+        self.__directory = os.path.dirname(
+            bpy.path.ensure_ext(config.filepath, ".dae"))
+        self.__state_path = os.path.join(self.__directory,
+                                         self.__STATE_FILENAME)
+        self.__fingerprints = self.__load()
+        self.__pending = {}
+
+    def get_dirty_nodes(self):
+        options = tuple(getattr(self.__config, option)
+                        for option in self.__OPTIONS)
+
+        dirty_nodes = []
+        for node in utils.get_export_nodes(
+                self.__config.export_selected_nodes):
+            apply_modifiers = self.__config.apply_modifiers
+            if utils.get_node_type(node) in ('chr', 'skin'):
+                apply_modifiers = False
+
+            fingerprint = get_node_fingerprint(node, options,
+                                               apply_modifiers)
+            self.__pending[node.name] = fingerprint
+
+            if self.__fingerprints.get(node.name) != fingerprint:
+                dirty_nodes.append(node)
+            elif not self.__has_output(node):
+                dirty_nodes.append(node)
+
+        return dirty_nodes
+
+    def save(self, failed_nodes=()):
+        '''Stores the fingerprints of the exported nodes, except of those
+        in failed_nodes which are exported again next time.
+        '''
+        for node_name in failed_nodes:
+            self.__pending.pop(node_name, None)
+            self.__fingerprints.pop(node_name, None)
+
+        self.__fingerprints.update(self.__pending)
+        self.__pending = {}
+
+        try:
+            with open(self.__state_path, 'wb') as f:
+                pickle.dump(self.__fingerprints, f, -1)
+        except:
+            bcPrint("[IO] can not write: {}".format(self.__state_path),
+                    'error')
+
+    def __has_output(self, node):
+        if self.__config.disable_rc:
+            return True
+
+        if utils.get_node_type(node) not in self.__OUTPUT_NODE_TYPES:
+            return True
+
+        return os.path.isfile(os.path.join(self.__directory, node.name))
+
+    def __load(self):
+        if not os.path.isfile(self.__state_path):
+            return {}
+
+        try:
+            with open(self.__state_path, 'rb') as f:
+                return pickle.load(f)
+        except:
+            bcPrint("[IO] can not read: {}".format(self.__state_path),
+                    'error')
+            return {}
+
+
+#------------------------------------------------------------------------------
+# Fingerprints:
+#------------------------------------------------------------------------------
+
+def get_node_fingerprint(node, options, apply_modifiers=False):
+    '''Hashes everything which ends up in the RC output of an export node:
+    object membership, transforms, mesh data, materials, custom properties
+    and armatures. Meshes are hashed as they are exported, with modifiers
+    applied if apply_modifiers is set.
+    '''
+    fingerprint = hashlib.sha1()
+    __update(fingerprint, (node.name, options, __get_properties(node)))
+
+    # Skeletons of characters are parents and not members of the node.
+    objects = set(node.objects)
+    for object_ in node.objects:
+        if object_.parent and object_.parent.type == 'ARMATURE':
+            objects.add(object_.parent)
+
+    for object_ in sorted(objects, key=lambda object_: object_.name):
+        parent_name = object_.parent.name if object_.parent else None
+        __update(fingerprint, (object_.name,
+                               object_.type,
+                               parent_name,
+                               object_.parent_bone,
+                               __to_tuple(object_.matrix_world),
+                               __get_properties(object_)))
+
+        for material in object_.material_slots:
+            __update(fingerprint, __get_material_state(material.material))
+
+        if object_.type == 'MESH':
+            for modifier in object_.modifiers:
+                __update(fingerprint, __get_rna_properties(modifier))
+
+            mesh = utils.get_evaluated_mesh(object_, apply_modifiers)
+            try:
+                __update(fingerprint, get_geometry_fingerprint(
+                    object_, mesh, ()))
+            finally:
+                utils.clear_bmesh(None, mesh)
+
+            if utils.get_node_type(node) in ('chr', 'skin'):
+                __update(fingerprint, __get_skin_weights(object_))
+
+        elif object_.type == 'ARMATURE':
+            for bone in object_.data.bones:
+                parent_name = bone.parent.name if bone.parent else None
+                __update(fingerprint, (bone.name,
+                                       parent_name,
+                                       __to_tuple(bone.matrix_local),
+                                       tuple(bone.tail_local)))
+
+            for pose_bone in object_.pose.bones:
+                __update(fingerprint, (pose_bone.name,
+                                       __get_properties(pose_bone),
+                                       udp.get_bone_ik_max_min(pose_bone)))
+
+    return fingerprint.hexdigest()
+
+
+def __get_skin_weights(object_):
+    weights = [group.name for group in object_.vertex_groups]
+    for vertex in object_.data.vertices:
+        weights.append(tuple((element.group, element.weight)
+                             for element in vertex.groups))
+
+    return weights
+
+
+def __get_material_state(material):
+    if material is None:
+        return None
+
+    images = []
+    for image in material_utils.get_textures(material):
+        if image is not None:
+            images.append((image.name, image.filepath))
+
+    return (material.name,
+            tuple(material.diffuse_color),
+            tuple(material.specular_color),
+            material.specular_hardness,
+            material.alpha,
+            tuple(images))
+
+
+def __get_properties(id_):
+    properties = []
+    for name, value in id_.items():
+        if hasattr(value, 'to_dict'):
+            value = value.to_dict()
+        elif hasattr(value, 'to_list'):
+            value = value.to_list()
+        properties.append((name, value))
+
+    return sorted(properties, key=lambda property: property[0])
+
+
+def __get_rna_properties(struct):
+    properties = []
+    for property_ in struct.bl_rna.properties:
+        if property_.identifier == 'rna_type' or \
+                property_.type == 'COLLECTION':
+            continue
+
+        value = getattr(struct, property_.identifier)
+        if property_.type == 'POINTER':
+            value = getattr(value, 'name', None)
+        elif getattr(property_, 'is_array', False):
+            value = tuple(value)
+        properties.append((property_.identifier, value))
+
+    return properties
+
+
+def __to_tuple(matrix):
+    return tuple(tuple(row) for row in matrix)
+
+
+def __update(fingerprint, value):
+    fingerprint.update(repr(value).encode('utf-8'))
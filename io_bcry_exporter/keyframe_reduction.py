@@ -0,0 +1,182 @@
+#------------------------------------------------------------------------------
+# Name:        keyframe_reduction.py
+# Purpose:     Removes redundant keyframes from exported animation channels
+#
+# Created:     17/10/2026
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+
+from array import array
+from collections import namedtuple
+
+
+Keyframe = namedtuple('Keyframe', ('frame', 'value', 'interpolation',
+                                   'handle_left', 'handle_right'))
+
+
+def get_bezier_keyframes(frames, values):
+    '''Returns BEZIER keyframes of samples with auto clamped handles, like
+    the ones keyframe_insert creates. Handles are flat on the first and last
+    key and on local extremes.
+    '''
+    keyframes = []
+    for index, (frame, value) in enumerate(zip(frames, values)):
+        slope = 0.0
+        if 0 < index < len(frames) - 1:
+            previous_value = values[index - 1]
+            next_value = values[index + 1]
+            if (value - previous_value) * (next_value - value) > 0.0:
+                slope = (next_value - previous_value) / \
+                    (frames[index + 1] - frames[index - 1])
+
+        left = (frame - frames[index - 1]) / 3.0 if index > 0 else 1.0 / 3.0
+        right = (frames[index + 1] - frame) / 3.0 \
+            if index < len(frames) - 1 else 1.0 / 3.0
+        keyframes.append(Keyframe(frame, value, 'BEZIER',
+                                  (frame - left, value - slope * left),
+                                  (frame + right, value + slope * right)))
+
+    return keyframes
+
+
+def get_fcurve_keyframes(curve):
+    points = curve.keyframe_points
+    co = __get_points_array(points, "co")
+    handles_left = __get_points_array(points, "handle_left")
+    handles_right = __get_points_array(points, "handle_right")
+
+    # Enum properties can not be read with foreach_get.
+    return [Keyframe(co[2 * i], co[2 * i + 1], point.interpolation,
+                     (handles_left[2 * i], handles_left[2 * i + 1]),
+                     (handles_right[2 * i], handles_right[2 * i + 1]))
+            for i, point in enumerate(points)]
+
+
+def get_fcurve_samples(curve, keyframes):
+    '''Evaluates the curve on every frame between its first and last key and
+    on the keys themselves.
+    '''
+    frames = set(keyframe.frame for keyframe in keyframes)
+    frames.update(range(int(keyframes[0].frame),
+                        int(keyframes[-1].frame) + 1))
+
+    return [(frame, curve.evaluate(frame)) for frame in sorted(frames)
+            if keyframes[0].frame <= frame <= keyframes[-1].frame]
+
+
+def __get_points_array(points, attribute):
+    values = array('f', [0]) * (len(points) * 2)
+    points.foreach_get(attribute, values)
+
+    return values
+
+
+def reduce_keyframes(keyframes, samples, tolerance):
+    '''Returns the keyframes which are needed to reconstruct the sampled
+    curve within tolerance. Constant channels collapse into a single key.
+    '''
+    if len(keyframes) < 2:
+        return keyframes
+
+    values = [value for frame, value in samples]
+    if max(values) - min(values) <= tolerance:
+        frame, value = keyframes[0].frame, keyframes[0].value
+        return [Keyframe(frame, value, 'LINEAR', (frame, value),
+                         (frame, value))]
+
+    indices = [0]
+    anchor = 0
+    for index in range(2, len(keyframes)):
+        start, end = __get_segment(keyframes, anchor, index)
+        if not __is_reconstructed(start, end, samples, tolerance):
+            anchor = index - 1
+            indices.append(anchor)
+    indices.append(len(keyframes) - 1)
+
+    reduced = [keyframes[0]]
+    for previous, index in zip(indices, indices[1:]):
+        start, end = __get_segment(keyframes, previous, index)
+        reduced[-1] = reduced[-1]._replace(handle_right=start.handle_right)
+        reduced.append(end)
+
+    return reduced
+
+
+def __get_segment(keyframes, start, end):
+    # Keys which are no longer neighbours get their BEZIER handles stretched
+    # to a third of the segment along their slope, as Blender does for auto
+    # handles, otherwise the segment would be almost linear.
+    start_key, end_key = keyframes[start], keyframes[end]
+    if end - start > 1:
+        length = (end_key.frame - start_key.frame) / 3.0
+        if start_key.interpolation == 'BEZIER':
+            start_key = start_key._replace(handle_right=__stretch_handle(
+                start_key, start_key.handle_right, length))
+        if end_key.interpolation == 'BEZIER':
+            end_key = end_key._replace(handle_left=__stretch_handle(
+                end_key, end_key.handle_left, -length))
+
+    return start_key, end_key
+
+
+def __stretch_handle(keyframe, handle, offset):
+    width = handle[0] - keyframe.frame
+    slope = (handle[1] - keyframe.value) / width if width else 0.0
+
+    return (keyframe.frame + offset, keyframe.value + slope * offset)
+
+
+def __is_reconstructed(start, end, samples, tolerance):
+    for frame, value in samples:
+        if frame <= start.frame:
+            continue
+        if frame >= end.frame:
+            break
+
+        interpolated = __interpolate(start, end, frame)
+        if interpolated is None or abs(interpolated - value) > tolerance:
+            return False
+
+    return True
+
+
+def __interpolate(start, end, frame):
+    if start.interpolation == 'CONSTANT':
+        return start.value
+
+    if start.interpolation == 'LINEAR':
+        factor = (frame - start.frame) / (end.frame - start.frame)
+        return start.value + (end.value - start.value) * factor
+
+    if start.interpolation == 'BEZIER':
+        return __interpolate_bezier((start.frame, start.value),
+                                    start.handle_right,
+                                    end.handle_left,
+                                    (end.frame, end.value),
+                                    frame)
+
+    # Easing modes can not be rebuilt from the neighbour keys.
+    return None
+
+
+def __interpolate_bezier(p0, p1, p2, p3, frame):
+    # Handles are clamped into the segment, so the frame grows monotonically
+    # along the curve and the parameter can be found by bisection.
+    low, high = 0.0, 1.0
+    for i in range(32):
+        middle = (low + high) * 0.5
+        if __bezier(p0[0], p1[0], p2[0], p3[0], middle) < frame:
+            low = middle
+        else:
+            high = middle
+
+    return __bezier(p0[1], p1[1], p2[1], p3[1], (low + high) * 0.5)
+
+
+def __bezier(a, b, c, d, t):
+    s = 1.0 - t
+    return s * s * s * a + 3.0 * s * s * t * b + 3.0 * s * t * t * c + \
+        t * t * t * d
@@ -35,11 +35,13 @@ import xml.dom.minidom
 # Generate Materials:
 #------------------------------------------------------------------------------
 
-def generate_mtl_files(_config, materials=None):
-    if materials is None:
-        materials = get_materials(_config.export_selected_nodes)
+def generate_mtl_files(_config, registry=None):
+    # Returns the future of the texture conversion, if there is one.
+    if registry is None:
+        registry = MaterialRegistry(_config.export_selected_nodes)
 
-    for node in get_material_groups(materials):
+    images = []
+    for node, material_names in registry.get_node_materials().items():
         _doc = Document()
         parent_material = _doc.createElement('Material')
         parent_material.setAttribute("MtlFlags", "524544")
@@ -51,9 +53,8 @@ def generate_mtl_files(_config, materials=None):
         print()
         bcPrint("'{}' material is being processed...".format(node))
 
-        for material_name, material in materials.items():
-            if material_name.split('__')[0] != node:
-                continue
+        for material_name in material_names:
+            material = registry.get_material(material_name)
 
             print()
             write_material_information(material_name)
@@ -62,6 +63,7 @@ def generate_mtl_files(_config, materials=None):
 
             set_material_attributes(material, material_name, material_node)
             add_textures(_doc, material, material_node, _config)
+            images.extend(get_textures(material))
             set_public_params(_doc, material, material_node)
 
             sub_material.appendChild(material_node)
@@ -76,6 +78,11 @@ def generate_mtl_files(_config, materials=None):
         print()
         bcPrint("'{}' material file has been generated.".format(filename))
 
+    if _config.convert_textures:
+        return convert_image_to_dds(images, _config)
+
+    return None
+
 
 def write_material_information(material_name):
     parts = material_name.split('__')
@@ -83,18 +90,6 @@ def write_material_information(material_name):
         parts[2], parts[1], parts[3]))
 
 
-def get_material_groups(materials):
-    material_groups = []
-
-    for material_name, material in materials.items():
-        group_name = material_name.split('__')[0]
-
-        if not (group_name in material_groups):
-            material_groups.append(group_name)
-
-    return material_groups
-
-
 def sort_materials_by_names(unordered_materials):
     materials = OrderedDict()
     for material_name in sorted(unordered_materials):
@@ -104,20 +99,42 @@ def sort_materials_by_names(unordered_materials):
 
 
 def get_materials(just_selected=False):
-    materials = OrderedDict()
-    material_counter = {}
-
-    for group in utils.get_mesh_export_nodes(just_selected):
-        material_counter[group.name] = 0
-        for object in group.objects:
-            for i in range(0, len(object.material_slots)):
-                slot = object.material_slots[i]
-                material = slot.material
-                if material is None:
-                    continue
-
-                if material not in materials.values():
-                    node_name = utils.get_node_name(group)
+    return MaterialRegistry(just_selected).materials
+
+
+class MaterialRegistry:
+    '''Collects the materials of the mesh export nodes once and indexes
+    them by material, by export name and by owning node. Objects are
+    mapped slot by slot to export names on first request.
+
+    Export names depend on the order in which nodes are visited, so they
+    are given over all export nodes even if a filter exports only some.
+    Shards and incremental exports then name materials like .mtl files.
+    materials holds the materials of the filtered nodes.
+    '''
+
+    def __init__(self, just_selected=False):
+        self.__export_names = {}
+        self.__object_slots = {}
+
+        materials = {}
+        material_counter = {}
+        used_materials = set()
+
+        with utils.unfiltered_export_nodes() as node_filter:
+            export_nodes = utils.get_mesh_export_nodes(just_selected)
+
+        for group in export_nodes:
+            material_counter[group.name] = 0
+            node_name = utils.get_node_name(group)
+            is_exported = node_filter is None or group.name in node_filter
+            for object_ in group.objects:
+                for slot in object_.material_slots:
+                    material = slot.material
+                    if material is not None and is_exported:
+                        used_materials.add(material)
+                    if material is None or material in self.__export_names:
+                        continue
 
                     material.name = utils.replace_invalid_rc_characters(
                         material.name)
@@ -129,7 +146,7 @@ def get_materials(just_selected=False):
                             pass
 
                     node, index, name, physics = get_material_parts(
-                        node_name, slot.material.name)
+                        node_name, material.name)
 
                     # check if material has no position defined
                     if index == 0:
@@ -139,8 +156,51 @@ def get_materials(just_selected=False):
                     material_name = "{}__{:02d}__{}__{}".format(
                         node, index, name, physics)
                     materials[material_name] = material
+                    self.__export_names[material] = material_name
+
+        self.__materials = sort_materials_by_names(materials)
+        self.materials = OrderedDict(
+            (material_name, material)
+            for material_name, material in self.__materials.items()
+            if material in used_materials)
+
+        self.__node_materials = OrderedDict()
+        for material_name in self.__materials:
+            node = material_name.split('__')[0]
+            self.__node_materials.setdefault(node, []).append(material_name)
+
+    def get_export_name(self, material):
+        return self.__export_names.get(material)
+
+    def get_material(self, material_name):
+        return self.__materials[material_name]
+
+    def get_node_materials(self):
+        '''Returns export names of the materials of all export nodes grouped
+        by their .mtl file.
+        '''
+        return self.__node_materials
 
-    return sort_materials_by_names(materials)
+    def get_slot_names(self, object_):
+        '''Returns export names indexed by material slot, None for empty
+        or not exported slots.
+        '''
+        slot_names = self.__object_slots.get(object_)
+        if slot_names is None:
+            slot_names = [self.__export_names.get(slot.material)
+                          for slot in object_.material_slots]
+            self.__object_slots[object_] = slot_names
+
+        return slot_names
+
+    def get_materials_for_object(self, object_):
+        materials = OrderedDict()
+        for slot, material_name in zip(object_.material_slots,
+                                       self.get_slot_names(object_)):
+            if material_name is not None:
+                materials[slot.material] = material_name
+
+        return materials
 
 
 def set_material_attributes(material, material_name, material_node):
@@ -221,9 +281,6 @@ def add_textures(_doc, material, material_node, _config):
         textures_node.appendChild(texture_node)
         bcPrint("Normal Path: {}.".format(path))
 
-    if _config.convert_textures:
-        convert_image_to_dds([diffuse, specular, normal], _config)
-
     material_node.appendChild(textures_node)
 
 
@@ -233,7 +290,7 @@ def add_textures(_doc, material, material_node, _config):
 
 def convert_image_to_dds(images, _config):
     converter = RCInstance(_config)
-    converter.convert_tif(images)
+    return converter.convert_tif(images)
 
 
 #------------------------------------------------------------------------------
@@ -17,59 +17,410 @@
 if "bpy" in locals():
     import imp
     imp.reload(utils)
+    imp.reload(exceptions)
+    imp.reload(texture_manifest)
+    imp.reload(timers)
 else:
     import bpy
-    from io_bcry_exporter import utils
+    from io_bcry_exporter import utils, exceptions, texture_manifest, timers
 
 from io_bcry_exporter.outpipe import bcPrint
+from collections import deque
+from concurrent.futures import CancelledError, Future
 import fnmatch
 import os
 import shutil
 import subprocess
 import threading
 import tempfile
+import time
 
 
 class RCInstance:
 
     def __init__(self, config):
         self.__config = config
+        self.__timer = timers.get_current_timer()
+        get_rc_scheduler().max_jobs = config.rc_max_jobs
+        get_rc_batcher().max_files = config.rc_batch_size
+        get_rc_batcher().max_delay = config.rc_batch_delay
 
     def convert_tif(self, source):
-        converter = _TIFConverter(self.__config, source)
-        conversion_thread = threading.Thread(target=converter)
-        conversion_thread.start()
+        converter = _TIFConverter(self.__config, source, self.__timer)
+        return self.__start(converter)
 
     def convert_dae(self, source):
-        converter = _DAEConverter(self.__config, source)
-        conversion_thread = threading.Thread(target=converter)
+        converter = _DAEConverter(self.__config, source, self.__timer)
+        return self.__start(converter)
+
+    def __start(self, converter):
+        # Converters wait on their RC jobs, so they run out of the UI thread.
+        # The returned future is resolved with the result of the converter.
+        # Timings of the export are reported after the conversion.
+        future = Future()
+        if self.__timer is not None:
+            self.__timer.hold()
+
+        def convert():
+            try:
+                try:
+                    result = converter()
+                finally:
+                    # Timings are written before the future is resolved.
+                    if self.__timer is not None:
+                        self.__timer.release()
+            except Exception as exception:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+        conversion_thread = threading.Thread(target=convert)
         conversion_thread.start()
 
+        return future
+
+
+#------------------------------------------------------------------------------
+# Job Scheduler:
+#------------------------------------------------------------------------------
+
+class RCJob:
+    '''A resource compiler process which is queued or run by RCScheduler.
+    The future of a job is resolved with the return code of the process,
+    or with CancelledError when the job is cancelled.
+    '''
+
+    def __init__(self, args, name):
+        self.args = args
+        self.name = name
+        self.returncode = None
+        self.start_time = None
+        self.end_time = None
+        self.future = Future()
+        self.process = None
+        self.cancelled = False
+
+    @property
+    def duration(self):
+        if self.start_time is None or self.end_time is None:
+            return None
+
+        return self.end_time - self.start_time
+
+    def wait(self, timeout=None):
+        '''Returns the return code, or None if the job has been cancelled.'''
+        try:
+            return self.future.result(timeout)
+        except CancelledError:
+            return None
+
+    def cancel(self):
+        # Futures of running jobs can not be cancelled, they are resolved
+        # with CancelledError when their process has stopped.
+        self.cancelled = True
+        self.future.cancel()
+
+
+class RCScheduler:
+    '''Runs RC processes in FIFO order with at most max_jobs processes at
+    the same time.
+    '''
+
+    def __init__(self, max_jobs):
+        self.max_jobs = max_jobs
+        self.__queue = deque()
+        self.__running = []
+        self.__lock = threading.Lock()
+
+    def submit(self, args, name=None, callback=None):
+        job = RCJob(args, name or os.path.basename(args[0]))
+        if callback is not None:
+            job.future.add_done_callback(lambda future: callback(job))
+
+        with self.__lock:
+            self.__queue.append(job)
+            self.__dispatch()
+
+        return job
+
+    def cancel(self):
+        '''Drops queued jobs and terminates running RC processes.'''
+        with self.__lock:
+            while self.__queue:
+                self.__queue.popleft().cancel()
+
+            for job in self.__running:
+                job.cancel()
+                if job.process is not None:
+                    job.process.terminate()
+
+    def __dispatch(self):
+        while self.__queue and len(self.__running) < max(1, self.max_jobs):
+            job = self.__queue.popleft()
+            if not job.future.set_running_or_notify_cancel():
+                continue
+
+            self.__running.append(job)
+            threading.Thread(target=self.__run, args=(job,)).start()
+
+    def __run(self, job):
+        job.start_time = time.time()
+        error = None
+        try:
+            # Processes are started under the lock, so cancel either sees
+            # the process or the job never starts it.
+            with self.__lock:
+                if not job.cancelled:
+                    job.process = subprocess.Popen(job.args)
+            if job.process is not None:
+                job.returncode = job.process.wait()
+        except OSError:
+            error = exceptions.NoRcSelectedException()
+        except Exception as exception:
+            error = exception
+        finally:
+            # The slot is released even if the job failed unexpectedly.
+            job.end_time = time.time()
+            with self.__lock:
+                self.__running.remove(job)
+                self.__dispatch()
+
+        if job.cancelled:
+            job.returncode = None
+            job.future.set_exception(CancelledError())
+        elif error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(job.returncode)
+
+
+class RCBatcher:
+    '''Groups files which are processed with the same RC and parameters into
+    one RC invocation. A group is submitted to the scheduler when it has
+    max_files files, max_delay seconds after its first file or on flush.
+    Every file gets its own RCJob; when a batch fails its files are run
+    one by one to find the failing ones.
+    '''
+
+    def __init__(self, scheduler, max_files, max_delay):
+        self.max_files = max_files
+        self.max_delay = max_delay
+        self.__scheduler = scheduler
+        self.__groups = {}
+        self.__timers = {}
+        self.__lock = threading.Lock()
+
+    def submit(self, rc_path, source, params):
+        key = (rc_path, tuple(params))
+        job = RCJob([rc_path, source] + list(params),
+                    os.path.basename(source))
+
+        with self.__lock:
+            group = self.__groups.setdefault(key, [])
+            group.append(job)
+
+            if len(group) >= self.max_files:
+                self.__submit_group(key)
+            elif len(group) == 1:
+                timer = threading.Timer(self.max_delay, self.__flush_group,
+                                        (key,))
+                self.__timers[key] = timer
+                timer.start()
+
+        return job
+
+    def flush(self):
+        with self.__lock:
+            for key in list(self.__groups):
+                self.__submit_group(key)
+
+    def cancel(self):
+        with self.__lock:
+            for key in list(self.__groups):
+                self.__cancel_timer(key)
+                for job in self.__groups.pop(key):
+                    job.cancel()
+
+    def __flush_group(self, key):
+        with self.__lock:
+            if key in self.__groups:
+                self.__submit_group(key)
+
+    def __cancel_timer(self, key):
+        # Full groups are submitted before they get a timer.
+        timer = self.__timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+    def __submit_group(self, key):
+        self.__cancel_timer(key)
+        jobs = self.__groups.pop(key)
+        rc_path, params = key
+
+        args = [rc_path]
+        args.extend(job.args[1] for job in jobs)
+        args.extend(params)
+        name = "{} files".format(len(jobs))
+
+        self.__scheduler.submit(
+            args, name, lambda batch: self.__finish_batch(jobs, batch))
+
+    def __finish_batch(self, jobs, batch):
+        # A terminated batch exits like a failed one, it must not be retried.
+        if batch.cancelled:
+            for job in jobs:
+                job.cancel()
+            return
+
+        if batch.returncode is not None and batch.returncode != 0 and \
+                len(jobs) > 1:
+            bcPrint("RC batch of {} failed, running its files one by one."
+                    .format(batch.name), 'warning')
+            for job in jobs:
+                self.__scheduler.submit(
+                    job.args, job.name,
+                    lambda single, job=job: self.__finish_job(job, single))
+            return
+
+        for job in jobs:
+            self.__finish_job(job, batch)
+
+    def __finish_job(self, job, run):
+        if run.cancelled:
+            job.cancel()
+            return
+
+        job.returncode = run.returncode
+        job.start_time = run.start_time
+        job.end_time = run.end_time
+        if job.future.set_running_or_notify_cancel():
+            if job.returncode is None:
+                job.future.set_exception(
+                    exceptions.NoRcSelectedException())
+            else:
+                job.future.set_result(job.returncode)
+
+
+__scheduler = None
+__batcher = None
+
+
+def get_rc_scheduler():
+    global __scheduler
+    if __scheduler is None:
+        __scheduler = RCScheduler(os.cpu_count() or 1)
+
+    return __scheduler
+
+
+def get_rc_batcher():
+    global __batcher
+    if __batcher is None:
+        __batcher = RCBatcher(get_rc_scheduler(), 16, 0.5)
+
+    return __batcher
+
+
+def cancel_rc_jobs():
+    get_rc_batcher().cancel()
+    get_rc_scheduler().cancel()
+
+
+def wait_for_conversions(conversions):
+    '''Waits for the futures of RCInstance conversions and raises
+    RCFailedException with the nodes and images RC failed on.
+    '''
+    failed = []
+    for conversion in conversions:
+        failed.extend(conversion.result() or ())
+
+    if failed:
+        raise exceptions.RCFailedException(sorted(failed))
+
+
+def wait_for_jobs(jobs):
+    '''Waits until the jobs have finished. Jobs whose RC could not be
+    started keep None as return code and the error is reported once.
+    '''
+    error = None
+    for job in jobs:
+        try:
+            job.wait()
+        except exceptions.NoRcSelectedException as exception:
+            error = exception
+
+    if error is not None:
+        bcPrint(error.what(), 'error')
+
+
+def report_rc_jobs(jobs):
+    for job in jobs:
+        if job.cancelled:
+            bcPrint("RC job {!r} has been cancelled.".format(job.name),
+                    'warning')
+        elif job.returncode is None:
+            bcPrint("RC job {!r} did not run.".format(job.name), 'warning')
+        else:
+            bcPrint("RC job {!r} finished with {} in {:.2f} seconds.".format(
+                job.name, job.returncode, job.duration))
+
+
+def record_rc_jobs(timer, stage_name, jobs):
+    if timer is None:
+        return
+
+    for job in jobs:
+        if job.start_time is not None and job.end_time is not None:
+            timer.add_span("{}/{}".format(stage_name, job.name),
+                           job.start_time, job.end_time,
+                           thread="RC {}".format(job.name),
+                           returncode=job.returncode)
+
 
 class _DAEConverter:
 
-    def __init__(self, config, source):
+    def __init__(self, config, source, timer=None):
         self.__config = config
-        self.__doc = source
+        self.__filepath = source
+        self.__timer = timer
+        # Nodes are read here, the converter runs out of the main thread.
+        self.__dae_path = utils.get_absolute_path_for_rc(source)
+        export_nodes = utils.get_export_nodes()
+        self.__export_nodes = [(group.name, utils.get_node_type(group))
+                               for group in export_nodes]
+        self.__anm_files = []
+        if config.is_animation_process:
+            self.__anm_files = self.__get_anm_files(export_nodes)
+        self.__layer_objects = []
+        if config.make_layer:
+            self.__layer_objects = self.__get_layer_objects(export_nodes)
 
     def __call__(self):
-        filepath = bpy.path.ensure_ext(self.__config.filepath, ".dae")
-        utils.generate_xml(filepath, self.__doc, overwrite=True)
-
-        dae_path = utils.get_absolute_path_for_rc(filepath)
+        # Returns the names of export nodes which RC failed to convert.
+        # DAE file has already been streamed to disk by the exporter.
+        filepath = self.__filepath
+        dae_path = self.__dae_path
+        failed_nodes = set()
 
         if not self.__config.disable_rc:
             rc_params = ["/verbose", "/threads=processors", "/refresh"]
             if self.__config.vcloth_pre_process:
                 rc_params.append("/wait=0 /forceVCloth")
 
-            rc_process = run_rc(self.__config.rc_path, dae_path, rc_params)
+            rc_job = run_rc(self.__config.rc_path, dae_path, rc_params)
+
+            wait_for_jobs([rc_job])
+            returncode = rc_job.returncode
+            if returncode != 0 and not rc_job.cancelled:
+                failed_nodes.update(node_name for node_name, node_type
+                                    in self.__export_nodes)
 
-            if rc_process is not None:
-                rc_process.wait()
+            if returncode is not None:
+                report_rc_jobs([rc_job])
+                record_rc_jobs(self.__timer, "rc", [rc_job])
 
                 if not self.__config.is_animation_process:
-                    self.__recompile(dae_path)
+                    failed_nodes.update(self.__recompile(dae_path))
                 else:
                     self.__rename_anm_files(dae_path)
 
@@ -83,20 +434,23 @@ class _DAEConverter:
             utils.remove_file(dae_path)
             utils.remove_file(rcdone_path)
 
+        bcPrint("Conversion of {!r} has finished.".format(
+            os.path.basename(filepath)))
+
+        return failed_nodes
+
     def __recompile(self, dae_path):
-        name = os.path.basename(dae_path)
         output_path = os.path.dirname(dae_path)
         ALLOWED_NODE_TYPES = ("chr", "skin")
-        for group in utils.get_export_nodes():
-            node_type = utils.get_node_type(group)
+        rc_jobs = []
+        node_names = []
+        for node_name, node_type in self.__export_nodes:
             if node_type in ALLOWED_NODE_TYPES:
-                out_file = os.path.join(output_path, group.name)
-                args = [
-                    self.__config.rc_path,
-                    "/refresh",
-                    "/vertexindexformat=u16",
-                    out_file]
-                rc_second_pass = subprocess.Popen(args)
+                out_file = os.path.join(output_path, node_name)
+                rc_params = ["/refresh", "/vertexindexformat=u16"]
+                rc_jobs.append(run_rc(self.__config.rc_path, out_file,
+                                      rc_params, batch=True))
+                node_names.append(node_name)
             elif node_type == 'i_caf':
                 try:
                     os.remove(os.path.join(output_path, ".animsettings"))
@@ -105,23 +459,42 @@ class _DAEConverter:
                 except:
                     pass
 
-    def __rename_anm_files(self, dae_path):
-        output_path = os.path.dirname(dae_path)
+        # Output files are rewritten until the second pass has finished.
+        if rc_jobs:
+            get_rc_batcher().flush()
+            wait_for_jobs(rc_jobs)
+
+            bcPrint("Second pass of {} nodes:".format(len(rc_jobs)))
+            report_rc_jobs(rc_jobs)
+            record_rc_jobs(self.__timer, "rc second pass", rc_jobs)
 
-        for group in utils.get_export_nodes():
+        return [node_name for node_name, rc_job in zip(node_names, rc_jobs)
+                if rc_job.returncode != 0 and not rc_job.cancelled]
+
+    def __get_anm_files(self, export_nodes):
+        anm_files = []
+        for group in export_nodes:
             if utils.get_node_type(group) == 'anm':
                 node_name = utils.get_node_name(group)
                 src_name = "{}_{}".format(node_name, group.name)
-                src_name = os.path.join(output_path, src_name)
+                dest_name = utils.get_geometry_animation_file_name(group)
+                anm_files.append((src_name, dest_name))
 
-                if os.path.exists(src_name):
-                    dest_name = utils.get_geometry_animation_file_name(group)
-                    dest_name = os.path.join(output_path, dest_name)
+        return anm_files
 
-                    if os.path.exists(dest_name):
-                        os.remove(dest_name)
+    def __rename_anm_files(self, dae_path):
+        output_path = os.path.dirname(dae_path)
 
-                    os.rename(src_name, dest_name)
+        for src_name, dest_name in self.__anm_files:
+            src_name = os.path.join(output_path, src_name)
+
+            if os.path.exists(src_name):
+                dest_name = os.path.join(output_path, dest_name)
+
+                if os.path.exists(dest_name):
+                    os.remove(dest_name)
+
+                os.rename(src_name, dest_name)
 
     def __get_mtl_files_in_directory(self, directory):
         MTL_MATCH_STRING = "*.{!s}".format("mtl")
@@ -134,6 +507,19 @@ class _DAEConverter:
 
         return mtl_files
 
+    def __get_layer_objects(self, export_nodes):
+        layer_objects = []
+        for group in export_nodes:
+            if len(group.objects) > 1:
+                origin = 0, 0, 0
+                rotation = 1, 0, 0, 0
+            else:
+                origin = tuple(group.objects[0].location)
+                rotation = tuple(group.objects[0].delta_rotation_quaternion)
+            layer_objects.append((group.name, origin, rotation))
+
+        return layer_objects
+
     def __make_layer(self):
         layer_doc = Document()
         object_layer = layer_doc.createElement("ObjectLayer")
@@ -154,17 +540,10 @@ class _DAEConverter:
         )
 
         layer_objects = layer_doc.createElement("LayerObjects")
-        for group in utils.get_export_nodes():
-            if len(group.objects) > 1:
-                origin = 0, 0, 0
-                rotation = 1, 0, 0, 0
-            else:
-                origin = group.objects[0].location
-                rotation = group.objects[0].delta_rotation_quaternion
-
+        for node_name, origin, rotation in self.__layer_objects:
             object = createAttributes(
                 'Object',
-                {'name': group.name[14:],
+                {'name': node_name[14:],
                  'Type': 'Entity',
                  'Id': utils.get_guid(),
                  'LayerGUID': layer.getAttribute('GUID'),
@@ -187,7 +566,7 @@ class _DAEConverter:
             )
             properties = createAttributes(
                 'Properties',
-                {'object_Model': '/Objects/{}.cgf'.format(group.name[14:]),
+                {'object_Model': '/Objects/{}.cgf'.format(node_name[14:]),
                  'bCanTriggerAreas': '0',
                  'bExcludeCover': '0',
                  'DmgFactorWhenCollidingAI': '1',
@@ -248,16 +627,91 @@ class _DAEConverter:
 
 
 class _TIFConverter:
+    # Source paths which are converted by any converter at the moment, their
+    # futures are resolved with whether the conversion has failed.
+    __in_progress = {}
+    __in_progress_lock = threading.Lock()
 
-    def __init__(self, config, source):
+    def __init__(self, config, source, timer=None):
         self.__config = config
         self.__images_to_convert = source
+        self.__timer = timer
         self.__tmp_images = {}
         self.__tmp_dir = tempfile.mkdtemp("CryBlend")
 
     def __call__(self):
+        # Returns the names of images which RC failed to convert.
+        images, converted_elsewhere = self.__claim_images()
+        failed_images = None
+        try:
+            failed_images = self.__convert(images)
+        finally:
+            self.__release_images(images, failed_images)
+
+        if self.__config.texture_rc_path:
+            self.__save_tiffs()
+
+        self.__remove_tmp_files()
+
+        # Claims are released first, so converters never wait on each other
+        # in a cycle.
+        for image_name, future in converted_elsewhere:
+            if future.result():
+                failed_images.append(image_name)
+
+        return failed_images
+
+    def __claim_images(self):
+        # Same image can be used by many materials and export nodes. Images
+        # which another converter is converting are waited for instead.
+        images = {}
         for image in self.__images_to_convert:
+            if image is not None:
+                images.setdefault(utils.get_absolute_path(image.filepath),
+                                  image)
+
+        converted_elsewhere = []
+        with self.__in_progress_lock:
+            for source_path, image in list(images.items()):
+                future = self.__in_progress.get(source_path)
+                if future is not None:
+                    converted_elsewhere.append((image.name, future))
+                    del images[source_path]
+                else:
+                    self.__in_progress[source_path] = Future()
+
+        return images, converted_elsewhere
+
+    def __release_images(self, images, failed_images):
+        # Images count as failed when the conversion raised.
+        with self.__in_progress_lock:
+            futures = [(self.__in_progress.pop(source_path), image.name)
+                       for source_path, image in images.items()]
+
+        for future, image_name in futures:
+            future.set_result(failed_images is None or
+                              image_name in failed_images)
+
+    def __convert(self, images):
+        # TIFF files are written while RC jobs of earlier images run.
+        manifest = texture_manifest.TextureManifest(self.__config.game_dir)
+        conversions = []
+        converted = []
+        up_to_date = 0
+        for source_path, image in images.items():
+            start_time = time.time()
             rc_params = self.__get_rc_params(image.filepath)
+
+            # Unsaved images differ from their files.
+            content_hash = None
+            if not image.is_dirty:
+                content_hash = texture_manifest.get_content_hash(source_path)
+            manifest_params = [self.__config.texture_rc_path] + rc_params
+            if manifest.is_up_to_date(source_path, content_hash,
+                                      manifest_params):
+                up_to_date += 1
+                continue
+
             tiff_image_path = self.__get_temp_tiff_image_path(image)
 
             tiff_image_for_rc = utils.get_absolute_path_for_rc(tiff_image_path)
@@ -268,9 +722,15 @@ class _TIFConverter:
             except:
                 bcPrint("Failed to invert green channel")
 
-            rc_process = run_rc(self.__config.texture_rc_path,
-                                tiff_image_for_rc,
-                                rc_params)
+            tiff_time = time.time() - start_time
+            if self.__timer is not None:
+                self.__timer.add_span(
+                    "texture conversion/{}/tiff".format(image.name),
+                    start_time, start_time + tiff_time)
+            rc_job = run_rc(self.__config.texture_rc_path,
+                            tiff_image_for_rc,
+                            rc_params,
+                            batch=True)
 
             # re-save the original image after running the RC to
             # prevent the original one from getting lost
@@ -280,12 +740,40 @@ class _TIFConverter:
             except:
                 bcPrint("Failed to invert green channel")
 
-            rc_process.wait()
-
-        if self.__config.texture_rc_path:
-            self.__save_tiffs()
-
-        self.__remove_tmp_files()
+            conversions.append((image.name, tiff_time, rc_job))
+            if content_hash is not None:
+                converted.append((rc_job, (source_path, content_hash,
+                                           manifest_params)))
+
+        get_rc_batcher().flush()
+        wait_for_jobs([rc_job for image_name, tiff_time, rc_job
+                       in conversions])
+
+        manifest.update([entry for rc_job, entry in converted
+                         if rc_job.returncode == 0])
+        record_rc_jobs(self.__timer, "texture conversion",
+                       [rc_job for image_name, tiff_time, rc_job
+                        in conversions])
+        self.__report(conversions, up_to_date)
+
+        return [image_name for image_name, tiff_time, rc_job in conversions
+                if rc_job.returncode != 0 and not rc_job.cancelled]
+
+    def __report(self, conversions, up_to_date):
+        bcPrint("{} textures have been converted, {} are up to date.".format(
+            len(conversions), up_to_date))
+        for image_name, tiff_time, rc_job in conversions:
+            if rc_job.cancelled:
+                bcPrint("Conversion of texture {!r} has been cancelled."
+                        .format(image_name), 'warning')
+            elif rc_job.returncode is None:
+                bcPrint("Texture {!r} could not be converted.".format(
+                    image_name), 'warning')
+            else:
+                bcPrint("Texture {!r}: TIFF {:.2f} s, RC {:.2f} s, "
+                        "return code {}.".format(image_name, tiff_time,
+                                                 rc_job.duration,
+                                                 rc_job.returncode))
 
     def __create_normal_texture(self):
         if ("_ddn" in image.name):
@@ -369,7 +857,7 @@ class _TIFConverter:
         self.__tmp_images.clear()
 
 
-def run_rc(rc_path, files_to_process, params=None):
+def run_rc(rc_path, files_to_process, params=None, batch=False):
     bcPrint("RC Path: {}".format(os.path.abspath(rc_path)), newline=True)
     process_params = [rc_path]
 
@@ -383,10 +871,9 @@ def run_rc(rc_path, files_to_process, params=None):
     bcPrint("RC Parameters: {}".format(params))
     bcPrint("Processing File: {}".format(files_to_process))
 
-    try:
-        run_object = subprocess.Popen(process_params)
-    except:
-        raise exceptions.NoRcSelectedException
-
     print()
-    return run_object
+    if batch and not isinstance(files_to_process, list):
+        return get_rc_batcher().submit(rc_path, files_to_process, params)
+
+    name = os.path.basename(str(files_to_process))
+    return get_rc_scheduler().submit(process_params, name)
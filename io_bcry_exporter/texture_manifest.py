@@ -0,0 +1,134 @@
+#------------------------------------------------------------------------------
+# Name:        texture_manifest.py
+# Purpose:     Remembers converted DDS textures between exports
+#
+# Created:     17/10/2026
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+
+from io_bcry_exporter.outpipe import bcPrint
+import hashlib
+import os
+import pickle
+import threading
+
+
+class TextureManifest:
+    '''Maps source images to the DDS files which RC produced from them. An
+    entry is valid while the content of the source, the RC parameters and
+    the modification time of the DDS are unchanged.
+    '''
+
+    __MANIFEST_FILENAME = '.bcry_texture_manifest'
+
+    # Texture converters of different exports share the manifest file.
+    __lock = threading.Lock()
+
+    def __init__(self, game_dir):
+        self.__manifest_path = None
+        if game_dir and os.path.isdir(game_dir):
+            self.__manifest_path = os.path.join(game_dir,
+                                                self.__MANIFEST_FILENAME)
+        self.__entries = self.__load()
+
+    def is_up_to_date(self, source_path, content_hash, rc_params):
+        entry = self.__entries.get(source_path)
+        if entry is None or entry[3] is None or content_hash is None:
+            return False
+
+        return entry == self.__get_entry(source_path, content_hash,
+                                         rc_params)
+
+    def update(self, converted):
+        '''Records (source_path, content_hash, rc_params) of successfully
+        converted textures.
+        '''
+        if self.__manifest_path is None or not converted:
+            return
+
+        with self.__lock:
+            entries = self.__load()
+            for source_path, content_hash, rc_params in converted:
+                entries[source_path] = self.__get_entry(
+                    source_path, content_hash, rc_params)
+            self.__save(entries)
+            self.__entries = entries
+
+    def prune(self):
+        '''Drops entries whose source or DDS is missing or out of date.'''
+        with self.__lock:
+            entries = self.__load()
+            for source_path, entry in list(entries.items()):
+                content_hash, rc_params, dds_path, dds_mtime = entry
+                if (dds_mtime is None or
+                        get_file_mtime(dds_path) != dds_mtime or
+                        get_content_hash(source_path) != content_hash):
+                    del entries[source_path]
+            self.__save(entries)
+            self.__entries = entries
+
+        bcPrint("Texture manifest has {} valid entries.".format(len(entries)))
+
+    def rebuild(self):
+        '''Forgets all entries, every texture is converted again.'''
+        with self.__lock:
+            self.__save({})
+            self.__entries = {}
+
+        bcPrint("Texture manifest has been cleared.")
+
+    def __get_entry(self, source_path, content_hash, rc_params):
+        dds_path = get_dds_path(source_path)
+        return (content_hash, tuple(rc_params), dds_path,
+                get_file_mtime(dds_path))
+
+    def __load(self):
+        if self.__manifest_path is None:
+            return {}
+        if not os.path.isfile(self.__manifest_path):
+            return {}
+
+        try:
+            with open(self.__manifest_path, 'rb') as f:
+                return pickle.load(f)
+        except:
+            bcPrint("[IO] can not read: {}".format(self.__manifest_path),
+                    'error')
+            return {}
+
+    def __save(self, entries):
+        if self.__manifest_path is None:
+            return
+
+        try:
+            with open(self.__manifest_path, 'wb') as f:
+                pickle.dump(entries, f, -1)
+        except:
+            bcPrint("[IO] can not write: {}".format(self.__manifest_path),
+                    'error')
+
+
+def get_dds_path(source_path):
+    return "{}.dds".format(os.path.splitext(source_path)[0])
+
+
+def get_content_hash(filepath):
+    content_hash = hashlib.sha1()
+    try:
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                content_hash.update(chunk)
+    except OSError:
+        return None
+
+    return content_hash.hexdigest()
+
+
+def get_file_mtime(filepath):
+    try:
+        return os.path.getmtime(filepath)
+    except OSError:
+        return None
@@ -0,0 +1,450 @@
+#------------------------------------------------------------------------------
+# Name:        timers.py
+# Purpose:     Hierarchical timings and memory of export stages
+#
+# Created:     17/10/2026
+# License:     GPLv2+
+#------------------------------------------------------------------------------
+
+# <pep8-80 compliant>
+
+
+from io_bcry_exporter.outpipe import bcPrint
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+
+MB = 1024.0 * 1024.0
+
+
+class ExportTimer:
+    '''Records nested stages of an export. Stages nest per thread, spans
+    of RC jobs are added by the converter threads when the jobs finish.
+    Reports are written next to the DAE file when the export and all the
+    conversions which it started have finished.
+
+    With memory, stages of the thread which started the timer also record
+    tracemalloc peaks and RSS deltas until stop_memory() is called.
+    '''
+
+    __TRACEBACK_FRAMES = 8
+    __TOP_ALLOCATIONS = 20
+
+    def __init__(self, filepath, timings=True, memory=False):
+        self.__filepath = filepath
+        self.__timings = timings
+        self.__origin = time.time()
+        self.__events = []
+        self.__local = threading.local()
+        self.__holds = 0
+        self.__lock = threading.Lock()
+
+        self.__memory_thread = None
+        self.__memory_report = None
+        if memory:
+            self.__start_memory()
+
+    @contextmanager
+    def stage(self, name, **args):
+        stack = getattr(self.__local, 'stack', None)
+        if stack is None:
+            stack = self.__local.stack = []
+
+        stack.append(name)
+        path = "/".join(stack)
+        memory = self.__enter_memory_stage()
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            end_time = time.time()
+            if memory is not None:
+                args = dict(args, **self.__exit_memory_stage(memory, path))
+            self.add_span(path, start_time, end_time, **args)
+            stack.pop()
+
+    def add_span(self, path, start_time, end_time, thread=None, **args):
+        event = {
+            'name': path.rsplit("/", 1)[-1],
+            'path': path,
+            'start': start_time - self.__origin,
+            'duration': end_time - start_time,
+            'thread': thread or threading.current_thread().name,
+            'args': args,
+        }
+        with self.__lock:
+            self.__events.append(event)
+
+    def hold(self):
+        with self.__lock:
+            self.__holds += 1
+
+    def release(self):
+        with self.__lock:
+            self.__holds -= 1
+            finished = self.__holds == 0
+
+        if finished:
+            self.__finish()
+
+    def stop_memory(self):
+        '''Stops tracing memory and keeps the report of the export.'''
+        if not self.__is_tracing_memory():
+            return
+
+        root = self.__memory_stages.pop()
+        peak = self.__get_stage_peak(root)
+        rss, rss_peak = get_rss()
+
+        self.__memory_report = {
+            'filepath': self.__filepath,
+            'traced_peak_mb': peak / MB if peak is not None else None,
+            'rss_peak_mb': rss_peak,
+            'summary': self.get_memory_summary(),
+            'top_allocations': self.__get_top_allocations(),
+        }
+
+        self.__memory_thread = None
+        self.__snapshot = None
+        if self.__started_tracing:
+            tracemalloc.stop()
+
+    def get_summary(self):
+        summary = OrderedDict()
+        for event in sorted(self.__events, key=lambda event: event['start']):
+            count, total = summary.get(event['path'], (0, 0.0))
+            summary[event['path']] = (count + 1, total + event['duration'])
+
+        return summary
+
+    def get_memory_summary(self):
+        '''Returns the largest peak and the summed deltas of every stage
+        which has been traced.
+        '''
+        summary = OrderedDict()
+        for event in sorted(self.__events, key=lambda event: event['start']):
+            if 'traced_delta_mb' not in event['args']:
+                continue
+
+            args = event['args']
+            entry = summary.setdefault(event['path'], {
+                'path': event['path'],
+                'count': 0,
+                'traced_peak_mb': None,
+                'traced_delta_mb': 0.0,
+                'rss_delta_mb': None,
+                'rss_peak_mb': None,
+            })
+            entry['count'] += 1
+            entry['traced_delta_mb'] += args['traced_delta_mb']
+            entry['traced_peak_mb'] = get_max(entry['traced_peak_mb'],
+                                              args['traced_peak_mb'])
+            entry['rss_peak_mb'] = get_max(entry['rss_peak_mb'],
+                                           args['rss_peak_mb'])
+            if args['rss_delta_mb'] is not None:
+                entry['rss_delta_mb'] = (entry['rss_delta_mb'] or 0.0) + \
+                    args['rss_delta_mb']
+
+        return list(summary.values())
+
+    def __start_memory(self):
+        self.__started_tracing = not tracemalloc.is_tracing()
+        if self.__started_tracing:
+            tracemalloc.start(self.__TRACEBACK_FRAMES)
+
+        self.__memory_thread = threading.current_thread()
+        self.__snapshot = None
+        self.__snapshot_path = None
+        self.__snapshot_traced = 0
+        self.__memory_stages = []
+        self.__memory_stages.append(self.__get_memory_state())
+
+    def __is_tracing_memory(self):
+        return self.__memory_thread is threading.current_thread()
+
+    def __get_memory_state(self):
+        traced, peak = tracemalloc.get_traced_memory()
+        rss, rss_peak = get_rss()
+        return {'traced': traced, 'peak': peak, 'child_peak': 0,
+                'rss': rss, 'rss_peak': rss_peak}
+
+    def __enter_memory_stage(self):
+        if not self.__is_tracing_memory():
+            return None
+
+        # Peak of the parent stage so far is kept before it is reset.
+        traced, peak = tracemalloc.get_traced_memory()
+        parent = self.__memory_stages[-1]
+        parent['child_peak'] = max(parent['child_peak'], peak)
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+        state = self.__get_memory_state()
+        self.__memory_stages.append(state)
+        return state
+
+    def __exit_memory_stage(self, state, path):
+        self.__memory_stages.pop()
+        peak = self.__get_stage_peak(state)
+        parent = self.__memory_stages[-1]
+        parent['child_peak'] = max(parent['child_peak'], peak or 0)
+
+        traced = tracemalloc.get_traced_memory()[0]
+        rss, rss_peak = get_rss()
+        self.__take_snapshot(traced, path)
+
+        return {
+            'traced_peak_mb': peak / MB if peak is not None else None,
+            'traced_delta_mb': (traced - state['traced']) / MB,
+            'rss_delta_mb': get_difference(rss, state['rss']),
+            # Only stages which raise the high water mark of RSS have one.
+            'rss_peak_mb': rss_peak if get_difference(
+                rss_peak, state['rss_peak']) else None,
+        }
+
+    def __get_stage_peak(self, state):
+        peak = tracemalloc.get_traced_memory()[1]
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+            return max(peak, state['child_peak'])
+
+        # Without reset_peak only stages which raise the peak of the whole
+        # export have one.
+        if peak > state['peak']:
+            return peak
+
+        return None
+
+    def __take_snapshot(self, traced, path):
+        # A snapshot is taken when traced memory grows by a tenth, so the
+        # top allocations are those of the largest state of the export.
+        if traced <= self.__snapshot_traced * 1.1:
+            return
+
+        snapshot = tracemalloc.take_snapshot()
+        self.__snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__, all_frames=True),
+            tracemalloc.Filter(False, __file__, all_frames=True),
+        ))
+        self.__snapshot_path = path
+        self.__snapshot_traced = traced
+
+    def __get_top_allocations(self):
+        if self.__snapshot is None:
+            return None
+
+        sites = []
+        statistics = self.__snapshot.statistics('traceback')
+        for statistic in statistics[:self.__TOP_ALLOCATIONS]:
+            frames = list(statistic.traceback)
+            # Python 3.7 orders frames from the oldest one.
+            if sys.version_info >= (3, 7):
+                frames.reverse()
+            # The innermost frame of the add-on tells which code allocated
+            # in a library like minidom.
+            callers = [frame for frame in frames
+                       if 'io_bcry_exporter' in frame.filename]
+            sites.append({
+                'size_mb': statistic.size / MB,
+                'count': statistic.count,
+                'site': get_frame_name(frames[0]),
+                'caller': get_frame_name(callers[0]) if callers else None,
+            })
+
+        return {
+            'stage': self.__snapshot_path,
+            'traced_mb': self.__snapshot_traced / MB,
+            'sites': sites,
+        }
+
+    def __finish(self):
+        basepath = os.path.splitext(self.__filepath)[0]
+
+        if self.__timings:
+            self.__print_summary()
+            self.__write("{}.timings.json".format(basepath),
+                         self.__get_report())
+            self.__write("{}.trace.json".format(basepath),
+                         self.__get_trace())
+
+        if self.__memory_report is not None:
+            self.__print_memory_summary()
+            self.__write("{}.memory.json".format(basepath),
+                         self.__memory_report)
+
+    def __print_summary(self):
+        print()
+        bcPrint("Export timings:")
+        print("{:<60} {:>6} {:>10}".format("Stage", "Count", "Seconds"))
+        summary = self.get_summary()
+        for path, (count, total) in summary.items():
+            # Spans of RC jobs have no parent stage, they keep their path.
+            parent, separator, name = path.rpartition("/")
+            if parent in summary:
+                name = "{}{}".format("  " * path.count("/"), name)
+            else:
+                name = path
+            print("{:<60} {:>6} {:>10.4f}".format(name[:60], count, total))
+        print()
+
+    def __print_memory_summary(self):
+        report = self.__memory_report
+
+        print()
+        bcPrint("Export memory:")
+        print("{:<48} {:>6} {:>10} {:>10} {:>10}".format(
+            "Stage", "Count", "Peak MB", "Delta MB", "RSS MB"))
+        for entry in report['summary']:
+            name = "{}{}".format("  " * entry['path'].count("/"),
+                                 entry['path'].rsplit("/", 1)[-1])
+            print("{:<48} {:>6} {:>10} {:>10.2f} {:>10}".format(
+                name[:48], entry['count'],
+                format_megabytes(entry['traced_peak_mb']),
+                entry['traced_delta_mb'],
+                format_megabytes(entry['rss_delta_mb'])))
+
+        top_allocations = report['top_allocations']
+        if top_allocations is not None:
+            print()
+            bcPrint("Top allocations at {!r} with {:.2f} MB:".format(
+                top_allocations['stage'], top_allocations['traced_mb']))
+            for site in top_allocations['sites'][:10]:
+                print("{:>10.2f} MB {:>8} {} ({})".format(
+                    site['size_mb'], site['count'], site['site'],
+                    site['caller']))
+        print()
+
+    def __get_report(self):
+        return {
+            'filepath': self.__filepath,
+            'summary': [{'path': path, 'count': count, 'seconds': total}
+                        for path, (count, total)
+                        in self.get_summary().items()],
+            'events': sorted(self.__events,
+                             key=lambda event: event['start']),
+        }
+
+    def __get_trace(self):
+        # Chrome trace_event format, opened with chrome://tracing.
+        threads = {}
+        trace_events = []
+        for event in sorted(self.__events, key=lambda event: event['start']):
+            thread_id = threads.setdefault(event['thread'], len(threads))
+            trace_events.append({
+                'name': event['name'],
+                'cat': event['path'].split("/", 1)[0],
+                'ph': 'X',
+                'ts': event['start'] * 1000000.0,
+                'dur': event['duration'] * 1000000.0,
+                'pid': 1,
+                'tid': thread_id,
+                'args': dict(event['args'], path=event['path']),
+            })
+
+        for thread_name, thread_id in threads.items():
+            trace_events.append({'name': 'thread_name', 'ph': 'M',
+                                 'pid': 1, 'tid': thread_id,
+                                 'args': {'name': thread_name}})
+
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def __write(self, filepath, data):
+        try:
+            with open(filepath, 'w') as f:
+                json.dump(data, f, indent=1)
+            bcPrint("Export report has been written to {}.".format(filepath))
+        except OSError:
+            bcPrint("[IO] can not write: {}".format(filepath), 'error')
+
+
+def get_rss():
+    '''Returns the resident set size and its high water mark in MB, or
+    None for both where /proc is not available.
+    '''
+    rss, rss_peak = None, None
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) / 1024.0
+                elif line.startswith('VmHWM:'):
+                    rss_peak = int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+
+    return rss, rss_peak
+
+
+def get_difference(value, start_value):
+    if value is None or start_value is None:
+        return None
+
+    return value - start_value
+
+
+def get_max(value, other_value):
+    if value is None:
+        return other_value
+    if other_value is None:
+        return value
+
+    return max(value, other_value)
+
+
+def get_frame_name(frame):
+    return "{}:{}".format(frame.filename, frame.lineno)
+
+
+def format_megabytes(value):
+    if value is None:
+        return "-"
+
+    return "{:.2f}".format(value)
+
+
+__current_timer = None
+
+
+@contextmanager
+def export_timer(filepath, timings=True, memory=False):
+    '''Makes an ExportTimer the target of stage() during the export. Timings
+    are reported when the block and every conversion holding it have
+    finished, memory is traced only while the block runs.
+    '''
+    global __current_timer
+
+    if not timings and not memory:
+        yield None
+        return
+
+    timer = ExportTimer(filepath, timings, memory)
+    timer.hold()
+    __current_timer = timer
+    try:
+        yield timer
+    finally:
+        __current_timer = None
+        timer.stop_memory()
+        timer.release()
+
+
+def get_current_timer():
+    return __current_timer
+
+
+@contextmanager
+def stage(name, **args):
+    '''Times a stage of the current export, does nothing without one.'''
+    timer = __current_timer
+    if timer is None:
+        yield
+        return
+
+    with timer.stage(name, **args):
+        yield
@@ -19,12 +19,16 @@ if "bpy" in locals():
     import imp
     imp.reload(material_utils)
     imp.reload(exceptions)
+    imp.reload(udp)
 else:
     import bpy
-    from io_bcry_exporter import material_utils, exceptions
+    from io_bcry_exporter import material_utils, exceptions, udp
 
 
 from io_bcry_exporter.outpipe import bcPrint
+from array import array
+from collections import namedtuple
+from contextlib import contextmanager
 from mathutils import Matrix, Vector
 from xml.dom.minidom import Document, parseString
 import bpy
@@ -39,10 +43,30 @@ import xml.dom.minidom
 import time
 import bmesh
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 # Globals:
 to_degrees = 180.0 / math.pi
 
+# Shared factory for detached DOM nodes.
+__node_factory = Document()
+
+# Names of the only export nodes to process, None processes all of them.
+__export_node_filter = None
+
+# Benchmarks turn bulk extraction off to measure the per element code.
+__bulk_extraction = True
+
+# Benchmarks turn action sampling off to evaluate the scene on every frame.
+__action_sampling = True
+
+# Scene snapshot used while an export is running, see scene_index.
+__scene_index = None
+
 
 #------------------------------------------------------------------------------
 # Conversions:
@@ -52,13 +76,29 @@ def transform_bone_matrix(bone):
     if not bone.parent:
         return Matrix()
 
+    return __transform_bone_axes(bone.x_axis, bone.y_axis, bone.z_axis,
+                                 bone.matrix.translation)
+
+
+def transform_rest_bone_matrix(bone):
+    '''transform_bone_matrix of the pose bone in rest pose, taken from
+    the armature bone.
+    '''
+    if not bone.parent:
+        return Matrix()
+
+    return __transform_bone_axes(bone.x_axis, bone.y_axis, bone.z_axis,
+                                 bone.matrix_local.translation)
+
+
+def __transform_bone_axes(bone_x_axis, bone_y_axis, bone_z_axis, translation):
     i1 = Vector((1.0, 0.0, 0.0))
     i2 = Vector((0.0, 1.0, 0.0))
     i3 = Vector((0.0, 0.0, 1.0))
 
-    x_axis = bone.y_axis
-    y_axis = bone.x_axis
-    z_axis = -bone.z_axis
+    x_axis = bone_y_axis
+    y_axis = bone_x_axis
+    z_axis = -bone_z_axis
 
     row_x = Vector((x_axis * i1, x_axis * i2, x_axis * i3))
     row_y = Vector((y_axis * i1, y_axis * i2, y_axis * i3))
@@ -66,7 +106,7 @@ def transform_bone_matrix(bone):
 
     trans_matrix = Matrix((row_x, row_y, row_z))
 
-    location = trans_matrix * bone.matrix.translation
+    location = trans_matrix * translation
     bone_matrix = trans_matrix.to_4x4()
     bone_matrix.translation = -location
 
@@ -86,9 +126,21 @@ def transform_animation_matrix(matrix):
 
 
 def frame_to_time(frame):
-    fps_base = bpy.context.scene.render.fps_base
-    fps = bpy.context.scene.render.fps
-    return fps_base * frame / fps
+    return frame * get_time_scale()
+
+
+def frames_to_times(frames):
+    '''Converts a sequence of frames to seconds with a single scale.'''
+    time_scale = get_time_scale()
+    if numpy is not None:
+        return numpy.asarray(frames, dtype=numpy.float64) * time_scale
+
+    return [frame * time_scale for frame in frames]
+
+
+def get_time_scale():
+    render = bpy.context.scene.render
+    return render.fps_base / render.fps
 
 
 def matrix_to_string(matrix):
@@ -96,7 +148,13 @@ def matrix_to_string(matrix):
 
 
 def floats_to_string(floats, separator=" ", precision="%.6f"):
-    return separator.join(precision % x for x in floats)
+    if numpy is not None and isinstance(floats, numpy.ndarray):
+        floats = floats.ravel().tolist()
+    return separator.join(map(precision.__mod__, floats))
+
+
+def ints_to_string(ints, separator=" "):
+    return separator.join(map(str, ints))
 
 
 def strings_to_string(strings, separator=" "):
@@ -112,10 +170,9 @@ def matrix_to_array(matrix):
 
 
 def write_matrix(matrix, node):
-    doc = Document()
     for row in matrix:
         row_string = floats_to_string(row)
-        node.appendChild(doc.createTextNode(row_string))
+        node.appendChild(__node_factory.createTextNode(row_string))
 
 
 def join(*items):
@@ -159,95 +216,325 @@ def get_geometry_name(group, object_):
         return "{}_{}_geometry".format(node_name, object_.name)
 
 
-def get_bmesh(object_, apply_modifiers=False):
-    set_active(object_)
+def get_evaluated_mesh(object_, apply_modifiers=False):
+    '''Returns a temporary mesh of the object, which has to be freed with
+    clear_bmesh or passed on to get_bmesh.
+    '''
+    return object_.to_mesh(bpy.context.scene, apply_modifiers, 'PREVIEW')
 
-    # bmesh may be gotten only in edit mode for active object.
-    # Unfortunately Blender goes in edit mode just objects
-    # in which first layer with bpy.ops.object.mode_set(mode='EDIT')
-    # So we must temporarily activate first layer for objects which it is not
-    # already in first layer. Also scene first layer must be active.
-    # That lacking related with Blender, if it will fix in future that
-    # code will be clean.
 
-    scene_first_layer = bpy.context.scene.layers[0]
-    bpy.context.scene.layers[0] = True
+def get_bmesh(object_, apply_modifiers=False, mesh=None):
+    '''Returns a bmesh and the evaluated mesh it was built from. Neither
+    the active object, layers, modes nor the object data are changed.
+    Both have to be freed with clear_bmesh.
+    '''
+    if mesh is None:
+        mesh = get_evaluated_mesh(object_, apply_modifiers)
 
-    layer_state = not object_.layers[0]
-    if layer_state:
-        object_.layers[0] = True
+    bmesh_ = bmesh.new()
+    bmesh_.from_mesh(mesh)
 
-    bcry_split_modifier(object_)
+    # Auto smooth edges are split like an edge split modifier at the end
+    # of the stack, and written back so the mesh arrays match the bmesh.
+    if apply_modifiers and object_.data.use_auto_smooth:
+        split_edges(bmesh_, object_.data.auto_smooth_angle)
+        bmesh_.to_mesh(mesh)
 
-    backup_data = object_.data
-    object_.data = object_.to_mesh(
-        bpy.context.scene, apply_modifiers, 'PREVIEW')
+    return bmesh_, mesh
 
-    bpy.ops.object.mode_set(mode='EDIT')
 
-    bmesh_ = bmesh.from_edit_mesh(object_.data)
-    backup_info = (backup_data, layer_state, scene_first_layer)
+def clear_bmesh(bmesh_, mesh):
+    if bmesh_ is not None:
+        bmesh_.free()
+    bpy.data.meshes.remove(mesh)
 
-    return bmesh_, backup_info
 
+def split_edges(bmesh_, split_angle):
+    edges = []
+    for edge in bmesh_.edges:
+        if not edge.smooth:
+            edges.append(edge)
+        elif len(edge.link_faces) == 2 and \
+                edge.calc_face_angle() > split_angle:
+            edges.append(edge)
 
-def clear_bmesh(object_, backup_info):
-    backup_data = backup_info[0]
-    layer_state = backup_info[1]
-    scene_first_layer = backup_info[2]
+    bmesh.ops.split_edges(bmesh_, edges=edges)
 
-    bpy.ops.object.mode_set(mode='OBJECT')
+    bmesh_.verts.index_update()
+    bmesh_.edges.index_update()
+    bmesh_.faces.index_update()
+    bmesh_.normal_update()
+
+
+def is_bulk_extraction_available():
+    '''Bulk extraction needs numpy, which ships with Blender builds.'''
+    return numpy is not None and __bulk_extraction
+
+
+def set_bulk_extraction(enabled):
+    global __bulk_extraction
+    __bulk_extraction = enabled
+
+
+def set_action_sampling(enabled):
+    global __action_sampling
+    __action_sampling = enabled
 
-    bpy.context.scene.layers[0] = scene_first_layer
 
-    if layer_state:
-        object_.layers[0] = False
+def get_mesh_array(collection, attribute, dtype, size=1):
+    '''Reads one attribute of a mesh collection into a flat array.'''
+    values = numpy.empty(len(collection) * size, dtype=dtype)
+    collection.foreach_get(attribute, values)
 
-    export_data = object_.data
-    object_.data = backup_data
-    remove_bcry_split_modifier(object_)
-    bpy.data.meshes.remove(export_data)
+    return values
 
 
-def bcry_split_modifier(object_):
-    if object_.data.use_auto_smooth:
-        modifier_unique_name = 'BCRY_EDGE_SPLIT'
+def get_vertex_positions(mesh):
+    '''Returns flat XYZ array of mesh vertex coordinates.'''
+    return get_mesh_array(mesh.vertices, "co", numpy.float32, 3)
 
-        object_.modifiers.new(modifier_unique_name, 'EDGE_SPLIT')
-        edge_split_modifier = object_.modifiers.get(modifier_unique_name)
-        edge_split_modifier.use_edge_angle = True
-        edge_split_modifier.use_edge_sharp = True
-        edge_split_modifier.split_angle = object_.data.auto_smooth_angle
 
-        object_.data.use_auto_smooth = False
+def get_loop_uvs(mesh):
+    '''Returns flat ST array of active UV layer in loop order.
+    Mesh without a UV map gets a zero filled array like a new UV layer.
+    '''
+    uvs = numpy.zeros(len(mesh.loops) * 2, dtype=numpy.float32)
+    uv_layer = mesh.uv_layers.active
+    if uv_layer is not None:
+        uv_layer.data.foreach_get("uv", uvs)
 
+    return uvs
 
-def remove_bcry_split_modifier(object_):
-    modifier_unique_name = 'BCRY_EDGE_SPLIT'
 
-    edge_split_modifier = object_.modifiers.get(modifier_unique_name)
-    if edge_split_modifier:
-        object_.data.use_auto_smooth = True
-        object_.modifiers.remove(edge_split_modifier)
+def get_vertex_colors(mesh, alpha=False):
+    '''Returns flat RGB (or RGBA when alpha) array of active vertex color
+    layer, one color per vertex taken from its first loop.
+    '''
+    color_layer = mesh.vertex_colors.active
+    vertex_count = len(mesh.vertices)
+    loop_count = len(mesh.loops)
 
+    channels = 3
+    if loop_count:
+        channels = len(color_layer.data[0].color)
+    loop_colors = numpy.empty(loop_count * channels, dtype=numpy.float32)
+    color_layer.data.foreach_get("color", loop_colors)
+    loop_colors = loop_colors.reshape(loop_count, channels)[:, :3]
 
-def get_tessfaces(bmesh_):
-    tessfaces = []
-    tfs = bmesh_.calc_tessface()
+    loop_vertices = get_mesh_array(mesh.loops, "vertex_index", numpy.int32)
 
+    colors = numpy.ones((vertex_count, 3), dtype=numpy.float32)
+    vertices, first_loops = numpy.unique(loop_vertices, return_index=True)
+    colors[vertices] = loop_colors[first_loops]
+
+    if alpha:
+        alpha_colors = numpy.ones((vertex_count, 4), dtype=numpy.float32)
+        alpha_colors[:, 3] = colors.mean(axis=1)
+        colors = alpha_colors
+
+    return colors.ravel()
+
+
+def get_triangle_indices(bmesh_, vertex_colors=False):
+    '''Returns a dictionary of flat <p> index arrays keyed by material index.
+    Each triangle corner holds vertex, normal and uv indices, and also
+    a color index when vertex colors are exported.
+    '''
+    # Normals and UVs are written per face corner in face order.
+    corner = 0
     for face in bmesh_.faces:
-        # initialize tessfaces array
-        tessfaces.append([])
+        for loop in face.loops:
+            loop.index = corner
+            corner += 1
+
+    triangle_indices = {}
+    for triangle in bmesh_.calc_tessface():
+        material_index = triangle[0].face.material_index
+        indices = triangle_indices.get(material_index)
+        if indices is None:
+            indices = array('I')
+            triangle_indices[material_index] = indices
+
+        for loop in triangle:
+            vert = loop.vert.index
+            if vertex_colors:
+                indices.extend((vert, loop.index, loop.index, vert))
+            else:
+                indices.extend((vert, loop.index, loop.index))
+
+    return triangle_indices
+
+
+def calc_split_normals(mesh, use_edge_angle, use_edge_sharp, split_angle):
+    '''Returns flat XYZ array of area weighted split normals in face corner
+    order. It is the array version of get_normal_array:
+    face normals, areas and vertex-face adjacency are computed once and
+    every corner is smoothed with the faces around its vertex.
+    '''
+    poly_count = len(mesh.polygons)
+    edge_count = len(mesh.edges)
+
+    # Buffers match the raw RNA types, so foreach_get copies them at once.
+    # Computation is done in double precision and 64 bit indices.
+    poly_normals = get_mesh_array(
+        mesh.polygons, "normal", numpy.float32, 3).reshape(poly_count, 3)
+    poly_normals = poly_normals.astype(numpy.float64)
+    lengths = numpy.linalg.norm(poly_normals, axis=1)
+    lengths[lengths == 0.0] = 1.0
+    poly_normals /= lengths[:, None]
+    poly_areas = get_mesh_array(mesh.polygons, "area", numpy.float32)
+    poly_areas = poly_areas.astype(numpy.float64)
+    poly_smooth = get_mesh_array(mesh.polygons, "use_smooth",
+                                 numpy.int32).astype(numpy.bool_)
+    loop_starts = get_mesh_array(mesh.polygons, "loop_start",
+                                 numpy.int32).astype(numpy.int64)
+    loop_totals = get_mesh_array(mesh.polygons, "loop_total",
+                                 numpy.int32).astype(numpy.int64)
+    loop_verts = get_mesh_array(mesh.loops, "vertex_index",
+                                numpy.int32).astype(numpy.int64)
+    loop_edges = get_mesh_array(mesh.loops, "edge_index",
+                                numpy.int32).astype(numpy.int64)
+    edge_sharp = get_mesh_array(mesh.edges, "use_edge_sharp",
+                                numpy.int32).astype(numpy.bool_)
+
+    # Face corners in face order, and their previous corners in the face.
+    corner_faces = numpy.repeat(numpy.arange(poly_count), loop_totals)
+    corner_starts = numpy.cumsum(loop_totals) - loop_totals
+    corner_offsets = numpy.arange(len(corner_faces)) - \
+        corner_starts[corner_faces]
+    corner_loops = loop_starts[corner_faces] + corner_offsets
+    previous_offsets = (corner_offsets - 1) % loop_totals[corner_faces]
+    previous_loops = loop_starts[corner_faces] + previous_offsets
+    corner_verts = loop_verts[corner_loops]
+
+    normals = poly_normals[corner_faces].copy()
+
+    # Vertex-face pairs sorted by vertex, each keeping one of its corners.
+    pair_keys, pair_corners = numpy.unique(
+        corner_verts * poly_count + corner_faces, return_index=True)
+    pair_verts = pair_keys // poly_count
+    pair_faces = pair_keys % poly_count
+    pair_edges = numpy.stack((loop_edges[corner_loops[pair_corners]],
+                              loop_edges[previous_loops[pair_corners]]), 1)
+    vert_starts = numpy.searchsorted(pair_verts, corner_verts)
+    vert_valences = numpy.searchsorted(
+        pair_verts, corner_verts, side='right') - vert_starts
+
+    smooth_corners = numpy.flatnonzero(poly_smooth[corner_faces])
+    if len(smooth_corners) == 0:
+        return normals.ravel()
+
+    # Expand every smooth corner to all faces linked to its vertex.
+    counts = vert_valences[smooth_corners]
+    link_corners = numpy.repeat(smooth_corners, counts)
+    link_offsets = numpy.arange(counts.sum()) - \
+        numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    link_pairs = vert_starts[link_corners] + link_offsets
+    link_faces = pair_faces[link_pairs]
+    faces = corner_faces[link_corners]
+
+    included = poly_smooth[link_faces].copy()
+
+    if use_edge_angle:
+        cosines = numpy.einsum('ij,ij->i', poly_normals[faces],
+                               poly_normals[link_faces])
+        angles = numpy.arccos(numpy.clip(cosines, -1.0, 1.0))
+        included &= angles < split_angle
+
+    if use_edge_sharp:
+        # Faces sharing an edge around the vertex are smoothed through that
+        # edge, other faces have to be reachable along smooth edges.
+        corner_edges = numpy.stack((loop_edges[corner_loops[link_corners]],
+                                    loop_edges[previous_loops[link_corners]]),
+                                   1)
+        link_edges = pair_edges[link_pairs]
+        shared = corner_edges[:, :, None] == link_edges[:, None, :]
+        shared = shared.any(axis=2)
+        shared_smooth = shared & ~edge_sharp[corner_edges]
+
+        # Others are found walking around the vertex like check_sharp_edges.
+        walked = included & ~shared.any(axis=1)
+        own_pairs = numpy.searchsorted(
+            pair_keys, corner_verts[link_corners] * poly_count + faces)
+        first_slots = (corner_offsets[pair_corners] != 0).astype(numpy.int64)
+        reached = numpy.zeros(len(link_pairs), dtype=numpy.bool_)
+        reached[walked] = walk_smooth_fans(
+            pair_verts, pair_edges, first_slots, edge_sharp, edge_count,
+            own_pairs[walked], link_pairs[walked])
+
+        included &= numpy.where(shared.any(axis=1),
+                                shared_smooth.any(axis=1), reached)
+
+    included |= link_faces == faces
+
+    weights = poly_areas[link_faces] * included
+    sums = numpy.empty((len(smooth_corners), 3))
+    local_corners = numpy.repeat(numpy.arange(len(smooth_corners)), counts)
+    for axis in range(3):
+        sums[:, axis] = numpy.bincount(
+            local_corners,
+            weights=poly_normals[link_faces, axis] * weights,
+            minlength=len(smooth_corners))
+
+    lengths = numpy.linalg.norm(sums, axis=1)
+    valid = lengths > 0.0
+    sums[valid] /= lengths[valid, None]
+    sums[~valid] = 0.0
+    normals[smooth_corners] = sums
+
+    return normals.ravel()
+
+
+def walk_smooth_fans(pair_verts, pair_edges, first_slots, edge_sharp,
+                     edge_count, starts, targets):
+    '''Walks around vertices from start to target vertex-face pairs through
+    smooth edges, all walks at once. Like check_sharp_edges a walk takes
+    the first smooth edge of the start face and keeps that direction.
+    '''
+    pair_count = len(pair_verts)
+
+    # Incidence is slot * pair_count + pair, slot 0 is the edge leaving
+    # the vertex and slot 1 the edge coming to it. Incidences on the same
+    # edge around the same vertex are linked to each other.
+    incidences = numpy.arange(pair_count * 2)
+    edges = pair_edges.T.ravel()
+    keys = numpy.concatenate((pair_verts, pair_verts)) * edge_count + edges
+    order = numpy.argsort(keys, kind='mergesort')
+    sorted_keys = keys[order]
+    positions = numpy.arange(len(order))
+    following = numpy.minimum(positions + 1, len(order) - 1)
+    same = (positions + 1 < len(order)) & \
+        (sorted_keys[following] == sorted_keys)
+    following = numpy.where(
+        same, following, numpy.searchsorted(sorted_keys, sorted_keys))
+
+    across = numpy.empty(pair_count * 2, dtype=numpy.int64)
+    across[order] = order[following]
+    across[(across == incidences) | edge_sharp[edges]] = -1
+
+    first_slots = first_slots[starts]
+    slots = numpy.where(across[first_slots * pair_count + starts] != -1,
+                        first_slots, 1 - first_slots)
+    states = slots * pair_count + starts
+
+    reached = numpy.zeros(len(starts), dtype=numpy.bool_)
+    active = numpy.arange(len(starts))
+    for step in range(pair_count):
+        exits = across[states]
+        moving = exits != -1
+        active, exits = active[moving], exits[moving]
+        if len(active) == 0:
+            break
 
-    for tf in tfs:
-        vert_list = []
-        for loop in tf:
-            # tessfaces[loop.face.index].append(loop.vert.index)
-            vert_list.append(loop.vert.index)
+        pairs = exits % pair_count
+        found = pairs == targets[active]
+        reached[active[found]] = True
+        active, exits = active[~found], exits[~found]
 
-        tessfaces[tf[0].face.index].append(vert_list)
+        # Leave the next face through its other edge around the vertex.
+        states = (exits + pair_count) % (pair_count * 2)
 
-    return tessfaces
+    return reached
 
 
 def get_custom_normals(bmesh_, use_edge_angle, split_angle):
@@ -592,15 +879,128 @@ def fix_weights():
 # Collections:
 #------------------------------------------------------------------------------
 
+class SceneIndex:
+    '''Snapshot of the export nodes, their objects and the parent relations
+    inside each node. It is only valid while the scene is not changed.
+    '''
+
+    def __init__(self, export_nodes, selected_nodes):
+        self.export_nodes = export_nodes
+        self.selected_nodes = selected_nodes
+        self.nodes_by_types = {}
+        self.object_groups = {}
+        self.group_objects = {}
+        self.group_children = {}
+        self.types = {}
+        self.parent_relations = {}
+
+        node_names = []
+        for node in export_nodes:
+            node_names.append(get_node_name(node))
+
+            children = {}
+            for object_ in node.objects:
+                self.object_groups.setdefault(object_.name, set()).add(
+                    node.name)
+                if object_.parent is not None:
+                    children.setdefault(object_.parent.name, []).append(
+                        object_)
+
+            self.group_objects[node.name] = set(
+                object_.name for object_ in node.objects)
+            self.group_children[node.name] = children
+
+        self.duplicate_nodes = len(set(node_names)) < len(node_names)
+
+    def get_nodes(self, node_types):
+        nodes = self.nodes_by_types.get(node_types)
+        if nodes is None:
+            nodes = [node for node in self.export_nodes
+                     if get_node_type(node) in node_types]
+            self.nodes_by_types[node_types] = nodes
+
+        return list(nodes)
+
+
+@contextmanager
+def scene_index(just_selected=False):
+    '''Answers export node and group membership queries from a snapshot
+    taken once, instead of rescanning bpy.data.groups for every query.
+    '''
+    global __scene_index
+
+    export_nodes = get_export_nodes()
+    selected_nodes = __get_selected_nodes() if just_selected else []
+    __scene_index = SceneIndex(export_nodes, selected_nodes)
+    try:
+        yield __scene_index
+    finally:
+        __scene_index = None
+
+
+def set_export_node_filter(nodes=None):
+    global __export_node_filter
+
+    if nodes is None:
+        __export_node_filter = None
+    else:
+        __export_node_filter = set(node.name for node in nodes)
+
+
+@contextmanager
+def unfiltered_export_nodes():
+    '''Lifts the export node filter for the block and yields the filter,
+    a set of node names or None.
+    '''
+    global __export_node_filter
+
+    node_filter = __export_node_filter
+    __export_node_filter = None
+    try:
+        yield node_filter
+    finally:
+        __export_node_filter = node_filter
+
+
+def get_shard_nodes(nodes, shard_index, shard_count):
+    '''Splits export nodes into shards of about the same vertex count. The
+    split only depends on the scene, so every process of a sharded export
+    computes the same shards.
+    '''
+    def get_weight(node):
+        return sum(len(object_.data.vertices) for object_ in node.objects
+                   if object_.type == 'MESH')
+
+    weighted_nodes = sorted(((get_weight(node), node.name, node)
+                             for node in nodes),
+                            key=lambda item: (-item[0], item[1]))
+
+    shard_weights = [0] * shard_count
+    shard_nodes = []
+    for weight, name, node in weighted_nodes:
+        index = shard_weights.index(min(shard_weights))
+        shard_weights[index] += max(weight, 1)
+        if index == shard_index:
+            shard_nodes.append(node)
+
+    return shard_nodes
+
+
 def get_export_nodes(just_selected=False):
     export_nodes = []
 
+    if __scene_index is not None:
+        if just_selected:
+            return list(__scene_index.selected_nodes)
+        return list(__scene_index.export_nodes)
+
     if just_selected:
         return __get_selected_nodes()
 
     for group in bpy.data.groups:
         if is_export_node(group) and len(group.objects) > 0:
-            export_nodes.append(group)
+            if __is_node_filtered(group):
+                export_nodes.append(group)
 
     return export_nodes
 
@@ -609,6 +1009,9 @@ def get_mesh_export_nodes(just_selected=False):
     export_nodes = []
 
     ALLOWED_NODE_TYPES = ('cgf', 'cga', 'chr', 'skin')
+    if __scene_index is not None and not just_selected:
+        return __scene_index.get_nodes(ALLOWED_NODE_TYPES)
+
     for node in get_export_nodes(just_selected):
         if get_node_type(node) in ALLOWED_NODE_TYPES:
             export_nodes.append(node)
@@ -648,12 +1051,16 @@ def get_animation_export_nodes(just_selected=False):
     export_nodes = []
 
     if just_selected:
-        return __get_selected_nodes()
+        return get_export_nodes(just_selected)
 
     ALLOWED_NODE_TYPES = ('anm', 'i_caf')
+    if __scene_index is not None:
+        return __scene_index.get_nodes(ALLOWED_NODE_TYPES)
+
     for group in bpy.data.groups:
         if is_export_node(group) and len(group.objects) > 0:
-            if get_node_type(group) in ALLOWED_NODE_TYPES:
+            if get_node_type(group) in ALLOWED_NODE_TYPES and \
+                    __is_node_filtered(group):
                 export_nodes.append(group)
 
     return export_nodes
@@ -665,21 +1072,34 @@ def __get_selected_nodes():
     for object in bpy.context.selected_objects:
         for group in object.users_group:
             if is_export_node(group) and group not in export_nodes:
-                export_nodes.append(group)
+                if __is_node_filtered(group):
+                    export_nodes.append(group)
 
     return export_nodes
 
 
+def __is_node_filtered(node):
+    return __export_node_filter is None or node.name in __export_node_filter
+
+
 def get_type(type_):
     dispatch = {
         "objects": __get_objects,
         "geometry": __get_geometry,
         "controllers": __get_controllers,
         "skins": __get_skins,
-        "fakebones": __get_fakebones,
         "bone_geometry": __get_bone_geometry,
     }
-    return list(set(dispatch[type_]()))
+
+    if __scene_index is None:
+        return list(set(dispatch[type_]()))
+
+    items = __scene_index.types.get(type_)
+    if items is None:
+        items = list(set(dispatch[type_]()))
+        __scene_index.types[type_] = items
+
+    return list(items)
 
 
 def __get_objects():
@@ -693,7 +1113,7 @@ def __get_objects():
 def __get_geometry():
     items = []
     for object_ in get_type("objects"):
-        if object_.type == "MESH" and not is_fakebone(object_):
+        if object_.type == "MESH":
             items.append(object_)
 
     return items
@@ -702,8 +1122,7 @@ def __get_geometry():
 def __get_controllers():
     items = []
     for object_ in get_type("objects"):
-        if not (is_bone_geometry(object_) or
-                is_fakebone(object_)):
+        if not is_bone_geometry(object_):
             if object_.parent is not None:
                 if object_.parent.type == "ARMATURE":
                     items.append(object_.parent)
@@ -715,8 +1134,7 @@ def __get_skins():
     items = []
     for object_ in get_type("objects"):
         if object_.type == "MESH":
-            if not (is_bone_geometry(object_) or
-                    is_fakebone(object_)):
+            if not is_bone_geometry(object_):
                 if object_.parent is not None:
                     if object_.parent.type == "ARMATURE":
                         items.append(object_)
@@ -724,15 +1142,6 @@ def __get_skins():
     return items
 
 
-def __get_fakebones():
-    items = []
-    for object_ in bpy.data.objects:
-        if is_fakebone(object_):
-            items.append(object_)
-
-    return items
-
-
 def __get_bone_geometry():
     items = []
     for object_ in get_type("objects"):
@@ -756,6 +1165,9 @@ def is_export_node(node):
 
 
 def are_duplicate_nodes():
+    if __scene_index is not None:
+        return __scene_index.duplicate_nodes
+
     node_names = []
     for group in get_export_nodes():
         node_names.append(get_node_name(group))
@@ -784,6 +1196,19 @@ def is_visual_scene_node_writed(object_, group):
 
 
 def is_there_a_parent_releation(object_, group):
+    if __scene_index is not None:
+        key = (object_.name, group.name)
+        relation = __scene_index.parent_relations.get(key)
+        if relation is None:
+            relation = __find_parent_releation(object_, group)
+            __scene_index.parent_relations[key] = relation
+
+        return relation
+
+    return __find_parent_releation(object_, group)
+
+
+def __find_parent_releation(object_, group):
     while object_.parent:
         if is_object_in_group(
                 object_.parent,
@@ -798,6 +1223,11 @@ def is_there_a_parent_releation(object_, group):
 
 
 def is_object_in_group(object_, group):
+    if __scene_index is not None:
+        objects = __scene_index.group_objects.get(group.name)
+        if objects is not None:
+            return object_.name in objects
+
     for obj in group.objects:
         if object_.name == obj.name:
             return True
@@ -805,165 +1235,236 @@ def is_object_in_group(object_, group):
     return False
 
 
+def get_children_in_group(object_, group):
+    if __scene_index is not None:
+        children = __scene_index.group_children.get(group.name)
+        if children is not None:
+            return children.get(object_.name, [])
+
+    return [child for child in object_.children
+            if is_object_in_group(child, group)]
+
+
 def is_dummy(object_):
     return object_.type == 'EMPTY'
 
 
 #------------------------------------------------------------------------------
-# Fakebones:
+# Animation and Keyframing:
 #------------------------------------------------------------------------------
 
-
-def get_fakebone(bone_name):
-    return next((fakebone for fakebone in get_type("fakebones")
-                 if fakebone.name == bone_name), None)
-
-
-def is_fakebone(object_):
-    if object_.get("fakebone") is not None:
-        return True
-    else:
-        return False
-
-
-def add_fakebones(group=None):
-    '''Add helpers to track bone transforms.'''
+def sample_bone_animation(armature, frame_start, frame_end):
+    '''Evaluates the pose once per frame and returns the CryEngine space
+    location and euler rotation of every pose bone, keyed by bone name as
+    (locations, rotations) per axis lists of the frames.
+    '''
     scene = bpy.context.scene
-    remove_unused_meshes()
-
-    if group:
-        for object_ in group.objects:
-            if object_.type == 'ARMATURE':
-                armature = object_
-    else:
-        armature = get_armature()
-
-    if armature is None:
-        return
-
     skeleton = armature.data
+    pose_bones = armature.pose.bones
+    frames = range(frame_start, frame_end + 1)
 
-    skeleton.pose_position = 'REST'
-    time.sleep(0.5)
-
-    scene.frame_set(scene.frame_start)
-    for pose_bone in armature.pose.bones:
-        bone_matrix = transform_bone_matrix(pose_bone)
-        loc, rot, scl = bone_matrix.decompose()
-
-        bpy.ops.mesh.primitive_cube_add(radius=.01)
-        fakebone = bpy.context.active_object
-        fakebone.matrix_world = bone_matrix
-        fakebone.scale = (1, 1, 1)
-        fakebone.name = pose_bone.name
-        fakebone["fakebone"] = "fakebone"
-        scene.objects.active = armature
-        armature.data.bones.active = pose_bone.bone
-        bpy.ops.object.parent_set(type='BONE_RELATIVE')
-
-        if group:
-            group.objects.link(fakebone)
-
-    if group:
-        if get_node_type(group) == 'i_caf':
-            process_animation(armature, skeleton)
-
-
-def remove_fakebones():
-    '''Select to remove all fakebones from the scene.'''
-    if len(get_type("fakebones")) == 0:
-        return
-    old_mode = bpy.context.mode
-    if old_mode != 'OBJECT':
-        bpy.ops.object.mode_set(mode='OBJECT')
-    deselect_all()
-    for fakebone in get_type("fakebones"):
-        fakebone.select = True
-        bpy.ops.object.delete(use_global=False)
-    if old_mode != 'OBJECT':
-        bpy.ops.object.mode_set(mode=old_mode)
-
-
-#------------------------------------------------------------------------------
-# Animation and Keyframing:
-#------------------------------------------------------------------------------
-
-def process_animation(armature, skeleton):
-    '''Process animation to export.'''
+    initial_frame = scene.frame_current
+    pose_position = skeleton.pose_position
     skeleton.pose_position = 'POSE'
-    time.sleep(0.5)
-
-    location_list, rotation_list = get_keyframes(armature)
-    set_keyframes(armature, location_list, rotation_list)
-
-
-def get_keyframes(armature):
-    '''Get each bone location and rotation for each frame.'''
-    location_list = []
-    rotation_list = []
-
-    for frame in range(
-            bpy.context.scene.frame_start,
-            bpy.context.scene.frame_end + 1):
-        bpy.context.scene.frame_set(frame)
-
-        locations = {}
-        rotations = {}
-
-        for bone in armature.pose.bones:
-            bone_matrix = transform_animation_matrix(bone.matrix)
-            if bone.parent and bone.parent.parent:
-                parent_matrix = transform_animation_matrix(bone.parent.matrix)
-                bone_matrix = parent_matrix.inverted() * bone_matrix
-            elif bone.name == 'Locator_Locomotion':
-                bone_matrix = bone.matrix
-            elif not bone.parent:
-                bone_matrix = Matrix()
-
-            loc, rot, scl = bone_matrix.decompose()
-
-            locations[bone.name] = loc
-            rotations[bone.name] = rot.to_euler()
-
-        location_list.append(locations.copy())
-        rotation_list.append(rotations.copy())
-
-        del locations
-        del rotations
-
-    bcPrint("Keyframes have been appended to lists.")
+    set_frame = __get_pose_frame_setter(armature, scene)
+
+    if is_bulk_extraction_available():
+        matrices = numpy.empty((len(frames), len(pose_bones), 4, 4))
+        for index, frame in enumerate(frames):
+            set_frame(frame)
+            # Blender matrices are stored column by column.
+            matrices[index] = get_mesh_array(
+                pose_bones, "matrix", numpy.float32, 16).reshape(
+                len(pose_bones), 4, 4).transpose(0, 2, 1)
+
+        locations, rotations = __transform_animation_matrices(
+            matrices, pose_bones)
+        locations = locations.tolist()
+        rotations = rotations.tolist()
+    else:
+        locations = []
+        rotations = []
+        for frame in frames:
+            set_frame(frame)
+            frame_locations = []
+            frame_rotations = []
+            for pose_bone in pose_bones:
+                loc, rot, scl = __get_animation_bone_matrix(
+                    pose_bone).decompose()
+                frame_locations.append(loc)
+                frame_rotations.append(rot.to_euler())
+            locations.append(frame_locations)
+            rotations.append(frame_rotations)
+
+    skeleton.pose_position = pose_position
+    scene.frame_set(initial_frame)
+
+    channels = {}
+    for bone_index, pose_bone in enumerate(pose_bones):
+        channels[pose_bone.name] = (
+            [[frame_values[bone_index][axis] for frame_values in locations]
+             for axis in range(3)],
+            [[frame_values[bone_index][axis] for frame_values in rotations]
+             for axis in range(3)])
+
+    bcPrint("{} frames of {} bones have been sampled.".format(
+        len(frames), len(pose_bones)))
+
+    return channels
+
+
+def __get_pose_frame_setter(armature, scene):
+    '''Returns a function which poses the armature at a frame. Blender 2.7x
+    can only evaluate the animation of the whole scene, with frame_set.
+    When the pose depends on nothing but the action of the armature, its
+    curves are written to the pose bones instead and scene.update then
+    evaluates only the armature.
+    '''
+    channels = __get_action_channels(armature) if __action_sampling \
+        else None
+    if channels is None:
+        bcPrint("Pose of {!r} depends on more than its action, the scene is "
+                "evaluated for every frame.".format(armature.name))
+        return scene.frame_set
+
+    def set_frame(frame):
+        for owner, name, index, curve in channels:
+            value = curve.evaluate(frame)
+            if index is None:
+                setattr(owner, name, value)
+            else:
+                getattr(owner, name)[index] = value
+        scene.update()
 
-    return location_list, rotation_list
+    return set_frame
 
 
-def set_keyframes(armature, location_list, rotation_list):
-    '''Insert each keyframe from lists.'''
+def __get_action_channels(armature):
+    # Returns (owner, property name, array index, fcurve) of every curve of
+    # the action, or None when NLA, drivers, custom properties or other
+    # objects take part in the pose.
+    animation_data = armature.animation_data
+    if animation_data is None or animation_data.action is None:
+        return None
+    if len(animation_data.nla_tracks) or len(animation_data.drivers):
+        return None
 
-    bpy.context.scene.frame_set(bpy.context.scene.frame_start)
+    for pose_bone in armature.pose.bones:
+        for constraint in pose_bone.constraints:
+            targets = [getattr(constraint, 'target', None)]
+            targets.extend(target.target for target
+                           in getattr(constraint, 'targets', ()))
+            if any(target is not None and target != armature
+                   for target in targets):
+                return None
+
+    channels = []
+    for curve in animation_data.action.fcurves:
+        if curve.mute:
+            continue
+
+        owner_path, separator, name = curve.data_path.rpartition('.')
+        if not name.isidentifier():
+            return None
+        try:
+            owner = armature.path_resolve(owner_path) if owner_path \
+                else armature
+        except ValueError:
+            return None
+
+        property_ = owner.bl_rna.properties.get(name)
+        if property_ is None:
+            return None
+        index = None
+        if getattr(property_, 'array_length', 0) > 0:
+            index = curve.array_index
+        channels.append((owner, name, index, curve))
+
+    return channels
+
+
+def __get_animation_bone_matrix(pose_bone):
+    if pose_bone.parent and pose_bone.parent.parent:
+        parent_matrix = transform_animation_matrix(pose_bone.parent.matrix)
+        return parent_matrix.inverted() * transform_animation_matrix(
+            pose_bone.matrix)
+    elif pose_bone.name == 'Locator_Locomotion':
+        return pose_bone.matrix
+    elif not pose_bone.parent:
+        return Matrix()
 
-    for frame in range(
-            bpy.context.scene.frame_start,
-            bpy.context.scene.frame_end + 1):
-        set_keyframe(armature, frame, location_list, rotation_list)
+    return transform_animation_matrix(pose_bone.matrix)
+
+
+def __transform_animation_matrices(matrices, pose_bones):
+    '''Array version of __get_animation_bone_matrix and decompose for
+    frames x bones x 4 x 4 pose matrices.
+    '''
+    rotations = matrices[:, :, :3, :3]
+    rotations = rotations / numpy.linalg.norm(rotations, axis=2,
+                                              keepdims=True)
+    translations = matrices[:, :, :3, 3]
+
+    # transform_animation_matrix: rotate around local Z by 90 degrees,
+    # then around local X by 180 degrees.
+    axis_swap = numpy.array(((0.0, 1.0, 0.0),
+                             (1.0, 0.0, 0.0),
+                             (0.0, 0.0, -1.0)))
+    animation_rotations = numpy.matmul(rotations, axis_swap)
+
+    bone_rotations = numpy.empty_like(rotations)
+    bone_locations = numpy.empty_like(translations)
+    for index, pose_bone in enumerate(pose_bones):
+        if pose_bone.parent and pose_bone.parent.parent:
+            parent = pose_bones.find(pose_bone.parent.name)
+            inverse = animation_rotations[:, parent].transpose(0, 2, 1)
+            bone_rotations[:, index] = numpy.matmul(
+                inverse, animation_rotations[:, index])
+            bone_locations[:, index] = numpy.einsum(
+                'fij,fj->fi', inverse,
+                translations[:, index] - translations[:, parent])
+        elif pose_bone.name == 'Locator_Locomotion':
+            bone_rotations[:, index] = rotations[:, index]
+            bone_locations[:, index] = translations[:, index]
+        elif not pose_bone.parent:
+            bone_rotations[:, index] = numpy.identity(3)
+            bone_locations[:, index] = 0.0
+        else:
+            bone_rotations[:, index] = animation_rotations[:, index]
+            bone_locations[:, index] = translations[:, index]
 
-    bpy.context.scene.frame_set(bpy.context.scene.frame_start)
-    bcPrint("Keyframes have been inserted to armature fakebones.")
+    return bone_locations, matrices_to_eulers(bone_rotations)
 
 
-def set_keyframe(armature, frame, location_list, rotation_list):
-    '''Inset keyframe for current frame from lists.'''
-    bpy.context.scene.frame_set(frame)
+def matrices_to_eulers(matrices):
+    '''XYZ euler angles of an array of rotation matrices, choosing the
+    same of the two solutions as Matrix.to_euler.
+    '''
+    m00 = matrices[..., 0, 0]
+    m10 = matrices[..., 1, 0]
+    m20 = matrices[..., 2, 0]
+    m21 = matrices[..., 2, 1]
+    m22 = matrices[..., 2, 2]
+    m11 = matrices[..., 1, 1]
+    m12 = matrices[..., 1, 2]
 
-    for bone in armature.pose.bones:
-        index = frame - bpy.context.scene.frame_start
+    cy = numpy.hypot(m00, m10)
+    regular = cy > 16.0 * numpy.finfo(numpy.float32).eps
 
-        fakeBone = bpy.data.objects[bone.name]
+    eulers1 = numpy.stack((
+        numpy.where(regular, numpy.arctan2(m21, m22),
+                    numpy.arctan2(-m12, m11)),
+        numpy.arctan2(-m20, cy),
+        numpy.where(regular, numpy.arctan2(m10, m00), 0.0)), axis=-1)
+    eulers2 = numpy.stack((
+        numpy.where(regular, numpy.arctan2(-m21, -m22), eulers1[..., 0]),
+        numpy.where(regular, numpy.arctan2(-m20, -cy), eulers1[..., 1]),
+        numpy.where(regular, numpy.arctan2(-m10, -m00), 0.0)), axis=-1)
 
-        fakeBone.location = location_list[index][bone.name]
-        fakeBone.rotation_euler = rotation_list[index][bone.name]
+    use_second = (numpy.abs(eulers1).sum(axis=-1) >
+                  numpy.abs(eulers2).sum(axis=-1))
 
-        fakeBone.keyframe_insert(data_path="location")
-        fakeBone.keyframe_insert(data_path="rotation_euler")
+    return numpy.where(use_second[..., None], eulers2, eulers1)
 
 
 def apply_animation_scale(armature):
@@ -1271,6 +1772,94 @@ def get_bones(armature):
     return [bone for bone in armature.data.bones]
 
 
+# Transform of a bone as it is written for skeleton nodes.
+BoneTransform = namedtuple('BoneTransform',
+                           ('location', 'rotation_euler', 'scale'))
+
+
+def get_rest_bone_transforms(armature):
+    '''Returns the rest pose transforms of the bones, keyed by bone name,
+    as they are written for the skeleton nodes.
+    '''
+    transforms = {}
+    for bone in armature.data.bones:
+        location, rotation, scale = transform_rest_bone_matrix(
+            bone).decompose()
+        transforms[bone.name] = BoneTransform(
+            location, rotation.to_euler(), Vector((1.0, 1.0, 1.0)))
+
+    return transforms
+
+
+class SkeletonIndex:
+    '''Bone name keyed lookups of transforms, bone geometries, IK limits
+    and property names of a skeleton. Transforms are BoneTransforms
+    keyed by bone name.
+    '''
+
+    def __init__(self, bones, object_, node_name, transforms):
+        self.transforms = {}
+        self.bone_geometries = {}
+        self.ik_limits = {}
+        self.properties_names = {}
+
+        for bone in bones:
+            self.transforms[bone.name] = transforms.get(bone.name)
+            self.bone_geometries[bone.name] = get_bone_geometry(bone)
+            self.properties_names[bone.name] = get_properties_name(
+                bone.name, node_name)
+
+            if is_physic_bone(bone):
+                # Physic skeletons are named after their armature.
+                armature = bpy.data.objects[object_.name[:-5]]
+                pose_bone = armature.pose.bones[bone.name[:-5]]
+                self.ik_limits[bone.name] = (
+                    udp.get_bone_ik_max_min(pose_bone) +
+                    udp.get_bone_ik_properties(pose_bone))
+
+
+def get_properties_name(name, node_name):
+    return '%{!s}%--PRprops_name={!s}'.format(node_name,
+                                               name.replace("__", "*"))
+
+
+def get_skin_weights(object_, bones, max_influences=8):
+    '''Returns flat weight, <vcount> and <v> arrays of the object.
+    Vertex groups are mapped to bone indices once; when a vertex has more
+    than max_influences bone references the strongest ones are kept.
+    Also returns the number of vertices which exceeded the limit.
+    '''
+    bone_indices = {bone.name: index for index, bone in enumerate(bones)}
+    group_bones = [bone_indices.get(group.name)
+                   for group in object_.vertex_groups]
+
+    weights = array('f')
+    vertex_counts = array('I')
+    joint_weights = array('I')
+    capped_vertices = 0
+
+    for vertex in object_.data.vertices:
+        influences = []
+        for element in vertex.groups:
+            if element.weight == 0 or element.group >= len(group_bones):
+                continue
+            bone_index = group_bones[element.group]
+            if bone_index is not None:
+                influences.append((bone_index, element.weight))
+
+        if len(influences) > max_influences:
+            influences.sort(key=lambda influence: influence[1], reverse=True)
+            del influences[max_influences:]
+            capped_vertices += 1
+
+        vertex_counts.append(len(influences))
+        for bone_index, weight in influences:
+            joint_weights.extend((bone_index, len(weights)))
+            weights.append(weight)
+
+    return weights, vertex_counts, joint_weights, capped_vertices
+
+
 def get_animation_node_range(object_, node_name, initial_start, initial_end):
     try:
         start_frame = object_["{}_Start".format(node_name)]
@@ -1310,20 +1899,6 @@ def get_armature_from_node(group):
     return None
 
 
-def activate_all_bone_layers(armature):
-    layers = []
-    for index in range(0, 32):
-        layers.append(armature.data.layers[index])
-        armature.data.layers[index] = True
-
-    return layers
-
-
-def recover_bone_layers(armature, layers):
-    for index in range(0, 32):
-        armature.data.layers[index] = layers[index]
-
-
 #------------------------------------------------------------------------------
 # General:
 #------------------------------------------------------------------------------
@@ -1503,7 +2078,7 @@ def remove_file(filepath):
 #------------------------------------------------------------------------------
 
 def write_source(id_, type_, array, params):
-    doc = Document()
+    doc = __node_factory
     length = len(array)
     if type_ == "float4x4":
         stride = 16
@@ -1549,7 +2124,7 @@ def write_source(id_, type_, array, params):
 
 
 def write_input(name, offset, type_, semantic):
-    doc = Document()
+    doc = __node_factory
     id_ = "{!s}-{!s}".format(name, type_)
     input = doc.createElement("input")
 